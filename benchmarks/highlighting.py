@@ -0,0 +1,331 @@
+"""
+Benchmarks for syntax highlighting, both the highlighter extension and the tag pipeline of the editor.
+
+Run from the root of the repository with the highlighter extension installed:
+
+    python benchmarks/highlighting.py --output results.json
+
+The results are written as JSON, so runs on different commits can be compared.
+Every size runs in its own process, so the peak RSS reported for it is not inflated by the sizes before it.
+The tag pipeline needs GTK (pygobject), it is skipped if GTK can not be imported.
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import pathlib
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Callable
+
+# lets the benchmark import the bracket package when run as a script
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+# recognized names of the default theme, loaded without GTK so the extension can be measured on its own
+THEME = pathlib.Path(__file__).parent.parent.resolve() / "bracket" / "theme.json"
+
+# number of lines above and below the edit that are highlighted after a keystroke, like the viewport of the editor
+VIEWPORT = 100
+
+# a piece of python using most of the constructs the highlight query knows about, repeated to the requested size
+BLOCK = '''\
+@dataclass(frozen=True)
+class Point{n}(Base):
+    """a point with a docstring"""
+
+    x: int = 0
+    y: float = 1.5
+
+    def distance(self, other: "Point{n}") -> float:
+        # comment with some words in it
+        dx, dy = self.x - other.x, self.y - other.y
+        return (dx ** 2 + dy ** 2) ** 0.5
+
+    async def fetch(self, *args, **kwargs):
+        async with session.get(f"https://example.com/{{self.x}}") as response:
+            return [await item for item in response if item is not None]
+
+
+def helper_{n}(values: list[int], flag=True, name=None) -> dict[str, int]:
+    result = {{"count": len(values), "flag": int(flag)}}
+    for i, value in enumerate(values):
+        if value % 2 == 0 and not flag:
+            result[str(i)] = value
+        elif value < 0 or name is None:
+            raise ValueError("negative value " + repr(value))
+        else:
+            try:
+                result[name] += value
+            except KeyError:
+                pass
+    return lambda: result
+
+
+'''
+
+# text typed into the middle of the document, one keystroke per char
+TYPED = 'def typed(value):\n    return {"key": [value, 1, 2.0]}  # done\n'
+
+
+def recognized_names() -> list[str]:
+    with THEME.open("r") as file:
+        return list(json.load(file))
+
+
+def generate_source(lines: int) -> str:
+    """returns python source with `lines` lines"""
+    block_lines = BLOCK.count("\n")
+    text = "".join(BLOCK.format(n=n) for n in range(lines // block_lines + 1))
+    return "\n".join(text.split("\n", lines)[:lines]) + "\n"
+
+
+def peak_rss() -> int:
+    """peak resident set size of the process in bytes"""
+    # linux reports kibibytes, macos bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """percentiles of the samples, in milliseconds"""
+    ms = sorted(sample * 1000 for sample in samples)
+    if not ms:
+        return {}
+
+    def at(p: float) -> float:
+        return ms[min(int(p * len(ms)), len(ms) - 1)]
+
+    return {
+        "count": len(ms),
+        "mean": statistics.fmean(ms),
+        "p50": at(0.5),
+        "p90": at(0.9),
+        "p99": at(0.99),
+        "max": ms[-1],
+    }
+
+
+def timed[T](function: Callable[[], T]) -> tuple[T, float]:
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def bench_highlight(lines: int, repeat: int) -> dict[str, Any]:
+    """throughput of highlighting a whole document from scratch"""
+    from highlighter import Highlighter
+
+    source = generate_source(lines)
+    size = len(source.encode())
+    rss_before = peak_rss()
+
+    highlighter = Highlighter(recognized_names())
+    highlighter.set_language("python")
+
+    times: list[float] = []
+    events = 0
+    for _ in range(repeat):
+        result, elapsed = timed(lambda: highlighter.highlight(source))
+        events = len(result)
+        times.append(elapsed)
+
+    best = min(times)
+    return {
+        "lines": lines,
+        "bytes": size,
+        "events": events,
+        "seconds": percentiles(times),
+        "bytes_per_second": size / best,
+        "events_per_second": events / best,
+        "peak_rss": peak_rss(),
+        "peak_rss_growth": peak_rss() - rss_before,
+    }
+
+
+def apply_events(buffer: Any, events: list[Any]):
+    """applies highlight events to a buffer tag by tag, the way the editor did before the spans were packed"""
+    from highlighter import HLEvent
+
+    tag: str | None = None
+    buffer.remove_all_tags(*buffer.get_bounds())
+    for event in events:
+        match event:
+            case HLEvent.Start():
+                (tag,) = event
+            case HLEvent.Source():
+                (start, end) = event
+                if tag:
+                    buffer.apply_tag_by_name(tag, buffer.get_iter_at_offset(start), buffer.get_iter_at_offset(end))
+            case HLEvent.End():
+                tag = None
+            case _:
+                pass
+
+
+def bench_tags(lines: int, repeat: int) -> dict[str, Any]:
+    """
+    cost of applying the spans of a whole document as tags to a buffer, first from scratch then unchanged again.
+    Applying the highlight events of `highlight_lines` one by one is measured as well, as the baseline of the packed spans
+    """
+    try:
+        from bracket.tags import TagApplier
+        from bracket.themes import ThemeRegistry
+        from gi.repository import Gtk  # pyright: ignore[reportMissingModuleSource]
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    from highlighter import Highlighter
+
+    source = generate_source(lines)
+    themes = ThemeRegistry()
+    themes.load(THEME)
+
+    highlighter = Highlighter(list(themes.names))
+    highlighter.set_language("python")
+
+    first: list[float] = []
+    again: list[float] = []
+    baseline: list[float] = []
+    spans = 0
+    events = 0
+    for _ in range(repeat):
+        buffer = Gtk.TextBuffer(tag_table=themes.tag_table)
+        applier = TagApplier(buffer, themes.tags())
+        # the buffer is filled the way the editor sees it, as one insertion at the start
+        applier.lines_inserted(0, source.count("\n"))
+        buffer.set_text(source)
+
+        highlighter.highlight(source)
+        packed, fetch = timed(lambda: highlighter.highlight_spans(0, lines + 1))
+        spans = len(packed) // 16
+
+        _, elapsed = timed(lambda: applier.apply(0, lines + 1, packed))
+        first.append(fetch + elapsed)
+        # nothing changed, so this only measures the diffing
+        _, elapsed = timed(lambda: applier.apply(0, lines + 1, packed))
+        again.append(elapsed)
+
+        buffer = Gtk.TextBuffer(tag_table=themes.tag_table)
+        buffer.set_text(source)
+        result, fetch = timed(lambda: highlighter.highlight_lines(0, lines + 1))
+        events = len(result)
+        _, elapsed = timed(lambda: apply_events(buffer, result))
+        baseline.append(fetch + elapsed)
+
+    return {
+        "lines": lines,
+        "spans": spans,
+        "events": events,
+        "first_apply_seconds": percentiles(first),
+        "unchanged_apply_seconds": percentiles(again),
+        "events_apply_seconds": percentiles(baseline),
+        "spans_per_second": spans / min(first),
+        # how many times faster the packed spans are applied than the events, from scratch
+        "speedup_over_events": min(baseline) / min(first),
+    }
+
+
+def typing_trace(line: int) -> list[tuple[tuple[int, int], tuple[int, int], str]]:
+    """edits typing `TYPED` at the start of `line` and deleting it again with backspace, as (start, old end, text)"""
+    edits: list[tuple[tuple[int, int], tuple[int, int], str]] = []
+    row, column = line, 0
+    for char in TYPED:
+        edits.append(((row, column), (row, column), char))
+        row, column = (row + 1, 0) if char == "\n" else (row, column + 1)
+
+    lengths = [len(typed_line) for typed_line in TYPED.split("\n")]
+    for char in reversed(TYPED):
+        if char == "\n":
+            row -= 1
+            column = lengths[row - line]
+            edits.append(((row, column), (row + 1, 0), ""))
+        else:
+            edits.append(((row, column - 1), (row, column), ""))
+            column -= 1
+    return edits
+
+
+def bench_keystrokes(lines: int) -> dict[str, Any]:
+    """latency of a keystroke: recording the edit, reparsing and fetching the spans of the lines around it"""
+    from highlighter import Highlighter
+
+    source = generate_source(lines)
+    highlighter = Highlighter(recognized_names())
+    highlighter.set_language("python")
+    highlighter.highlight(source)
+
+    latencies: list[float] = []
+    for start, old_end, text in typing_trace(lines // 2):
+
+        def keystroke():
+            highlighter.edit(start, old_end, text)
+            changed = highlighter.update() or []
+            first = min([s for s, _ in changed] + [start[0]])
+            highlighter.highlight_spans(max(first - VIEWPORT, 0), start[0] + VIEWPORT)
+
+        _, elapsed = timed(keystroke)
+        latencies.append(elapsed)
+
+    return {
+        "lines": lines,
+        "keystrokes": len(latencies),
+        "latency": percentiles(latencies),
+    }
+
+
+def run_size(lines: int, repeat: int) -> dict[str, Any]:
+    return {
+        "highlight": bench_highlight(lines, repeat),
+        "tags": bench_tags(lines, repeat),
+        "keystrokes": bench_keystrokes(lines),
+    }
+
+
+def commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=pathlib.Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks syntax highlighting")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of lines of the generated sources")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement")
+    parser.add_argument("--output", type=pathlib.Path, help="file to write the JSON results to, stdout if not set")
+    args = parser.parse_args()
+
+    results: dict[str, Any] = {
+        "commit": commit(),
+        "date": datetime.datetime.now(datetime.UTC).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sizes": {},
+    }
+
+    # a fresh process per size keeps the peak RSS of one size from hiding the one of the next
+    context = multiprocessing.get_context("spawn")
+    for lines in args.sizes:
+        print(f"benchmarking {lines} lines", file=sys.stderr)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results["sizes"][str(lines)] = pool.submit(run_size, lines, args.repeat).result()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark for quick open, how long matching the paths of a large project takes per keystroke.
+
+Run from the root of the repository:
+
+    python benchmarks/quick_open.py --output results.json
+
+The paths are generated, a few directories deep with names that share a lot of chars like the ones of real projects.
+Every query is typed char by char like in the quick open dialog, so typing on narrows down the previous candidates.
+It needs pygobject, which the project index imports.
+"""
+
+import argparse
+import datetime
+import json
+import pathlib
+import platform
+import random
+import sys
+from typing import Any
+
+from highlighting import commit, percentiles, timed
+
+# lets the benchmark import the bracket package when run as a script
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+
+DEFAULT_PATHS = 300_000
+
+DIRECTORIES = [
+    "src", "lib", "core", "utils", "api", "models", "views", "tests", "docs", "build",
+    "internal", "server", "client", "common", "config", "handlers", "services", "widgets", "components",
+]
+NAMES = [
+    "index", "main", "util", "helpers", "types", "parser", "lexer", "editor", "window", "document",
+    "session", "scheduler", "render", "theme", "tabview", "search", "config", "router", "store",
+]
+EXTENSIONS = [".py", ".rs", ".ts", ".tsx", ".js", ".json", ".md", ".c", ".h"]
+
+# file names, parts of directories and paths with separators, the last ones are the slowest to match
+QUERIES = ["editor", "editor.py", "tabview", "wind", "docsess", "xq", "src/core/main", "server/api/router"]
+
+
+def generate_paths(count: int) -> list[str]:
+    """paths up to six directories deep, the same every run"""
+    rng = random.Random(0)
+    paths: list[str] = []
+    for i in range(count):
+        directories = [
+            rng.choice(DIRECTORIES) + (str(rng.randint(0, 30)) if rng.random() < 0.5 else "")
+            for _ in range(rng.randint(1, 6))
+        ]
+        paths.append("/".join([*directories, f"{rng.choice(NAMES)}{i % 97}{rng.choice(EXTENSIONS)}"]))
+    return paths
+
+
+def bench_queries(count: int, repeat: int) -> dict[str, Any]:
+    from bracket.project_index import PathMatcher
+
+    paths = generate_paths(count)
+    matcher, build = timed(lambda: PathMatcher(paths))
+
+    queries: dict[str, Any] = {}
+    everything: list[float] = []
+    for query in QUERIES:
+        keystrokes: list[float] = []
+        for _ in range(repeat):
+            # a fresh dialog starts without the candidates of a previous query
+            matcher._cache = None  # pyright: ignore[reportPrivateUsage]
+            for end in range(1, len(query) + 1):
+                _, elapsed = timed(lambda: matcher.match(query[:end]))
+                keystrokes.append(elapsed)
+        queries[query] = percentiles(keystrokes)
+        everything.extend(keystrokes)
+
+    return {
+        "paths": count,
+        "build_seconds": build,
+        "keystrokes": percentiles(everything),
+        "queries": queries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks quick open")
+    parser.add_argument("--paths", type=int, default=DEFAULT_PATHS, help="number of generated paths")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per query")
+    parser.add_argument("--output", type=pathlib.Path, help="file to write the JSON results to, stdout if not set")
+    args = parser.parse_args()
+
+    results: dict[str, Any] = {
+        "commit": commit(),
+        "date": datetime.datetime.now(datetime.UTC).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick_open": bench_queries(args.paths, args.repeat),
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ SAVE_FILE = "save-file"
 SAVE_FILE_AS = "save-file-as"
 OPEN_FILE = "open-file"
 CLOSE_FILE = "close-file"
+QUICK_OPEN = "quick-open"
+FIND_IN_FILES = "find-in-files"
 # Define the actions that can be performed in the application on a window level
 
 
@@ -16,7 +18,9 @@ WINDOW_ACTIONS = [
     SAVE_FILE,
     SAVE_FILE_AS,
     OPEN_FILE,
-    CLOSE_FILE
+    CLOSE_FILE,
+    QUICK_OPEN,
+    FIND_IN_FILES
 ]
 
 ACTIONS: dict[str, list[str]] = {
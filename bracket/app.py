@@ -5,10 +5,20 @@ from typing import override
 
 import gi
 from typing import Callable
-from bracket.tabview import EditorTabView
+from bracket.tabview import EditorPage, EditorTabView
 from bracket.actions import load_accels_json
 from bracket.utils import Args, KwArgs
 from bracket.directory_browser import DirectoryBrowser
+from bracket.document import find_document
+from bracket.find_in_files import FindInFiles
+from bracket.profiling import startup
+from bracket.project_index import ProjectIndex
+from bracket.quick_open import QuickOpen
+from bracket.session import Session
+from bracket.themes import get_theme_registry
+from bracket.trigram_index import TrigramIndex
+from bracket.viewer import LargeFileViewer
+from bracket.workers import run_in_worker
 
 # Boilerplate for GTK - the Widget-Toolkit
 gi.require_version("Gtk", "4.0")
@@ -47,9 +57,19 @@ class Window(Adw.ApplicationWindow):
     directory_browser: DirectoryBrowser = cast(DirectoryBrowser, Gtk.Template.Child("dir-browser"))
     # working dir of the window: Todo - seperate working dir and file logic into its own classes
     working_dir: pathlib.Path | None = pathlib.Path.cwd()
+    # whether find in files keeps an index of the text of the working dir in the cache, built the first time it is used
+    index_text: bool = True
 
     def __init__(self, app: Adw.Application):
         super().__init__(application=app)
+        # files below the working dir for quick open, replaced along with the working dir
+        self.project_index: ProjectIndex | None = None
+        # kept between uses, so it still shows the last search when opened again
+        self._find_in_files: FindInFiles | None = None
+        # index of the text of the files below the working dir, only while find in files is used
+        self.text_index: TrigramIndex | None = None
+        # runs after the app stored the tabs in the session, they are closed here
+        self.connect_after("close-request", self._on_close_request)
 
     # sets up keybinds and actions for the window (actions can be thought of as events here emittet by some widget and handled at window or app level)
     def setup_actions(self):
@@ -60,6 +80,8 @@ class Window(Adw.ApplicationWindow):
             "save-file-as": (self._on_file_save_as,),
             "open-file": (self._on_file_open,),
             "close-file": (self._on_file_close,),
+            "quick-open": (self._on_quick_open,),
+            "find-in-files": (self._on_find_in_files,),
         }
 
         for (
@@ -71,8 +93,8 @@ class Window(Adw.ApplicationWindow):
             action.connect("activate", callback)
             self.add_action(action)
 
-        # action for opening a specific path
-        file_path_open = Gio.SimpleAction(name="file-path-open", parameter_type=GLib.VariantType.new("s"))
+        # action for opening a specific path, at a line unless it is -1
+        file_path_open = Gio.SimpleAction(name="file-path-open", parameter_type=GLib.VariantType.new("(si)"))
         file_path_open.connect("activate", self._on_file_path_open)
         self.add_action(file_path_open)
 
@@ -94,18 +116,21 @@ class Window(Adw.ApplicationWindow):
 
         editor.write_to_file()
 
-    # the path is a string variant since thats the supported type for action callbacks
-    # will primarily be called by the directory tree
-    # TODO: focus file if it is open instead of opening it again
-    def _on_file_path_open(self, _, path: GLib.VariantType, *_args: Args, **_kwargs: KwArgs):
-        """Callback handling requests for opening a specific file"""
-        str_path, _ = path.dup_string()
-
-        print(str_path)
+    # the parameter is a (path, line) variant since thats the supported type for action callbacks
+    # will primarily be called by the directory tree, quick open and find in files
+    def _on_file_path_open(self, _, parameter: GLib.Variant, *_args: Args, **_kwargs: KwArgs):
+        """Callback handling requests for opening a specific file, at a line if it is not -1"""
+        str_path, line = parameter.unpack()
 
         fpath = pathlib.Path(str_path)
 
-        self.tabview.open_file(fpath)
+        page = self.tabview.open_file(fpath)
+
+        child = page.get_child() if page else None
+        if line >= 0 and isinstance(child, EditorPage):
+            child.go_to_line(line)
+        elif line >= 0 and isinstance(child, LargeFileViewer):
+            child.goto_line(line)
 
 
     def _on_file_save_as(self, *_args: Args, **_kwargs: KwArgs):
@@ -125,6 +150,54 @@ class Window(Adw.ApplicationWindow):
         self.working_dir = path
         self.directory_browser.set_path(path)
 
+        if self.project_index:
+            self.project_index.stop()
+        self.project_index = ProjectIndex(path)
+        # the text index is created again for the new working dir when find in files is used
+        if self.text_index:
+            self.text_index.stop()
+            self.text_index = None
+        # crawling competes with the first frame for the disk and the GIL
+        startup.defer("project index", self.project_index.start)
+
+    def _on_close_request(self, *_args: Args) -> bool:
+        """Internal callback for when the window is about to close, stops watching the working dir and closes the tabs"""
+        if self.project_index:
+            self.project_index.stop()
+            self.project_index = None
+        if self._find_in_files:
+            self._find_in_files.stop()
+        if self.text_index:
+            self.text_index.stop()
+            self.text_index = None
+        self.tabview.close_all()
+        return False
+
+    def _on_quick_open(self, *_args: Args, **_kwargs: KwArgs):
+        if self.project_index:
+            QuickOpen(self.project_index).present(self)
+
+    def _on_find_in_files(self, *_args: Args, **_kwargs: KwArgs):
+        if not self.working_dir:
+            return
+
+        # a search of the old working dir is of no use anymore
+        if not self._find_in_files or self._find_in_files.root != self.working_dir:
+            if self._find_in_files:
+                self._find_in_files.stop()
+            if self.text_index:
+                self.text_index.stop()
+                self.text_index = None
+
+            if self.index_text:
+                self.text_index = TrigramIndex(self.working_dir)
+                # the project index watches the directories already, it passes changed files on
+                if self.project_index:
+                    self.project_index.on_files_changed = self.text_index.refresh
+                self.text_index.start()
+            self._find_in_files = FindInFiles(self.working_dir, self.text_index)
+        self._find_in_files.present(self)
+
     def _on_file_new(self, *_args: Args, **_kwargs: KwArgs):
         self.tabview.new_file()
 
@@ -133,10 +206,15 @@ class Window(Adw.ApplicationWindow):
 
 
 class App(Adw.Application):
+    """
+    The application, only one instance runs per session. Launching bracket again hands the paths over to the running
+    instance over D-Bus, which opens them in the window they belong to, see `do_open`.
+    """
 
-    __directories: list[pathlib.Path] = []
-    __files: list[pathlib.Path] = []
-    _active_window: Gtk.Window | None = None
+    # when started as a D-Bus service the instance keeps running in the background with the theme and these grammars
+    # loaded, so the first window opens without waiting for them
+    keep_warm: bool = True
+    warm_languages: tuple[str, ...] = ("python",)
 
     def __init__(self, app_id: str | None = "io.github.bracket"):
         super().__init__(
@@ -144,7 +222,8 @@ class App(Adw.Application):
             flags=Gio.ApplicationFlags.HANDLES_OPEN,
         )
         self.set_resource_base_path("/")
-        self._load_css()
+        # tabs of the windows by working directory, restored with the directory
+        self._session: Session = Session()
 
     def _load_css(self, *_args: Args, **_kwargs: KwArgs) -> None:
         print(_args, _kwargs)
@@ -168,37 +247,59 @@ class App(Adw.Application):
             Gtk.STYLE_PROVIDER_PRIORITY_USER,
         )
 
-
+    # runs once in the primary instance, instances handing their paths over to it skip it
     @override
-    def do_activate(self):
+    def do_startup(self):
+        Adw.Application.do_startup(self)
 
-        self._load_accels()
+        with startup.phase("css"):
+            self._load_css()
+        with startup.phase("accels"):
+            self._load_accels()
         GLib.set_application_name("bracket")
 
-        if not self.__directories:
-            self.__directories.append(pathlib.Path.cwd())
-
-        for dir in self.__directories:
-            window = Window(self)
+        if self.keep_warm and self.get_flags() & Gio.ApplicationFlags.IS_SERVICE:
+            self._warm_up()
 
-            window.setup_actions()
+    def _warm_up(self):
+        """keeps the service running after its last window closed and loads the theme and grammars ahead of time"""
+        self.hold()
+        get_theme_registry()
+        from highlighter import load_language
 
-            for file in self.__files:
+        def work():
+            for name in self.warm_languages:
+                load_language(name)
 
-                window.tabview.open_file(file)
+        # compiling grammars does not need the main loop, so the instance answers requests meanwhile
+        run_in_worker(work, lambda _result: None)
 
-            window.set_working_dir(dir)
+    @override
+    def do_activate(self):
+        """
+        presents the last used window. Without any window the windows open when the app was closed last time come back,
+        or a window for the working directory if there were none
+        """
+        window = self._get_active_window()
+        if window:
             window.present()
+            return
 
-        # self.active_window = window
-
-    def _load_accels(self):
-        for action, accel in load_accels_json().items():
-            print(action, accel)
-            self.set_accels_for_action(action, (accel,))
+        directories = [d for d in self._session.windows if d.is_dir()] or [pathlib.Path.cwd()]
+        for directory in directories:
+            self._new_window(directory).present()
 
     @override
     def do_open(self, files: Sequence[Gio.File], hint: str, *args, **kwargs) -> None:
+        """
+        opens paths given on the command line, of this or of a later launch handing them over.
+        Directories get a window, the one showing them already if there is one. Files are opened in the window
+        showing them already, otherwise in the window of the innermost working directory containing them,
+        otherwise in the last used window
+        """
+        directories: list[pathlib.Path] = []
+        paths: list[pathlib.Path] = []
+
         for file in files:
             path = file.get_path()
 
@@ -208,9 +309,145 @@ class App(Adw.Application):
             path = pathlib.Path(path)
 
             if path.is_file():
-                self.__files.append(path)
+                paths.append(path)
 
             elif path.is_dir():
-                self.__directories.append(path)
+                directories.append(path)
+
+        for directory in directories:
+            window = self._find_window(directory) or self._new_window(directory)
+            window.present()
+
+        # files of one window are opened together, so only the last one of them is loaded right away
+        targets: dict[Window, list[pathlib.Path]] = {}
+        for path in paths:
+            window = self._window_for_file(path)
+            if not window:
+                window = self._new_window(self._directory_for_file(path))
+            targets.setdefault(window, []).append(path)
 
-        self.activate()
+        for window, window_paths in targets.items():
+            window.tabview.open_files(window_paths)
+            window.present()
+
+    def _windows(self) -> list[Window]:
+        return [w for w in self.get_windows() if isinstance(w, Window)]
+
+    def _get_active_window(self) -> Window | None:
+        """the window used last, get_windows is sorted by when they were focused"""
+        windows = self._windows()
+        return windows[0] if windows else None
+
+    def _find_window(self, directory: pathlib.Path) -> Window | None:
+        """returns the window of a working directory"""
+        directory = directory.resolve()
+        for window in self._windows():
+            if window.working_dir and window.working_dir.resolve() == directory:
+                return window
+        return None
+
+    def _window_for_file(self, path: pathlib.Path) -> Window | None:
+        """
+        returns the window a file should be opened in: the one showing it already,
+        the one whose working directory is the innermost one containing it or the one used last
+        """
+        windows = self._windows()
+
+        document = find_document(path)
+        for window in windows:
+            if document and document in window.tabview.opened_files:
+                return window
+
+        path = path.resolve()
+        containing = [w for w in windows if w.working_dir and path.is_relative_to(w.working_dir.resolve())]
+        if containing:
+            return max(containing, key=lambda w: len(cast(pathlib.Path, w.working_dir).resolve().parts))
+
+        return self._get_active_window()
+
+    def _directory_for_file(self, path: pathlib.Path) -> pathlib.Path:
+        """
+        working directory of a new window for a file: the current one if it contains the file, otherwise the directory of the file.
+        The instance may run as a service started somewhere else, so its working directory may have nothing to do with the file
+        """
+        cwd = pathlib.Path.cwd()
+        if cwd != pathlib.Path(cwd.anchor) and path.resolve().is_relative_to(cwd.resolve()):
+            return cwd
+        return path.parent
+
+    def _new_window(self, directory: pathlib.Path) -> Window:
+        """creates a window for a working directory with the tabs stored for it in the session"""
+        # the work that is not needed to show the window waits until it is drawn, see `_watch_first_frame`
+        startup.wait_for_first_frame()
+
+        with startup.phase("window template"):
+            window = Window(self)
+
+        window.setup_actions()
+        window.connect("close-request", self._on_window_close_request)
+
+        with startup.phase("restore session"):
+            state = self._session.directory(directory)
+            if state:
+                window.tabview.restore_session(state)
+
+        window.set_working_dir(directory)
+        self._watch_first_frame(window)
+        return window
+
+    def _watch_first_frame(self, window: Window):
+        """tells the startup profile when the window drew its first frame"""
+        def on_idle() -> bool:
+            startup.first_frame()
+            return GLib.SOURCE_REMOVE
+
+        def on_after_paint(clock: Gdk.FrameClock):
+            clock.disconnect(handler)
+            # after the frame is on screen, not while it is still being finished
+            GLib.idle_add(on_idle)
+
+        def on_map(*_args: Args):
+            nonlocal handler
+            window.disconnect(map_handler)
+            clock = window.get_frame_clock()
+            if clock:
+                handler = clock.connect("after-paint", on_after_paint)
+            else:
+                startup.first_frame()
+
+        handler = 0
+        map_handler = window.connect("map", on_map)
+
+    def _on_window_close_request(self, window: Window) -> bool:
+        """
+        Internal callback for when a window is about to close, stores its tabs in the session.
+        The windows still open afterwards are the ones opened on the next launch, or this one if it is the last
+        """
+        self._save_window(window)
+        others = [w.working_dir for w in self.get_windows() if isinstance(w, Window) and w is not window and w.working_dir]
+        self._session.set_windows(others or ([window.working_dir] if window.working_dir else []))
+        self._session.write()
+        return False
+
+    def _save_window(self, window: Window):
+        """stores the tabs of a window in the session under its working directory"""
+        if window.working_dir:
+            self._session.set_directory(window.working_dir, window.tabview.session_state())
+
+    @override
+    def do_shutdown(self):
+        # windows still open when the app quits are stored as well
+        windows = [w for w in self.get_windows() if isinstance(w, Window)]
+        if windows:
+            for window in windows:
+                self._save_window(window)
+            self._session.set_windows([w.working_dir for w in windows if w.working_dir])
+            # written on a worker, the threads of the pool are joined before the interpreter exits so the write finishes
+            self._session.write()
+
+        Adw.Application.do_shutdown(self)
+
+    def _load_accels(self):
+        for action, accel in load_accels_json().items():
+            print(action, accel)
+            self.set_accels_for_action(action, (accel,))
@@ -1,5 +1,9 @@
+import bisect
+from collections.abc import Sequence
+import os
 import pathlib
 from typing import cast
+import weakref
 import gi
 
 gi.require_version("Gtk", "4.0")
@@ -9,22 +13,326 @@ from gi.repository import Gtk, GLib, Adw, Gio, GObject
 
 from pathlib import Path
 
+from bracket.profiling import startup
+from bracket.workers import run_in_worker
+
 class DirectoryItem(GObject.Object):
-    """Data model for directory/file items"""
+    """
+    Data model for directory/file items
+    Whether the item is a directory is looked up once, by the enumeration that found it if possible, and kept
+    """
 
-    def __init__(self, path):
+    def __init__(self, path, is_dir: bool | None = None):
         super().__init__()
         self.path = Path(path)
         self.name = self.path.name
-        self._is_dir: bool = self.path.is_dir()
+        self.is_dir: bool = self.path.is_dir() if is_dir is None else is_dir
 
     @property
     def display_name(self):
         return self.name
 
-    @property
-    def is_dir(self) -> bool:
-        return self.path.is_dir()
+
+def sort_key(item: DirectoryItem) -> tuple[bool, str]:
+    """directories first, then files, alphabetically"""
+    return sort_key_for(item.name, item.is_dir)
+
+
+def sort_key_for(name: str, is_dir: bool) -> tuple[bool, str]:
+    return not is_dir, name.lower()
+
+
+# an entry of a directory: its name and whether it is a directory
+type Entry = tuple[str, bool]
+
+
+def sort_entries(names: list[str], dirs: bytearray) -> tuple[list[str], bytearray]:
+    """returns entries given as names and types sorted like `sort_key_for`"""
+    order = sorted(range(len(names)), key=lambda i: sort_key_for(names[i], bool(dirs[i])))
+    return [names[i] for i in order], bytearray(dirs[i] for i in order)
+
+
+class _SortKeys(Sequence[tuple[bool, str]]):
+    """the sort keys of the entries of a model, computed when looked at, so bisecting needs no list of keys"""
+
+    def __init__(self, names: list[str], dirs: bytearray):
+        self._names: list[str] = names
+        self._dirs: bytearray = dirs
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __getitem__(self, position: int) -> tuple[bool, str]:  # pyright: ignore[reportIncompatibleMethodOverride]
+        return sort_key_for(self._names[position], bool(self._dirs[position]))
+
+
+class DirectoryModel(GObject.Object, Gio.ListModel):
+    """
+    Entries of a directory as a list model for the tree, sorted by `sort_key_for`, read on a worker so large or slow
+    directories do not block the UI. Entries are kept as a list of names and an array of types, the `DirectoryItem`
+    of an entry is only created when the tree asks for its row and lives as long as the tree holds it,
+    so a directory with hundreds of thousands of entries costs a few objects for the rows on screen.
+    The first `first_batch` entries are shown as soon as they are read, the rest replaces them once the whole directory is read.
+    """
+    __gtype_name__: str = "DirectoryModel"
+
+    # entries shown before the rest of the directory is read, for directories that take a while
+    first_batch: int = 1000
+
+    def __init__(self, path: Path, cancellable: Gio.Cancellable):
+        super().__init__()
+        self.path: Path = path
+        self._cancellable: Gio.Cancellable = cancellable
+        self._names: list[str] = []
+        # 1 for directories, 0 for files, in the order of the names
+        self._dirs: bytearray = bytearray()
+        # the items handed out, by name, they are dropped once the tree lets go of them
+        self._items: weakref.WeakValueDictionary[str, DirectoryItem] = weakref.WeakValueDictionary()
+        self._loading: bool = False
+        # names removed by the watcher while the directory is read, the worker may have read them before
+        self._removed: set[str] = set()
+
+    def do_get_item_type(self) -> GObject.GType:
+        return DirectoryItem.__gtype__
+
+    def do_get_n_items(self) -> int:
+        return len(self._names)
+
+    def do_get_item(self, position: int) -> DirectoryItem | None:
+        if position >= len(self._names):
+            return None
+
+        name = self._names[position]
+        item = self._items.get(name)
+        if item is None:
+            item = DirectoryItem(self.path / name, bool(self._dirs[position]))
+            self._items[name] = item
+        return item
+
+    def start(self):
+        """reads the directory on a worker"""
+        self._loading = True
+        path = self.path
+        cancellable = self._cancellable
+        first_batch = self.first_batch
+
+        def work() -> tuple[list[str], bytearray, str | None]:
+            names: list[str] = []
+            dirs = bytearray()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if cancellable.is_cancelled():
+                            break
+                        # Skip hidden files/directories
+                        if entry.name.startswith("."):
+                            continue
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        names.append(entry.name)
+                        dirs.append(is_dir)
+
+                        if len(names) == first_batch:
+                            GLib.idle_add(self._on_first_batch, *sort_entries(names, dirs))
+            except OSError as e:
+                # the entries read before the error are shown in order like the others
+                return *sort_entries(names, dirs), e.strerror or str(e)
+
+            return *sort_entries(names, dirs), None
+
+        run_in_worker(work, self._on_loaded)
+
+    def _on_first_batch(self, names: list[str], dirs: bytearray) -> bool:
+        """Internal callback for when the first entries were read"""
+        if self._loading and not self._cancellable.is_cancelled():
+            self._replace(names, dirs)
+        return GLib.SOURCE_REMOVE
+
+    def _on_loaded(self, result: tuple[list[str], bytearray, str | None] | None):
+        """Internal callback for when the whole directory was read"""
+        if not result or self._cancellable.is_cancelled():
+            return
+
+        names, dirs, error = result
+        self._replace(names, dirs)
+        self._loading = False
+        self._removed.clear()
+
+        if error:
+            # TODO: handle this properly, maybe with a notification
+            print(error)
+            self.insert([(f"[Access Denied: {error}]", False)])
+
+    def _replace(self, names: list[str], dirs: bytearray):
+        """
+        replaces the entries by sorted ones read by the worker, entries the watcher added or removed meanwhile stay that way.
+        the tree is told with one change, it only asks for the rows it shows
+        """
+        if self._removed:
+            kept = [i for i, name in enumerate(names) if name not in self._removed]
+            names, dirs = [names[i] for i in kept], bytearray(dirs[i] for i in kept)
+
+        read = set(names)
+        added = [(name, bool(is_dir)) for name, is_dir in zip(self._names, self._dirs) if name not in read]
+
+        removed = len(self._names)
+        self._names, self._dirs = names, dirs
+        self.items_changed(0, removed, len(names))
+        self.insert(added)
+
+    def insert(self, entries: list[Entry]):
+        """
+        sorts entries in, entries that end up next to each other are added with one change,
+        so the tree is told about a batch in a few changes and not one per entry.
+        entries that are there already are left out, the watcher may have added them while the directory was read
+        """
+        entries = sorted((e for e in entries if self.find(e[0]) is None), key=lambda e: sort_key_for(*e))
+        if self._loading:
+            self._removed.difference_update(name for name, _ in entries)
+
+        keys = _SortKeys(self._names, self._dirs)
+        # positions as the entries are now, they do not decrease since the entries are sorted
+        runs: list[tuple[int, list[Entry]]] = []
+        for entry in entries:
+            position = bisect.bisect(keys, sort_key_for(*entry))
+            if runs and runs[-1][0] == position:
+                runs[-1][1].append(entry)
+            else:
+                runs.append((position, [entry]))
+
+        # from the last position to the first, so the earlier positions stay valid
+        for position, run in reversed(runs):
+            self._names[position:position] = [name for name, _ in run]
+            self._dirs[position:position] = bytes(is_dir for _, is_dir in run)
+            self.items_changed(position, 0, len(run))
+
+    def remove(self, names: set[str]):
+        """removes the entries with the given names, entries next to each other are removed with one change"""
+        if self._loading:
+            self._removed.update(names)
+
+        positions = sorted(p for p in (self.find(name) for name in names) if p is not None)
+
+        # runs of neighbouring positions, from the last to the first so the earlier positions stay valid
+        runs: list[list[int]] = []
+        for position in positions:
+            if runs and runs[-1][1] == position:
+                runs[-1][1] += 1
+            else:
+                runs.append([position, position + 1])
+
+        for start, end in reversed(runs):
+            del self._names[start:end]
+            del self._dirs[start:end]
+            self.items_changed(start, end - start, 0)
+
+    def find(self, name: str) -> int | None:
+        """returns the position of the entry with a name, None if there is none"""
+        keys = _SortKeys(self._names, self._dirs)
+        for is_dir in (True, False):
+            key = sort_key_for(name, is_dir)
+            position = bisect.bisect_left(keys, key)
+            # names only differing in case share a key
+            while position < len(self._names) and keys[position] == key:
+                if self._names[position] == name:
+                    return position
+                position += 1
+        return None
+
+
+class DirectoryWatcher:
+    """
+    Keeps a `DirectoryModel` up to date with the directory, so the tree does not have to be rebuilt.
+    Changes are collected for `merge_interval` milliseconds and then applied together, so a build creating thousands
+    of files leads to a few updates of the tree and not to one per file. The types of added entries are looked up on a worker.
+    The model is only referenced weakly, so it is released once its directory is collapsed, see `DirectoryBrowser._create_child_model`.
+    """
+
+    merge_interval: int = 100
+
+    def __init__(self, model: DirectoryModel):
+        self._model: weakref.ref[DirectoryModel] = weakref.ref(model)
+        self._path: Path = model.path
+        # names changed since the last update, with whether they were added (True) or removed (False), the last event wins
+        self._pending: dict[str, bool] = {}
+        self._source: int = 0
+        self._monitor: Gio.FileMonitor | None = None
+
+    def start(self):
+        try:
+            self._monitor = Gio.File.new_for_path(str(self._path)).monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+        except GLib.Error as e:
+            print(e)
+            return
+
+        self._monitor.connect("changed", self._on_changed)
+
+    def stop(self):
+        if self._monitor:
+            self._monitor.cancel()
+            self._monitor = None
+        if self._source:
+            GLib.source_remove(self._source)
+            self._source = 0
+        self._pending.clear()
+
+    def _on_changed(self, _monitor: Gio.FileMonitor, file: Gio.File, other: Gio.File | None, event: Gio.FileMonitorEvent):
+        """Internal callback for when an entry of the directory was created, deleted or renamed"""
+        match event:
+            case Gio.FileMonitorEvent.CREATED | Gio.FileMonitorEvent.MOVED_IN:
+                self._change(file.get_basename(), True)
+            case Gio.FileMonitorEvent.DELETED | Gio.FileMonitorEvent.MOVED_OUT:
+                self._change(file.get_basename(), False)
+            case Gio.FileMonitorEvent.RENAMED:
+                self._change(file.get_basename(), False)
+                if other:
+                    self._change(other.get_basename(), True)
+            case _:
+                return
+
+    def _change(self, name: str | None, added: bool):
+        # Skip hidden files/directories
+        if not name or name.startswith('.'):
+            return
+
+        self._pending[name] = added
+        if not self._source:
+            self._source = GLib.timeout_add(self.merge_interval, self._on_merge_timeout)
+
+    def _on_merge_timeout(self) -> bool:
+        """applies the changes collected in the meantime"""
+        self._source = 0
+        pending = self._pending
+        self._pending = {}
+
+        model = self._model()
+        if not model:
+            return GLib.SOURCE_REMOVE
+        model.remove({name for name, added in pending.items() if not added})
+
+        added = [name for name, added in pending.items() if added]
+        if added:
+            path = self._path
+
+            # entries may be gone again by the time they are looked at, they are left out
+            def work() -> list[Entry]:
+                entries: list[Entry] = []
+                for name in added:
+                    entry = path / name
+                    if os.path.lexists(entry):
+                        entries.append((name, entry.is_dir()))
+                return entries
+
+            def apply(entries: list[Entry] | None):
+                model = self._model()
+                if entries and model and self._monitor:
+                    model.insert(entries)
+
+            run_in_worker(work, apply)
+
+        return GLib.SOURCE_REMOVE
 
 
 @Gtk.Template(resource_path="/io/github/bracket/directory_browser.ui")
@@ -45,7 +353,13 @@ class DirectoryBrowser(Gtk.ListView):
     _root_path: Path | None = pathlib.Path.cwd()  # Default root path
     def __init__(self):
         super().__init__()
-        self._setup_tree_model()
+        # whether building the tree model is scheduled already
+        self._tree_scheduled: bool = False
+        # cancels loading the directories of the current tree once it is replaced
+        self._cancellable: Gio.Cancellable = Gio.Cancellable()
+        # watchers of the directories expanded so far by their path, they keep the tree up to date
+        self._watchers: dict[Path, DirectoryWatcher] = {}
+        self._schedule_tree_model()
 
     def set_path(self, path: Path):
         """
@@ -53,11 +367,33 @@ class DirectoryBrowser(Gtk.ListView):
         This will reset the model and load the new directory contents
         """
         self._root_path = path
-        self._setup_tree_model()
+        self._schedule_tree_model()
+
+    def _schedule_tree_model(self):
+        """
+        Builds the tree model once the window is shown, reading the directory is not needed to draw the first frame
+        Paths set in the meantime replace each other, so the directory is only read once
+        """
+        if self._tree_scheduled:
+            return
+        self._tree_scheduled = True
+
+        def build():
+            self._tree_scheduled = False
+            self._setup_tree_model()
+
+        startup.defer("directory tree", build)
 
     def _setup_tree_model(self):
         """Setup the TreeListModel with root directory"""
 
+        # the directories of the old tree do not need to be loaded or watched anymore
+        self._cancellable.cancel()
+        self._cancellable = Gio.Cancellable()
+        for watcher in self._watchers.values():
+            watcher.stop()
+        self._watchers.clear()
+
         # create a new list store for the root item
         root_store = Gio.ListStore.new(DirectoryItem)
         # Create the root item for the model, representing the root directory
@@ -88,6 +424,7 @@ class DirectoryBrowser(Gtk.ListView):
         """
         Create child model for TreeListModel
         This function is called for each item to get its children
+        The model is returned empty and filled asynchronously, see `DirectoryModel`
         """
         directory_item = item  # This is a DirectoryItem
 
@@ -95,33 +432,30 @@ class DirectoryBrowser(Gtk.ListView):
         if not directory_item.is_dir:
             return None
 
-        # Create a ListStore for this directory's children
-        child_store = Gio.ListStore.new(DirectoryItem)
+        # Create a model for this directory's children, it only holds names until rows are shown
+        child_model = DirectoryModel(directory_item.path, self._cancellable)
 
-        try:
-            # Get directory contents
-            children = list(directory_item.path.iterdir())
-
-            # Sort: directories first, then files, alphabetically
-            children.sort(key=lambda p: (not p.is_dir(), p.name.lower()))
+        # expanding a directory again creates a new model, the watcher of the old one is not needed anymore
+        old_watcher = self._watchers.pop(directory_item.path, None)
+        if old_watcher:
+            old_watcher.stop()
 
-            # Add children to store
-            for child_path in children:
-                # Skip hidden files/directories
-                if child_path.name.startswith('.'):
-                    continue
+        # watching starts before reading, so no entry created in between is missed
+        watcher = DirectoryWatcher(child_model)
+        watcher.start()
+        self._watchers[directory_item.path] = watcher
+        # the tree drops the model once the directory or one above it is collapsed, the watcher stops along with it
+        weakref.finalize(child_model, self._release_watcher, directory_item.path, watcher)
+        child_model.start()
 
-                child_item = DirectoryItem(child_path)
-                child_store.append(child_item)
-
-        except (PermissionError, OSError) as e:
-            # Create an error item for inaccessible directories
-            # TODO: handle this properly, maybe with a notification
-            error_item = DirectoryItem(directory_item.path / f"[Access Denied: {e}]")
-            child_store.append(error_item)
+        return child_model
 
-        # Return None if no children, otherwise return the store
-        return child_store if child_store.get_n_items() > 0 else None
+    def _release_watcher(self, path: Path, watcher: DirectoryWatcher):
+        """stops the watcher of a directory whose model was released"""
+        watcher.stop()
+        # the directory may have been expanded again in the meantime, with a watcher of its own
+        if self._watchers.get(path) is watcher:
+            del self._watchers[path]
 
     # Factorys are the constructors for the widgets in the ListView, in setup we define the base widget structure
     @Gtk.Template.Callback()
@@ -175,7 +509,7 @@ class DirectoryBrowser(Gtk.ListView):
         # TODO: focus the file if it is already open instead of opening it again
         else:
             path = directory_item.path
-            self.activate_action("win.file-path-open", GLib.Variant("s", str(path)))
+            self.activate_action("win.file-path-open", GLib.Variant("(si)", (str(path), -1)))
 
 
     @Gtk.Template.Callback()
@@ -0,0 +1,758 @@
+from gi.repository import (
+    GLib,
+    GObject,
+    Gio,
+    Gtk,
+)  # pyright: ignore[reportMissingModuleSource]
+
+from bracket.dialogs import request_save_file
+from bracket.files import write_atomic
+import codecs
+import hashlib
+import pathlib
+import sys
+from types import ModuleType
+from typing import TYPE_CHECKING, Callable, cast
+
+from bracket.profiling import startup
+from bracket.scheduler import HighlightScheduler
+from bracket.session import CachedSpans, get_span_cache
+from bracket.tags import TagApplier
+from bracket.themes import get_theme_registry
+from bracket.utils import Args, KwArgs, LineRanges, line_hunks
+from bracket.workers import run_in_worker
+
+if TYPE_CHECKING:
+    from bracket.editor import Editor
+    from highlighter import Highlighter
+
+
+def _point(it: Gtk.TextIter) -> tuple[int, int]:
+    """
+    returns the position of an iter as (line, byte in line), the format the highlighter expects edits in
+    """
+    return it.get_line(), it.get_line_index()
+
+
+def _import_highlighter() -> ModuleType:
+    """imports the highlighter module once a document needs it, so an empty window is shown without waiting for it"""
+    if "highlighter" not in sys.modules:
+        with startup.phase("import highlighter"):
+            import highlighter  # noqa: F401
+    return sys.modules["highlighter"]
+
+
+# open documents by the canonical path of their file, so every tab and window showing a file shares one document
+_documents: dict[pathlib.Path, "Document"] = {}
+
+
+def canonical_path(path: pathlib.Path | str) -> pathlib.Path:
+    """returns the absolute path with symlinks resolved, the key documents are indexed by"""
+    return pathlib.Path(path).resolve()
+
+
+def find_document(path: pathlib.Path | str) -> "Document | None":
+    """returns the open document of a file, None if the file is not open"""
+    return _documents.get(canonical_path(path))
+
+
+class Document(GObject.Object):
+    """
+    The text of a file together with everything that belongs to it rather than to a view of it:
+    the buffer, the highlighter, loading, saving and watching the file.
+    A document is shown by one or more `Editor`s, which may be in different tabs and windows, and is closed with the last of them.
+    Open documents are indexed by the canonical path of their file, see `find_document`.
+    """
+
+    # path to the file beeing edited
+    path: pathlib.Path | None = None
+
+    # current filename - is a gobject property so it can be bound to the Title of the tabpage and changes automatically when the filename changes (due to saving etc)
+    filename: GObject.Property = GObject.Property(type=str, default="Untitled")
+
+    # property indicating wether the file has been saved - gobject so it can be bound to some sort of indicator in the tabbar (not done yet)
+    saved: GObject.Property = GObject.Property(type=bool, default=False)
+
+    # whether a file is being loaded into the document and how much of it, from 0 to 1 - bound to the tab page to show the progress
+    loading: GObject.Property = GObject.Property(type=bool, default=False)
+    progress: GObject.Property = GObject.Property(type=float, default=0.0)
+
+    # emitted when loading a file ended, with True if the whole file was loaded and False if loading failed or was cancelled
+    __gsignals__ = {
+        "loaded": (GObject.SignalFlags.RUN_FIRST, None, (bool,)),
+    }
+
+    # whether saving flushes the file to disk before replacing the old one and whether the old one is kept as a backup `name~`
+    save_fsync: bool = True
+    save_backup: bool = False
+
+    # rough number of bytes a loaded char costs: the text in the buffer and in the highlighter, their line indexes and the syntax tree
+    bytes_per_char: int = 8
+
+    # files are read in chunks of this many bytes, every chunk is inserted on its own so the window stays responsive in between
+    load_chunk_size: int = 1 << 20
+
+    # at most this many lines around the visible ones are kept in the span cache when the document is closed, see `store_spans`
+    span_cache_lines: int = 2000
+
+    # new files are saved by default
+    def __init__(self, saved: bool = False):
+        super().__init__()
+        # internal buffer (GTK class for handling multiline texts, text styling etc)
+        # all buffers share the tag table of the theme registry, so the tags are created once and not per document
+        themes = get_theme_registry()
+        self.buffer: Gtk.TextBuffer = Gtk.TextBuffer(tag_table=themes.tag_table)
+        # insert-text and delete-range handlers run before the default handler, so they see the text before the edit
+        self.buffer.connect("changed", self._on_changed)
+        self.buffer.connect("insert-text", self._on_insert_text)
+        self.buffer.connect("delete-range", self._on_delete_range)
+        self.set_saved(saved)
+        # editors showing the document, their visible lines are the ones highlighted
+        self._views: list["Editor"] = []
+        # lines whose tags are up to date
+        self._highlighted: LineRanges = LineRanges()
+        # merges the highlight requests of bursts of edits into a single pass
+        self._scheduler: HighlightScheduler = HighlightScheduler(self.highlight)
+        # the highlighter is created once it is needed, see `highlighter`, the language is set once a file is opened or saved, see `_detect_language`
+        # the names are copied, names added to the registry by later themes are only recognized by new documents
+        self._names: list[str] = list(themes.names)
+        self._highlighter: "Highlighter | None" = None
+        self.language: str | None = None
+        # state of loading a file, see `open_file`
+        self._load_cancellable: Gio.Cancellable | None = None
+        self._load_decoder: codecs.IncrementalDecoder = codecs.getincrementaldecoder("utf-8")()
+        self._load_size: int = 0
+        self._load_read: int = 0
+        self._load_hash: hashlib.blake2b = hashlib.blake2b(digest_size=16)
+        # (mtime in ns, size, hash of the content) of the file as it was last loaded or saved, None if unknown
+        # used to tell changes made by other programs apart from our own writes, see `_check_disk`
+        self._disk_state: tuple[int, int, bytes] | None = None
+        self._monitor: Gio.FileMonitor | None = None
+        # bumped on every edit of the buffer, tells whether the buffer changed while work was done on a copy of its text
+        self._version: int = 0
+        # whether a save is running and the callbacks of saves requested meanwhile, see `write_to_file`
+        self._saving: bool = False
+        self._save_callbacks: list[Callable[[bool], None] | None] = []
+        # applies the spans of the highlighter as tags, only touching the ones that changed
+        self._tag_applier: TagApplier = TagApplier(self.buffer, themes.tags())
+        # spans cached when the file was closed last time, applied while it loads, and the hash of the content they belong to
+        self._cached_spans: CachedSpans | None = None
+        self._cached_digest: bytes | None = None
+
+    @property
+    def highlighter(self) -> "Highlighter":
+        """
+        the highlighter of the document, created with the text of the buffer the first time it is needed.
+        The highlighter module is only imported then, so an empty window is shown without waiting for it
+        """
+        if self._highlighter is None:
+            self._highlighter = _import_highlighter().Highlighter(self._names)
+            text = self.get_text()
+            if text:
+                self._highlighter.edit((0, 0), (0, 0), text)
+
+        return self._highlighter
+
+    def add_view(self, view: "Editor"):
+        """registers an editor showing the document"""
+        self._views.append(view)
+
+    def remove_view(self, view: "Editor"):
+        """unregisters an editor that does not show the document anymore, the document is closed with its last view"""
+        # the lines visible in the last view are the ones shown first when the file is opened again
+        if self._views == [view]:
+            self.store_spans()
+        if view in self._views:
+            self._views.remove(view)
+        if not self._views:
+            self.close()
+
+    @property
+    def views(self) -> list["Editor"]:
+        """the editors showing the document"""
+        return list(self._views)
+
+    def estimated_size(self) -> int:
+        """returns a rough estimate of the memory the document takes in bytes"""
+        return self.buffer.get_char_count() * self.bytes_per_char
+
+    def _on_changed(self, *_args: Args, **_kwargs: KwArgs):
+        """
+        Internal callback for when the text in the document changes.
+        It sets the document as unsaved and schedules highlighting the text.
+        """
+        # text inserted while loading a file is highlighted once loading finished, see `_on_chunk_read`
+        if self.get_property("loading"):
+            return
+
+        self.set_saved(False)
+        self._scheduler.request()
+
+    def _on_insert_text(self, _buffer: Gtk.TextBuffer, location: Gtk.TextIter, text: str, _len: int):
+        """
+        Internal callback run before text is inserted into the buffer.
+        Passes the edit on to the highlighter so it can reuse the previous syntax tree.
+        """
+        self._version += 1
+        self.highlighter.edit(_point(location), _point(location), text)
+        # lines after the insertion move down by the number of inserted lines
+        line = location.get_line()
+        inserted = text.count("\n")
+        self._highlighted.shift(line, inserted)
+        self._tag_applier.lines_inserted(line, inserted)
+
+    def _on_delete_range(self, _buffer: Gtk.TextBuffer, start: Gtk.TextIter, end: Gtk.TextIter):
+        """
+        Internal callback run before a range of text is deleted from the buffer.
+        Passes the edit on to the highlighter so it can reuse the previous syntax tree.
+        """
+        self._version += 1
+        self.highlighter.edit(_point(start), _point(end), "")
+        # lines after the deleted range move up by the number of removed lines
+        line = start.get_line()
+        self._highlighted.shift(line, line - end.get_line())
+        self._tag_applier.lines_removed(line, end.get_line())
+
+    def get_filename(self) -> str:
+        return cast(str, self.get_property("filename"))
+
+    def open_file(self, path: pathlib.Path):
+        """
+        sets `self.path` to the given path and loads the file content into the document's buffer.
+        The file is read asynchronously in chunks of `load_chunk_size` bytes which are appended to the buffer as they come in,
+        the editors showing the document are read-only until the file is loaded. `loaded` is emitted when loading ended, it can be stopped with `cancel_loading`.
+        If the file does not exist or isn't a file, it will return without doing anything.
+        """
+        self.set_file(path)
+
+        # if the file path is not set or is not a file, return
+        if not self.path:
+            return
+        if not self.path.is_file():
+            return
+
+        # a load still running is superseded, its callbacks are ignored from now on, see `_is_superseded`
+        superseded = self._load_cancellable is not None
+        self.cancel_loading()
+        self._load_cancellable = Gio.Cancellable()
+        self._load_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._load_size = self.path.stat().st_size
+        self._load_read = 0
+        self._load_hash = hashlib.blake2b(digest_size=16)
+        self._disk_state = None
+        self._cached_spans = get_span_cache().lookup(self.path, self._names)
+        self._cached_digest = self._cached_spans[3] if self._cached_spans else None
+
+        self.set_property("progress", 0.0)
+        self.set_property("loading", True)
+        # loading the file is not something the user should be able to undo, the superseded load began that already
+        if not superseded:
+            self.buffer.begin_irreversible_action()
+        self.buffer.set_text("")
+        self.set_saved(True)
+
+        file = Gio.File.new_for_path(str(self.path))
+        file.read_async(GLib.PRIORITY_DEFAULT, self._load_cancellable, self._on_file_opened, self._load_cancellable)
+
+    def cancel_loading(self):
+        """stops loading the file if one is being loaded, `loaded` is emitted with False then"""
+        if self._load_cancellable:
+            self._load_cancellable.cancel()
+
+    def close(self):
+        """stops loading the file, highlighting and watching it for changes and removes the document from the index, called once no editor shows it"""
+        self.cancel_loading()
+        self._scheduler.cancel()
+        if self._monitor:
+            self._monitor.cancel()
+            self._monitor = None
+        self._unindex()
+
+    def _is_superseded(self, cancellable: Gio.Cancellable) -> bool:
+        """whether the load a callback belongs to was replaced by opening the file again"""
+        return cancellable is not self._load_cancellable
+
+    def _on_file_opened(self, file: Gio.File, result: Gio.AsyncResult, cancellable: Gio.Cancellable):
+        """Internal callback for when the file to load was opened, starts reading it."""
+        try:
+            stream = file.read_finish(result)
+        except GLib.Error as e:
+            if not self._is_superseded(cancellable):
+                self._finish_loading(False, e)
+            return
+
+        if self._is_superseded(cancellable):
+            stream.close()
+            return
+        self._read_chunk(stream, cancellable)
+
+    def _read_chunk(self, stream: Gio.FileInputStream, cancellable: Gio.Cancellable):
+        """reads the next chunk of the file being loaded"""
+        # idle priority lets input and drawing go first, so the window stays responsive while large files load
+        stream.read_bytes_async(
+            self.load_chunk_size, GLib.PRIORITY_DEFAULT_IDLE, cancellable, self._on_chunk_read, cancellable
+        )
+
+    def _on_chunk_read(self, stream: Gio.FileInputStream, result: Gio.AsyncResult, cancellable: Gio.Cancellable):
+        """
+        Internal callback for when a chunk of the file being loaded was read, appends it to the buffer and reads the next one.
+        """
+        # the buffer belongs to the load that superseded this one
+        if self._is_superseded(cancellable):
+            stream.close()
+            return
+
+        try:
+            data = stream.read_bytes_finish(result).get_data() or b""
+            # chunks may end in the middle of a char, the decoder keeps the incomplete bytes for the next chunk
+            text = self._load_decoder.decode(data, final=not data)
+        except (GLib.Error, UnicodeDecodeError) as e:
+            stream.close()
+            self._finish_loading(False, e)
+            return
+
+        if text:
+            self.buffer.insert(self.buffer.get_end_iter(), text)
+            # the last line may continue in the next chunk, unless this was the last one
+            self._apply_cached_spans(self.buffer.get_line_count() - (1 if data else 0))
+
+        # an empty chunk marks the end of the file
+        if not data:
+            stream.close()
+            self._finish_loading(True)
+            return
+
+        first = self._load_read == 0
+        self._load_read += len(data)
+        self._load_hash.update(data)
+        self.set_property("progress", min(self._load_read / max(self._load_size, 1), 1.0))
+
+        # the start of the file is visible right away, so it is highlighted without waiting for the rest
+        if first:
+            self._detect_language()
+            self._scheduler.request()
+
+        self._read_chunk(stream, cancellable)
+
+    def _finish_loading(self, completed: bool, error: Exception | None = None):
+        """
+        ends loading the file, the text is highlighted if it was loaded completely
+        """
+        # cancelling is not an error worth reporting
+        if isinstance(error, GLib.Error) and error.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+            error = None
+        if error:
+            print(error)
+
+        # the digest is checked once the file is read completely, the state of the load is cleared before
+        cached_digest = self._cached_digest
+        self._load_cancellable = None
+        self._cached_spans = None
+        self._cached_digest = None
+        self.buffer.end_irreversible_action()
+        self.set_property("loading", False)
+
+        if completed and self.path:
+            self.set_property("progress", 1.0)
+            self._set_disk_state(self.path, self._load_hash.digest())
+            # the file changed in a way that kept its modification time and size, the highlighting corrects the spans applied
+            if cached_digest and cached_digest != self._load_hash.digest():
+                get_span_cache().discard(self.path)
+            self._detect_language()
+            self._scheduler.request()
+
+        self.emit("loaded", completed)
+
+    def _apply_cached_spans(self, lines: int):
+        """
+        colors the first `lines` lines with the cached spans of the file, the ones loaded already.
+        The highlighting done once the file is parsed replaces the spans that turn out to be wrong
+        """
+        if not self._cached_spans:
+            return
+
+        start, end, packed, _ = self._cached_spans
+        if start < lines:
+            self._tag_applier.apply(start, min(end, lines), packed)
+        # lines before the last one do not change anymore while loading, so the spans are applied once
+        if end <= lines:
+            self._cached_spans = None
+
+    def store_spans(self):
+        """
+        stores the spans of the lines the views show in the span cache, so the file is colored right away when it is opened again.
+        Only the highlighted lines of files that are loaded and saved are stored, since the spans are checked against the file on disk
+        """
+        if not self.path or not self._disk_state or not self._views or not self.is_saved() or self.get_property("loading"):
+            return
+
+        visible = self._visible_lines()
+        start = min(s for s, _ in visible)
+        end = min(max(e for _, e in visible), start + self.span_cache_lines)
+
+        # lines that are not highlighted may carry outdated spans, they are left out
+        parts: list[bytes] = []
+        position = start
+        for missing_start, missing_end in self._highlighted.missing(start, end):
+            parts.append(self._tag_applier.export(position, missing_start))
+            position = missing_end
+        parts.append(self._tag_applier.export(position, end))
+
+        get_span_cache().store(self.path, self._disk_state, self._names, start, end, b"".join(parts))
+
+    def set_language(self, name: str):
+        """
+        sets the language used to highlight the text and highlights it again.
+        The grammar of the language is compiled the first time any document uses it and is shared afterwards.
+        """
+        if name == self.language:
+            return
+
+        try:
+            load_time = _import_highlighter().load_language(name)
+            self.highlighter.set_language(name)
+        except OSError as e:
+            print(e)
+            return
+
+        if load_time > 0:
+            print(f"loaded {name} grammar in {load_time * 1000:.1f}ms")
+
+        self.language = name
+        # the highlighter starts over with a new tree, so every line is highlighted again
+        self._highlighted.clear()
+        self._scheduler.request()
+
+    def _detect_language(self):
+        """
+        sets the language judged by the file extension or the shebang in the first line.
+        Files of unknown languages keep the language they had so far.
+        Compiling the grammar takes a while, while the app starts it waits until the window is shown.
+        """
+        startup.defer("detect language", self._set_detected_language)
+
+    def _set_detected_language(self):
+        """sets the language judged by the file, see `_detect_language`"""
+        if not self.path:
+            return
+
+        _, end = self.buffer.get_iter_at_line(0)
+        if not end.ends_line():
+            end.forward_to_line_end()
+        first_line = self.buffer.get_text(self.buffer.get_start_iter(), end, include_hidden_chars=True)
+
+        name = _import_highlighter().language_for_file(str(self.path), first_line)
+        if name:
+            self.set_language(name)
+
+    def is_saved(self) -> bool:
+        """
+        returns true if there are changes in the buffer not written to the file
+        """
+        return cast(bool, self.get_property("saved"))
+
+    def set_saved(self, v: bool):
+        self.set_property("saved", v)
+
+    def set_file(self, path: pathlib.Path | str):
+        """sets the internal path and creates it and its parents, sets the title to the files name"""
+
+        # handles the union parameter
+        file_path = pathlib.Path(path) if isinstance(path, str) else path
+
+        # creates the file if it does not exist
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.touch(exist_ok=True)
+
+        # set the internal path and the filename property, the document is indexed under its new path
+        self._unindex()
+        self.path = file_path
+        self.set_property("filename", file_path.name)
+        _documents.setdefault(canonical_path(file_path), self)
+        self._watch()
+
+    def _unindex(self):
+        """removes the document from the index of open documents"""
+        if self.path and _documents.get(canonical_path(self.path)) is self:
+            del _documents[canonical_path(self.path)]
+
+    def _watch(self):
+        """
+        watches the file for changes made by other programs, see `_check_disk`
+        """
+        if self._monitor:
+            self._monitor.cancel()
+            self._monitor = None
+        self._disk_state = None
+
+        if not self.path:
+            return
+
+        try:
+            self._monitor = Gio.File.new_for_path(str(self.path)).monitor_file(Gio.FileMonitorFlags.NONE, None)
+        except GLib.Error as e:
+            print(e)
+            return
+
+        self._monitor.connect("changed", self._on_file_changed)
+
+    def _set_disk_state(self, path: pathlib.Path, digest: bytes):
+        """remembers the file as it is on disk now, with `digest` as the hash of its content"""
+        try:
+            stat = path.stat()
+        except OSError:
+            self._disk_state = None
+            return
+        self._disk_state = (stat.st_mtime_ns, stat.st_size, digest)
+
+    def _on_file_changed(
+        self, _monitor: Gio.FileMonitor, _file: Gio.File, _other: Gio.File | None, event: Gio.FileMonitorEvent
+    ):
+        """Internal callback for when the watched file changed on disk"""
+        # other programs replacing the file (formatters, git, editors saving atomically) create it anew
+        if event in (Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.CREATED):
+            self._check_disk()
+
+    def _check_disk(self):
+        """
+        Reloads the file if another program changed it. Modification time and size tell cheaply whether it may have changed,
+        only then the file is read and its hash compared. Instead of replacing the whole text only the changed lines are replaced,
+        so the cursor, the scroll position and the highlighting of the other lines are kept and highlighting the change is incremental.
+        Buffers with unsaved changes are not touched.
+        """
+        # while loading or saving the state on disk is about to change anyway
+        if not self.path or self._disk_state is None or self._saving or self.get_property("loading"):
+            return
+
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return
+
+        mtime, size, digest = self._disk_state
+        if (stat.st_mtime_ns, stat.st_size) == (mtime, size):
+            return
+
+        if not self.is_saved():
+            print(f"{self.path} changed on disk, keeping the unsaved changes")
+            self._disk_state = (stat.st_mtime_ns, stat.st_size, digest)
+            return
+
+        path = self.path
+        version = self._version
+        text = self.get_text()
+
+        def work() -> tuple[bytes, list[tuple[int, int, str]]]:
+            content = path.read_bytes()
+            new_digest = hashlib.blake2b(content, digest_size=16).digest()
+            # only the modification time changed, for example by touch
+            if new_digest == digest:
+                return new_digest, []
+            return new_digest, line_hunks(text, content.decode("utf-8"))
+
+        def apply(result: tuple[bytes, list[tuple[int, int, str]]] | None):
+            # the file was replaced or the text edited in the meantime, the next change or save sorts it out
+            if not result or path != self.path or version != self._version:
+                return
+
+            new_digest, hunks = result
+            self._set_disk_state(path, new_digest)
+            if not hunks:
+                return
+
+            # from the last hunk to the first, so the offsets of the ones before stay valid
+            self.buffer.begin_user_action()
+            for start, end, replacement in reversed(hunks):
+                start_iter = self.buffer.get_iter_at_offset(start)
+                end_iter = self.buffer.get_iter_at_offset(end)
+                self.buffer.delete(start_iter, end_iter)
+                if replacement:
+                    self.buffer.insert(start_iter, replacement)
+            self.buffer.end_user_action()
+
+            self.set_saved(True)
+
+        run_in_worker(work, apply)
+
+    def write_to_file(self, cb: Callable[[bool], None] | None = None):
+        """
+        writes the current text in the documents buffer to the file specified by `self.path`.
+        If `self.path` is not set, it will request a new file path using `request_new_file_path`.
+        The text is copied from the buffer and written on a worker thread through a temporary file that replaces the file,
+        so a failed write does not leave a truncated file behind. `cb` is called with the result on the main loop.
+        """
+        if not self.path:
+            # the path is not set, request a new file path
+            self.request_new_file_path(cb)
+            return
+
+        # one save at a time, otherwise an older text could end up replacing a newer one
+        if self._saving:
+            self._save_callbacks.append(cb)
+            return
+
+        self._saving = True
+        callbacks = [cb]
+        path = self.path
+        text = self.get_text()
+        # edits made while writing set the buffer modified again, the document is only saved if there were none
+        self.buffer.set_modified(False)
+
+        def work() -> bytes:
+            write_atomic(path, text, fsync=self.save_fsync, backup=self.save_backup)
+            # the hash lets `_check_disk` recognize the file as the one written here
+            return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+        def done(result: bytes | None):
+            self._saving = False
+            saved = result is not None
+
+            if result is not None and path == self.path:
+                self._set_disk_state(path, result)
+
+            # the file was written successfully, set the saved property to True
+            if saved and not self.buffer.get_modified():
+                self.set_saved(True)
+
+            # callback to indicate the result, callback because saving is handled asynchronously
+            for callback in callbacks:
+                if callback:
+                    callback(saved)
+
+            # saves requested while writing get the newest text
+            if self._save_callbacks:
+                pending = self._save_callbacks
+                self._save_callbacks = []
+
+                def notify(saved: bool):
+                    for callback in pending:
+                        if callback:
+                            callback(saved)
+
+                self.write_to_file(notify)
+
+        run_in_worker(work, done)
+
+    def get_text(self) -> str:
+        """
+        retrieves and returns the text from the document's buffer
+        """
+        # retrieve bounds
+        start, end = self.buffer.get_bounds()
+        # get text
+        return self.buffer.get_text(start, end, include_hidden_chars=True)
+
+    def request_new_file_path(self, cb: Callable[[bool], None] | None = None):
+        """
+        Opens a file chooser dialog to request a new file path.
+        If a file is selected, it sets the file path and writes the current text to that file.
+        Callback `cb` is called with `True` if the file was saved successfully, or `False` if no file was selected or an error occurred.
+        """
+        # callback is called when the user selects a file in the dialog
+        def on_save(f: Gio.File | None):
+            # if no file was selected, call the callback with False
+            if not f:
+                if cb:
+                    cb(False)
+                return
+
+            # get the path from the file object
+            path = f.get_path()
+
+            # if the path is None or empty, call the callback with False
+            if not path:
+                if cb:
+                    cb(False)
+                return
+
+            # set the file path and write the text to the file, the callback is called once it is written
+            self.set_file(path)
+            self._detect_language()
+            self.write_to_file(cb)
+
+        # request a new file path using the dialog
+        request_save_file(on_save)
+
+    def highlight(self):
+        """
+        Highlights the text in the document using the highlighter, the work is done on a worker thread.
+        The highlighter reparses the text and reports the lines whose highlighting changed since the last call,
+        it knows about the edits through `_on_insert_text` and `_on_delete_range`.
+        Those lines are highlighted again if they are visible, otherwise once they are scrolled into view.
+        Called by the scheduler, which is told through `done` when the results are applied.
+        """
+        generation = self._scheduler.generation
+        visible = self._visible_lines()
+        # created on the main loop, the worker must not be the one creating it
+        highlighter = self.highlighter
+        # the worker works on a copy, the original is only touched on the main loop
+        highlighted = self._highlighted.copy()
+
+        def work() -> tuple[list[tuple[int, int]], list[tuple[int, int, bytes]]] | None:
+            changed = highlighter.update()
+
+            # the text was edited while parsing, the pass following this one takes care of it
+            if changed is None:
+                return None
+
+            for changed_start, changed_end in changed:
+                highlighted.remove(changed_start, changed_end)
+
+            # views showing the same lines must not highlight them twice
+            spans: list[tuple[int, int, bytes]] = []
+            for start, end in visible:
+                for missing_start, missing_end in highlighted.missing(start, end):
+                    spans.append((missing_start, missing_end, highlighter.highlight_spans(missing_start, missing_end)))
+                    highlighted.add(missing_start, missing_end)
+            return changed, spans
+
+        def apply(result: tuple[list[tuple[int, int]], list[tuple[int, int, bytes]]] | None):
+            self._scheduler.done()
+
+            if not result:
+                return
+
+            changed, spans = result
+
+            # lines were inserted or removed since the update, so the reported line numbers can not be trusted,
+            # not even the first one, since the edits may have moved it. Every line is highlighted again when visible
+            if not self._scheduler.is_current(generation):
+                if changed:
+                    self._highlighted.remove(0, sys.maxsize)
+                return
+
+            for changed_start, changed_end in changed:
+                self._highlighted.remove(changed_start, changed_end)
+
+            for spans_start, spans_end, packed in spans:
+                self._tag_applier.apply(spans_start, spans_end, packed)
+                self._highlighted.add(spans_start, spans_end)
+
+            # the views may have been scrolled while the worker was busy
+            self.highlight_visible()
+
+        run_in_worker(work, apply)
+
+    def _visible_lines(self) -> list[tuple[int, int]]:
+        """returns the ranges of lines that should be highlighted right now, one per view, see `Editor.visible_lines`"""
+        return [view.visible_lines() for view in self._views]
+
+    def highlight_visible(self):
+        """
+        Highlights the lines returned by `_visible_lines` that are not highlighted yet.
+        Does nothing while a highlight pass is pending or a file is loading, since the syntax tree is outdated then,
+        the pass highlights the visible lines anyway.
+        """
+        if self._scheduler.pending or self.get_property("loading"):
+            return
+
+        for start, end in self._visible_lines():
+            for missing_start, missing_end in self._highlighted.missing(start, end):
+                self._highlight_lines(missing_start, missing_end)
+                self._highlighted.add(missing_start, missing_end)
+
+    def _highlight_lines(self, start: int, end: int):
+        """
+        Brings the tags of the lines `start` to `end`, end exclusive, up to date with the ones from the highlighter.
+        """
+        self._tag_applier.apply(start, end, self.highlighter.highlight_spans(start, end))
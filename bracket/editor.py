@@ -1,251 +1,166 @@
 from gi.repository import (
     GObject,
-    Gio,
     Gtk,
-    Pango,
 )  # pyright: ignore[reportMissingModuleSource]
 
-from bracket.dialogs import request_save_file
 import pathlib
-from typing import Any, Callable, cast, final
+from typing import Any, Callable, cast
 
-from bracket.themes import load_theme_from_file
+from bracket.document import Document
 from bracket.utils import Args, KwArgs
-from highlighter import HLEvent, Highlighter
 
-# At some point it will be necessary to seperate file concerns and text concerns into seperate classes but it is enough for now
+
 @Gtk.Template(resource_path="/io/github/bracket/editor.ui")
 class Editor(Gtk.TextView):
     """
     Represents a text editor widget with syntax highlighting capabilities.
-    Inherits from Gtk.TextView and provides methods to open files, save files,
-    and highlight text based on recognized names from a theme.
+    Inherits from Gtk.TextView and shows a `Document`, which holds the text, the file and the highlighting.
+    Several editors may show the same document, edits in one of them show up in all of them.
+    The file methods are passed on to the document.
     """
     __gtype_name__ = "Editor"
 
-    # path to the file beeing edited
-    path: pathlib.Path | None = None
-
-    # internal buffer (GTK class for handling multiline texts, text styling etc)
-    _buffer: Gtk.TextBuffer = cast(
-        Gtk.TextBuffer, Gtk.Template.Child("editor-text-buffer")
-    )
-    # current filename - is a gobject property so it can be bound to the Title of the tabpage and changes automatically when the filename changes (due to saving etc)
+    # mirror the properties of the document, so they can be bound to the tab page showing the editor
     filename: GObject.Property = GObject.Property(type=str, default="Untitled")
-
-    # property indicating wether the file has been saved - gobject so it can be bound to some sort of indicator in the tabbar (not done yet)
     saved: GObject.Property = GObject.Property(type=bool, default=False)
+    loading: GObject.Property = GObject.Property(type=bool, default=False)
+    progress: GObject.Property = GObject.Property(type=float, default=0.0)
+
+    # emitted when loading a file ended, with True if the whole file was loaded and False if loading failed or was cancelled
+    __gsignals__ = {
+        "loaded": (GObject.SignalFlags.RUN_FIRST, None, (bool,)),
+    }
 
-    # list of attribute for the highlighter to be recognized, are loaded from the current theme
-    _recognized_names: list[str] = []
+    # if set only the visible lines (plus a margin) are highlighted, the rest is highlighted lazily when scrolled into view
+    lazy_highlight: bool = True
+    # number of lines above and below the visible ones that are highlighted as well, so scrolling a bit does not show uncolored text
+    highlight_margin: int = 100
 
     # new files are saved by default
-    def __init__(self, saved: bool = False, *_args: Any, **_kwargs: Any):
+    def __init__(self, document: Document | None = None, saved: bool = False, *_args: Any, **_kwargs: Any):
         super().__init__(*_args, **_kwargs)
-        self.set_saved(saved)
-        # load tags to highlight and colors from theme
-        self._load_tags()
-        # create a new highlight and set the language
-        self.highlighter: Highlighter = Highlighter(self._recognized_names)
-        # TODO: make this function recieve an argument with the language name or maybe the file ending so languages other than python can be su
-        self.highlighter.set_language()
-
-    def _load_tags(self):
+        # a new document is created unless an open one is shown
+        self.document: Document = document if document else Document(saved=saved)
+        self.set_buffer(self.document.buffer)
+        self.document.add_view(self)
+
+        for name in ("filename", "saved", "loading", "progress"):
+            self.document.bind_property(name, self, name, GObject.BindingFlags.SYNC_CREATE)
+        self._document_handlers: list[int] = [
+            self.document.connect("loaded", self._on_loaded),
+            self.document.connect("notify::loading", self._on_loading),
+        ]
+        self._on_loading()
+
+        # the vertical adjustment is set by the scrolled window the editor is placed in, its signals drive lazy highlighting
+        self._vadjustment: Gtk.Adjustment | None = None
+        self._vadjustment_handlers: list[int] = []
+        self.connect("notify::vadjustment", self._on_vadjustment_set)
+
+    @property
+    def path(self) -> pathlib.Path | None:
+        """path to the file beeing edited"""
+        return self.document.path
+
+    def _on_loaded(self, _document: Document, completed: bool):
+        """Internal callback for when the document finished loading its file"""
+        self.emit("loaded", completed)
+
+    def _on_loading(self, *_args: Args, **_kwargs: KwArgs):
+        """Internal callback for when the document starts or stops loading, the editor is read-only while it loads"""
+        self.set_editable(not self.document.get_property("loading"))
+
+    def _on_vadjustment_set(self, *_args: Args, **_kwargs: KwArgs):
+        """
+        Internal callback for when the editor is given a new vertical adjustment.
+        Moves the handlers for scrolling and resizing over to it.
+        """
+        if self._vadjustment:
+            for handler in self._vadjustment_handlers:
+                self._vadjustment.disconnect(handler)
+
+        self._vadjustment = self.get_vadjustment()
+        self._vadjustment_handlers = []
+
+        if not self._vadjustment:
+            return
+
+        # value-changed is emitted on scrolling, changed when the size of the view or the text changes
+        self._vadjustment_handlers = [
+            self._vadjustment.connect("value-changed", self._on_scrolled),
+            self._vadjustment.connect("changed", self._on_scrolled),
+        ]
+
+    def _on_scrolled(self, *_args: Args, **_kwargs: KwArgs):
+        """
+        Internal callback for when the visible part of the text changes, highlights the lines that came into view.
         """
-        loads a theme from a JSON file and adds the tags to the text buffer's tag table.
-        The tags provide names to hightlight, as well as color and style.
-        The tags are used by the highlighter to apply styles to the text in the editor.
-        if loading the theme fails, it will simply return without doing anything.
-        The tags are then added to the text buffer's tag table.
+        self.document.highlight_visible()
+
+    def visible_lines(self) -> tuple[int, int]:
+        """
+        returns the range of lines `(start, end)`, end exclusive, that should be highlighted right now:
+        the visible lines plus `highlight_margin` or every line if lazy highlighting is turned off
         """
-        # get the tag table from the text buffer
-        tagtable = self._buffer.get_tag_table()
+        line_count = self.document.buffer.get_line_count()
 
-        # load the theme from the file
-        path = pathlib.Path(__file__).parent.resolve() / "theme.json"
-        theme = load_theme_from_file(path)
+        if not self.lazy_highlight:
+            return 0, line_count
 
-        # if the theme is not loaded, return
-        if not theme:
-            return
+        # the visible rect is in buffer coordinates, so the lines at its top and bottom are the visible ones
+        rect = self.get_visible_rect()
+        top, _ = self.get_line_at_y(rect.y)
+        bottom, _ = self.get_line_at_y(rect.y + rect.height)
 
-        # iterate over the theme and add the tags to the tag table
-        for name, tag in theme:
-            tagtable.add(tag)
-            self._recognized_names.append(name)
+        start = max(top.get_line() - self.highlight_margin, 0)
+        end = min(bottom.get_line() + self.highlight_margin + 1, line_count)
+        return start, end
 
-    @Gtk.Template.Callback()
-    def _on_changed(self, *_args: Args, **_kwargs: KwArgs):
-        """
-        Internal callback for when the text in the editor changes.
-        It sets the editor as unsaved and highlights the text.
-        """
-        self.set_saved(False)
-        self.highlight()
+    def close(self):
+        """stops showing the document, to be called once the editor is not shown anymore. The document closes with its last editor"""
+        for handler in self._document_handlers:
+            self.document.disconnect(handler)
+        self._document_handlers = []
+        self.document.remove_view(self)
 
     def get_filename(self) -> str:
         return cast(str, self.get_property("filename"))
 
     def open_file(self, path: pathlib.Path):
-        """
-        sets `self.path` to the given path, reads the file content and sets it to the editor's buffer.
-        If the file does not exist or isn't a file, it will return without doing anything.
-        """
-        self.set_file(path)
+        """loads a file into the document, see `Document.open_file`"""
+        self.document.open_file(path)
 
-        # if the file path is not set or is not a file, return
-        if not self.path:
-            return
-        if not self.path.is_file():
-            return
+    def cancel_loading(self):
+        """stops loading the file, see `Document.cancel_loading`"""
+        self.document.cancel_loading()
 
-        # read the file content and set it to the editor's buffer
-        with self.path.open("r") as file:
-            self._buffer.set_text(file.read())
-            self.set_saved(True)
+    def set_language(self, name: str):
+        """sets the language used to highlight the text, see `Document.set_language`"""
+        self.document.set_language(name)
 
     def is_saved(self) -> bool:
         """
         returns true if there are changes in the buffer not written to the file
         """
-        return cast(bool, self.get_property("saved"))
+        return self.document.is_saved()
 
     def set_saved(self, v: bool):
-        self.set_property("saved", v)
+        self.document.set_saved(v)
 
     def set_file(self, path: pathlib.Path | str):
-        """sets the internal path and creates it and its parents, sets the title to the files name"""
-
-        # handles the union parameter
-        file_path = pathlib.Path(path) if isinstance(path, str) else path
-
-        # creates the file if it does not exist
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        file_path.touch(exist_ok=True)
-
-        # set the internal path and the filename property
-        self.path = file_path
-        self.set_property("filename", file_path.name)
+        """sets the path of the document, see `Document.set_file`"""
+        self.document.set_file(path)
 
     def write_to_file(self, cb: Callable[[bool], None] | None = None):
-        """
-        writes the current text in the editors buffer to the file specified by `self.path`.
-        If `self.path` is not set, it will request a new file path using `request_new_file_path`.
-        """
-        if not self.path:
-            # the path is not set, request a new file path
-            self.request_new_file_path(cb)
-            return
-
-        try:
-            # ensure the directory exists and create the file if it does not exist
-            self.path.parent.mkdir(parents=True, exist_ok=True)
-            self.path.touch(exist_ok=True)
-
-            # write the text from the buffer to the file
-            with self.path.open("w") as file:
-                start, end = self._buffer.get_bounds()
-                text = self._buffer.get_text(start, end, include_hidden_chars=True)
-                file.write(text)
-
-            # the file was written successfully, set the saved property to True
-            self.set_saved(True)
-
-            # callback to indicate success, callback because request_new_file_path is asynchronously handled
-            if cb:
-                cb(True)
-
-        except Exception as e:
-            print(e)
-            # indicate that saving did not work via callback
-            if cb:
-                cb(False)
+        """writes the text to the file, see `Document.write_to_file`"""
+        self.document.write_to_file(cb)
 
     def get_text(self) -> str:
         """
         retrieves and returns the text from the editor's buffer
         """
-        # retrieve bounds
-        start, end = self._buffer.get_bounds()
-        # get text
-        return self._buffer.get_text(start, end, include_hidden_chars=True)
+        return self.document.get_text()
 
     def request_new_file_path(self, cb: Callable[[bool], None] | None = None):
-        """
-        Opens a file chooser dialog to request a new file path.
-        If a file is selected, it sets the file path and writes the current text to that file.
-        Callback `cb` is called with `True` if the file was saved successfully, or `False` if no file was selected or an error occurred.
-        """
-        # callback is called when the user selects a file in the dialog
-        def on_save(f: Gio.File | None):
-            # if no file was selected, call the callback with False
-            if not f:
-                if cb:
-                    cb(False)
-                return
-
-            # get the path from the file object
-            path = f.get_path()
-
-            # if the path is None or empty, call the callback with False
-            if not path:
-                if cb:
-                    cb(False)
-                return
-
-            # set the file path and write the text to the file
-            self.set_file(path)
-            self.write_to_file()
-
-            # if the file was written successfully, call the callback with True
-            if cb:
-                cb(True)
-
-        # request a new file path using the dialog
-        request_save_file(on_save)
-
-    def highlight(self):
-        """
-        Highlights the text in the editor using the highlighter.
-        """
-        # TODO: support for multiple languages, currently only supports python (should be the matter of an hour or less)
-        # retrieve the text from the buffer
-        text = self.get_text()
-
-        # retrieve highlighter events - contain information on highlight type, where it starts and ends
-        events = self.highlighter.highlight(text)
-
-        # tag to store the current highlight type
-        tag: str | None = None
-
-        # remove all previous and therefore invalid tags in the buffer
-        bounds = self._buffer.get_bounds()
-        self._buffer.remove_all_tags(*bounds)
-
-        # iterate over the events and apply the tags to the buffer
-        for event in events:
-
-            # match the event type and handle accordingly
-            match event:
-                # Start event indicates a new highlight type
-                case HLEvent.Start():
-                    (tag,) = event
-
-                # Source event tells to highlight a specific area
-                case HLEvent.Source():
-                    # retrieve start and end iter (iters are necessary for gtk)
-                    (start, end) = event
-                    start_iter = self._buffer.get_iter_at_offset(start)
-                    end_iter = self._buffer.get_iter_at_offset(end)
-
-                    # if a tag is set apply it to the area
-                    if tag:
-                        self._buffer.apply_tag_by_name(tag, start_iter, end_iter)
-
-                # Remove the current tag as it has ended
-                case HLEvent.End():
-                    tag = None
-
-                # falback for god knows
-                case _:
-                    pass
+        """asks for a path and saves the document there, see `Document.request_new_file_path`"""
+        self.document.request_new_file_path(cb)
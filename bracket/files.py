@@ -0,0 +1,49 @@
+import os
+import pathlib
+import shutil
+import uuid
+
+
+def write_atomic(path: pathlib.Path, text: str | bytes, fsync: bool = True, backup: bool = False):
+    """
+    writes `text`, as UTF-8 or as it is if it is bytes, to `path` so that the file either keeps its old content or has the new one, even if writing fails midway.
+    The text goes to a temporary file next to `path` first which then replaces `path`.
+    With `fsync` the data is flushed to disk before replacing, with `backup` the old file is kept as `path~`.
+    Symlinks are followed, so the file they point to is replaced and not the link. Raises OSError if writing fails.
+    """
+    # replacing a symlink would replace the link itself
+    target = path.resolve() if path.is_symlink() else path
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    # the temporary file has to be in the same directory, renaming is only atomic within a file system
+    temporary = target.with_name(f".{target.name}.{uuid.uuid4().hex[:8]}.tmp")
+
+    try:
+        # 0o666 minus the umask, the permissions a new file gets anyway
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        data = text if isinstance(text, bytes) else text.encode("utf-8")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+
+        # the new file keeps the permissions of the old one
+        if target.exists():
+            shutil.copymode(target, temporary)
+            if backup:
+                shutil.copy2(target, target.with_name(f"{target.name}~"))
+
+        os.replace(temporary, target)
+
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+
+    # makes the rename itself durable
+    if fsync:
+        directory = os.open(target.parent, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
@@ -0,0 +1,157 @@
+import pathlib
+import re
+from typing import cast
+
+import gi
+
+gi.require_version("Gtk", "4.0")
+gi.require_version("Adw", "1")
+
+from gi.repository import Gtk, GLib, GObject, Adw, Gio, Pango  # pyright: ignore[reportMissingModuleSource]
+
+from bracket.search import FileSearch, SearchMatch, compile_query, warm_up
+from bracket.trigram_index import TrigramIndex, required_literals
+from bracket.utils import Args
+
+
+class SearchResult(GObject.Object):
+    """a line containing a match, the item of the results list"""
+
+    def __init__(self, match: SearchMatch):
+        super().__init__()
+        self.path, self.line, self.column, self.text = match
+
+
+class FindInFiles(Adw.Dialog):
+    """
+    Dialog to search the text of all files below the working directory, see `FileSearch`.
+    Matches are listed while the search runs, changing the query stops it and starts a new one.
+    Activating a match opens its file at its line. The dialog is kept by its window, so the last query and its matches
+    are still there when it is opened again. With a text index only the files it finds are searched, once it is ready.
+    """
+
+    # queries shorter than this match too much to be worth searching
+    min_query_length: int = 2
+
+    def __init__(self, root: pathlib.Path, index: TrigramIndex | None = None):
+        super().__init__(title="Find in Files", content_width=800, content_height=560)
+        self.root: pathlib.Path = root
+        self._index: TrigramIndex | None = index
+        self._search: FileSearch | None = None
+
+        self._entry: Gtk.SearchEntry = Gtk.SearchEntry(placeholder_text="Search in files", hexpand=True, search_delay=200)
+        self._entry.connect("search-changed", self._on_query_changed)
+        self._entry.connect("activate", self._on_entry_activate)
+        self._entry.connect("stop-search", lambda *_args: self.close())
+
+        self._regex: Gtk.ToggleButton = Gtk.ToggleButton(label=".*", tooltip_text="Regular Expression")
+        self._regex.connect("toggled", self._on_query_changed)
+
+        query_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        query_box.append(self._entry)
+        query_box.append(self._regex)
+
+        self._results: Gio.ListStore = Gio.ListStore.new(SearchResult)
+        self._selection: Gtk.SingleSelection = Gtk.SingleSelection(model=self._results)
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self._on_factory_setup)
+        factory.connect("bind", self._on_factory_bind)
+
+        self._list: Gtk.ListView = Gtk.ListView(model=self._selection, factory=factory, single_click_activate=True)
+        self._list.connect("activate", self._on_list_activate)
+
+        scrolled = Gtk.ScrolledWindow(child=self._list, vexpand=True)
+        self._status: Gtk.Label = Gtk.Label(xalign=0, css_classes=["dim-label", "caption"])
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        for widget in (query_box, scrolled, self._status):
+            box.append(widget)
+        box.set_margin_top(12)
+        box.set_margin_bottom(12)
+        box.set_margin_start(12)
+        box.set_margin_end(12)
+
+        self.set_child(box)
+        self.set_focus(self._entry)
+
+        # the search processes take a moment to start, they do so while the query is typed
+        warm_up()
+
+    def stop(self):
+        """stops the running search"""
+        if self._search:
+            self._search.cancel()
+            self._search = None
+
+    def _on_query_changed(self, *_args: Args):
+        self.stop()
+        self._results.remove_all()
+
+        query = self._entry.get_text()
+        if len(query) < self.min_query_length:
+            self._status.set_text("")
+            return
+
+        try:
+            pattern, flags = compile_query(query, self._regex.get_active())
+        except re.error as e:
+            self._status.set_text(f"Invalid regular expression: {e}")
+            return
+
+        # without a ready index every file is searched
+        paths = self._index.candidates(required_literals(query, self._regex.get_active())) if self._index else None
+        self._search = FileSearch(self.root, pattern, flags, self._on_matches, self._on_done, paths)
+        self._search.start()
+        self._status.set_text("Searching…")
+
+    def _on_matches(self, matches: list[SearchMatch]):
+        """Internal callback for when a batch of files was searched"""
+        self._results.splice(self._results.get_n_items(), 0, [SearchResult(match) for match in matches])
+        if self._search:
+            self._status.set_text(f"Searching… {self._search.match_count} matches in {self._search.file_count} files")
+
+    def _on_done(self):
+        """Internal callback for when the search is done"""
+        search = self._search
+        if not search:
+            return
+
+        limit = " (stopped at the limit)" if search.match_count >= search.max_matches else ""
+        index = f" · {self._index.describe()}" if self._index else ""
+        self._status.set_text(f"{search.match_count} matches in {search.file_count} files{limit}{index}")
+
+    def _on_entry_activate(self, *_args: Args):
+        self._open(self._selection.get_selected())
+
+    def _on_list_activate(self, _list: Gtk.ListView, position: int):
+        self._open(position)
+
+    def _open(self, position: int):
+        """opens the file of the match at a position of the list at its line and closes the dialog"""
+        result = cast(SearchResult | None, self._results.get_item(position))
+        if not result:
+            return
+
+        path = self.root / result.path
+        self.activate_action("win.file-path-open", GLib.Variant("(si)", (str(path), result.line)))
+        self.close()
+
+    def _on_factory_setup(self, _factory: Gtk.SignalListItemFactory, list_item: Gtk.ListItem):
+        location = Gtk.Label(xalign=0, ellipsize=Pango.EllipsizeMode.START, css_classes=["dim-label", "caption"])
+        text = Gtk.Label(xalign=0, ellipsize=Pango.EllipsizeMode.END, css_classes=["monospace"])
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        box.append(location)
+        box.append(text)
+        list_item.set_child(box)
+
+    def _on_factory_bind(self, _factory: Gtk.SignalListItemFactory, list_item: Gtk.ListItem):
+        result = cast(SearchResult, list_item.get_item())
+        box = cast(Gtk.Box, list_item.get_child())
+        location = cast(Gtk.Label, box.get_first_child())
+        text = cast(Gtk.Label, location.get_next_sibling())
+
+        # lines are counted from 1 for people
+        location.set_text(f"{result.path}:{result.line + 1}")
+        text.set_text(result.text.strip())
@@ -20,4 +20,13 @@ class __End(HLEvent):
 class Highlighter:
     def __init__(self, recognized_names: list[str]) -> None: ...
     def highlight(self, code: str) -> list[HLEvent]: ...
-    def set_language(self) -> None: ...
+    def set_language(self, name: str = "python") -> None: ...
+    def edit(self, start: tuple[int, int], old_end: tuple[int, int], text: str) -> None: ...
+    def update(self) -> list[tuple[int, int]] | None: ...
+    def highlight_lines(self, start: int, end: int) -> list[HLEvent]: ...
+    def highlight_spans(self, start: int, end: int) -> bytes: ...
+
+
+def language_for_file(path: str, first_line: str) -> str | None: ...
+def load_language(name: str) -> float: ...
+def loaded_languages() -> dict[str, float]: ...
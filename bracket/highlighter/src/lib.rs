@@ -1,9 +1,13 @@
 use pyo3::prelude::*;
 mod hl;
+mod registry;
 
 #[pymodule(name = "highlighter")]
 fn highlighter(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_class::<hl::Highlighter>()?;
     m.add_class::<hl::HLEvent>()?;
+    m.add_function(wrap_pyfunction!(registry::language_for_file, m)?)?;
+    m.add_function(wrap_pyfunction!(registry::load_language, m)?)?;
+    m.add_function(wrap_pyfunction!(registry::loaded_languages, m)?)?;
     Ok(())
 }
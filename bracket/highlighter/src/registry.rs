@@ -0,0 +1,131 @@
+use pyo3::prelude::*;
+use std::collections::HashMap;
+use std::path::Path;
+use std::sync::{Arc, OnceLock};
+use std::time::{Duration, Instant};
+use tree_sitter::{Language, LanguageFn, Query};
+
+use crate::hl::HighlighterError;
+
+// a language the highlighter knows about, grammars for new languages only need an entry in `LANGUAGES`
+struct LanguageInfo {
+    name: &'static str,
+    // file extensions without the leading dot
+    extensions: &'static [&'static str],
+    // interpreters named in a shebang, matched as prefix so versions like python3.12 are found too
+    interpreters: &'static [&'static str],
+    language: LanguageFn,
+    highlights_query: &'static str,
+}
+
+const LANGUAGES: &[LanguageInfo] = &[LanguageInfo {
+    name: "python",
+    extensions: &["py", "pyi", "pyw"],
+    interpreters: &["python"],
+    language: tree_sitter_python::LANGUAGE,
+    highlights_query: tree_sitter_python::HIGHLIGHTS_QUERY,
+}];
+
+// compiled grammar of a language, shared by all highlighters using the language
+pub struct Grammar {
+    pub language: Language,
+    pub query: Query,
+    pub load_time: Duration,
+}
+
+// grammars are compiled on first use and kept for the lifetime of the process
+static GRAMMARS: [OnceLock<Arc<Grammar>>; LANGUAGES.len()] =
+    [const { OnceLock::new() }; LANGUAGES.len()];
+
+fn index_of(name: &str) -> Option<usize> {
+    LANGUAGES.iter().position(|info| info.name == name)
+}
+
+// returns the compiled grammar of a language and whether it was compiled by this call
+pub fn grammar(name: &str) -> Result<(Arc<Grammar>, bool), HighlighterError> {
+    let Some(index) = index_of(name) else {
+        return Err(HighlighterError::new(format!("Unknown language {name}")));
+    };
+
+    if let Some(grammar) = GRAMMARS[index].get() {
+        return Ok((grammar.clone(), false));
+    }
+
+    let info = &LANGUAGES[index];
+    let start = Instant::now();
+    let language: Language = info.language.into();
+    let query = match Query::new(&language, info.highlights_query) {
+        Ok(query) => query,
+        Err(e) => {
+            eprintln!("{e}");
+            return Err(HighlighterError::new(
+                "Could not create Highlighter Function".into(),
+            ));
+        }
+    };
+
+    let grammar = Arc::new(Grammar {
+        language,
+        query,
+        load_time: start.elapsed(),
+    });
+
+    // another thread may have compiled the grammar in the meantime, its grammar is kept then
+    match GRAMMARS[index].set(grammar.clone()) {
+        Ok(()) => Ok((grammar, true)),
+        Err(_) => Ok((GRAMMARS[index].get().unwrap().clone(), false)),
+    }
+}
+
+// interpreter named by a shebang line, either directly or through env
+fn interpreter(first_line: &str) -> Option<&str> {
+    let mut parts = first_line.strip_prefix("#!")?.split_whitespace();
+    let program = Path::new(parts.next()?).file_name()?.to_str()?;
+
+    if program != "env" {
+        return Some(program);
+    }
+    // skips options of env like -S
+    parts.find(|part| !part.starts_with('-'))
+}
+
+/// returns the name of the language of a file, judged by its extension or else by the shebang in its first line.
+/// returns None if the language is not known
+#[pyfunction]
+pub fn language_for_file(path: &str, first_line: &str) -> Option<&'static str> {
+    let extension = Path::new(path).extension().and_then(|e| e.to_str());
+
+    if let Some(extension) = extension {
+        let info = LANGUAGES.iter().find(|info| info.extensions.contains(&extension));
+        if let Some(info) = info {
+            return Some(info.name);
+        }
+    }
+
+    let interpreter = interpreter(first_line)?;
+    LANGUAGES
+        .iter()
+        .find(|info| info.interpreters.iter().any(|i| interpreter.starts_with(i)))
+        .map(|info| info.name)
+}
+
+/// compiles the grammar of a language if that did not happen yet.
+/// returns the time spent compiling in seconds, 0 if the grammar was compiled before
+#[pyfunction]
+pub fn load_language(py: Python<'_>, name: &str) -> PyResult<f64> {
+    match py.allow_threads(|| grammar(name)) {
+        Ok((grammar, true)) => Ok(grammar.load_time.as_secs_f64()),
+        Ok((_, false)) => Ok(0.0),
+        Err(e) => Err(e.into()),
+    }
+}
+
+/// returns the languages compiled so far together with the time compiling them took in seconds
+#[pyfunction]
+pub fn loaded_languages() -> HashMap<&'static str, f64> {
+    LANGUAGES
+        .iter()
+        .zip(GRAMMARS.iter())
+        .filter_map(|(info, grammar)| Some((info.name, grammar.get()?.load_time.as_secs_f64())))
+        .collect()
+}
@@ -0,0 +1,95 @@
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+
+class StartupProfile:
+    """
+    Records how long the phases of starting the app take and runs the work that is not needed for the first frame after it.
+    Phases are only recorded while profiling is enabled with `--profile-startup`, the report is printed to stderr once the first
+    frame is drawn. Phases recorded afterwards, like deferred work, are printed as they end, so regressions in them show up as well.
+    Work passed to `defer` runs right away unless the app announced with `wait_for_first_frame` that it is about to draw it.
+    """
+
+    def __init__(self):
+        self.enabled: bool = False
+        # perf_counter time the process started at, as far as python can tell
+        self._start: float = time.perf_counter()
+        # (name, nesting depth, start relative to `_start`, duration) of the recorded phases, in the order they started
+        self._phases: list[tuple[str, int, float, float]] = []
+        self._depth: int = 0
+        self._waiting: bool = False
+        self._reported: bool = False
+        self._deferred: list[tuple[str, Callable[[], None]]] = []
+
+    def enable(self, start: float | None = None):
+        """turns recording on, `start` is the perf_counter time the process started at if it was taken before this module was imported"""
+        self.enabled = True
+        if start is not None:
+            self._start = start
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """records the time the body of the with statement takes as the phase `name`, phases may be nested"""
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        index = len(self._phases)
+        self._phases.append((name, self._depth, start - self._start, 0.0))
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            duration = time.perf_counter() - start
+            self._phases[index] = (name, self._depth, start - self._start, duration)
+            if self._reported and self._depth == 0:
+                print(self._format(self._phases[index]), file=sys.stderr)
+
+    def wait_for_first_frame(self):
+        """from now on deferred work waits for `first_frame`"""
+        if not self._reported:
+            self._waiting = True
+
+    def defer(self, name: str, work: Callable[[], None]):
+        """runs `work` once the first frame is drawn, recorded as the phase `name`"""
+        if self._waiting:
+            self._deferred.append((name, work))
+            return
+
+        with self.phase(name):
+            work()
+
+    def first_frame(self):
+        """to be called once the first frame is drawn, prints the report and runs the deferred work"""
+        if not self._waiting:
+            return
+
+        self._waiting = False
+        if self.enabled:
+            self._phases.append(("first frame", 0, time.perf_counter() - self._start, 0.0))
+            print(self.report(), file=sys.stderr)
+        self._reported = True
+
+        deferred = self._deferred
+        self._deferred = []
+        for name, work in deferred:
+            with self.phase(name):
+                work()
+
+    def report(self) -> str:
+        """returns the recorded phases, one per line"""
+        return "\n".join(["startup profile:", *(self._format(phase) for phase in self._phases)])
+
+    @staticmethod
+    def _format(phase: tuple[str, int, float, float]) -> str:
+        name, depth, start, duration = phase
+        width = max(32 - 2 * depth, 0)
+        return f"  +{start * 1000:8.1f}ms {'  ' * depth}{name:<{width}} {duration * 1000:8.1f}ms"
+
+
+# the profile of this process
+startup: StartupProfile = StartupProfile()
@@ -0,0 +1,724 @@
+from array import array
+import heapq
+from itertools import accumulate, repeat
+import operator
+import os
+import pathlib
+import re
+import string
+import threading
+from typing import Callable, Iterator
+
+from gi.repository import GLib, Gio  # pyright: ignore[reportMissingModuleSource]
+
+from bracket.workers import run_in_worker
+
+# compiled rules of a .gitignore: (pattern, negated, only matches directories)
+type IgnoreRule = tuple[re.Pattern[str], bool, bool]
+# the rules in effect in a directory: (directory relative to the root, rules of its .gitignore), from the root down
+type IgnoreChain = tuple[tuple[str, tuple[IgnoreRule, ...]], ...]
+# what sweeping the unwatched directories finds: (mtime in ns, size) of their files, the files and directories of
+# directories added to them, and the directories that are gone
+type Sweep = tuple[dict[str, tuple[int, int]], list[str], list[tuple[str, IgnoreChain]], set[str]]
+
+
+def _translate(pattern: str) -> str:
+    """translates a gitignore glob into a regular expression, `*` and `?` do not match `/`, `**` matches across directories"""
+    res: list[str] = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            res.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            res.append(".*")
+            i += 2
+            continue
+
+        if c == "*":
+            res.append("[^/]*")
+        elif c == "?":
+            res.append("[^/]")
+        elif c == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            chars = pattern[i + 1:end].replace("\\", "\\\\")
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            res.append(f"[{chars}]")
+            i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            res.append(re.escape(pattern[i]))
+        else:
+            res.append(re.escape(c))
+        i += 1
+
+    return "".join(res)
+
+
+def parse_gitignore(text: str) -> tuple[IgnoreRule, ...]:
+    """compiles the lines of a .gitignore, comments and empty lines are left out"""
+    rules: list[IgnoreRule] = []
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+
+        negated = line.startswith("!")
+        if negated or line.startswith("\\"):
+            line = line[1:]
+
+        directory_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+
+        # patterns with a slash are relative to the directory of the .gitignore, others match in any directory below it
+        anchored = "/" in line
+        regex = _translate(line.lstrip("/"))
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+        rules.append((re.compile(regex + r"\Z"), negated, directory_only))
+
+    return tuple(rules)
+
+
+def is_ignored(chain: IgnoreChain, path: str, is_dir: bool) -> bool:
+    """returns whether a path relative to the root is ignored, the last matching rule decides like in git"""
+    ignored = False
+    for base, rules in chain:
+        relative = path[len(base) + 1:] if base else path
+        for regex, negated, directory_only in rules:
+            if directory_only and not is_dir:
+                continue
+            if regex.match(relative):
+                ignored = not negated
+    return ignored
+
+
+def read_ignore_chain(root: pathlib.Path, directory: str, chain: IgnoreChain) -> IgnoreChain:
+    """returns `chain` extended by the rules of the .gitignore of a directory relative to the root, if it has one"""
+    try:
+        text = (root / directory / ".gitignore").read_text(encoding="utf-8", errors="replace")
+    except OSError:
+        return chain
+
+    rules = parse_gitignore(text)
+    return (*chain, (directory, rules)) if rules else chain
+
+
+def crawl(
+    root: pathlib.Path, directory: str, chain: IgnoreChain, cancelled: threading.Event, batch_size: int
+) -> Iterator[tuple[list[str], list[tuple[str, IgnoreChain]]]]:
+    """
+    walks the files below a directory relative to the root and yields them in batches of about `batch_size`,
+    together with the directories walked meanwhile and the ignore rules in effect in them.
+    Hidden and ignored entries are left out, symlinked directories are not followed so links can not form loops.
+    """
+    stack: list[tuple[str, IgnoreChain]] = [(directory, chain)]
+    files: list[str] = []
+    directories: list[tuple[str, IgnoreChain]] = []
+
+    while stack:
+        if cancelled.is_set():
+            return
+
+        directory, chain = stack.pop()
+        chain = read_ignore_chain(root, directory, chain)
+        directories.append((directory, chain))
+
+        try:
+            with os.scandir(root / directory) as entries:
+                for entry in entries:
+                    # Skip hidden files/directories, like the directory tree does
+                    if entry.name.startswith("."):
+                        continue
+
+                    path = f"{directory}/{entry.name}" if directory else entry.name
+                    try:
+                        is_dir = entry.is_dir()
+                        if is_dir and entry.is_symlink():
+                            continue
+                    except OSError:
+                        continue
+
+                    if is_ignored(chain, path, is_dir):
+                        continue
+
+                    if is_dir:
+                        stack.append((path, chain))
+                    else:
+                        files.append(path)
+        except OSError:
+            continue
+
+        if len(files) >= batch_size:
+            yield files, directories
+            files, directories = [], []
+
+    yield files, directories
+
+
+def _is_below(directory: str, path: str) -> bool:
+    """whether a path relative to the root is a directory or lies below it, everything lies below the root"""
+    return not directory or path == directory or path.startswith(f"{directory}/")
+
+
+def _length_key(path: str) -> tuple[int, str]:
+    return len(path), path
+
+
+# matches the candidates in the bytes made from a candidate mask, one byte per path
+_CANDIDATE = re.compile(b"\x01")
+
+
+class PathMatcher:
+    """
+    Finds paths by the chars of a query, see `match`. Built once from a list of paths, which takes a while for large projects
+    and is meant to happen on a worker thread, and not changed afterwards.
+    Paths are sorted from the shortest to the longest. For every char typed there is a column, a bitmask of the paths containing it,
+    so the candidates for a query are found by and-ing the columns of its chars before the order of the chars is checked.
+    """
+
+    # chars whose column is built along with the matcher
+    column_chars: str = string.ascii_lowercase + string.digits + "._-"
+    # at most this many candidates are ranked, the shortest ones since paths are sorted by length
+    score_limit: int = 1000
+
+    def __init__(self, paths: list[str]):
+        self.paths: list[str] = sorted(paths, key=_length_key)
+        lowered = [path.lower() for path in self.paths]
+        # the paths lowercased and joined with newlines, and the offset of every path in it.
+        # lowercasing may change the length of a path, so the offsets are taken from the lowercased paths
+        self._text: str = "\n".join(lowered)
+        self._starts: array[int] = array("Q", accumulate((len(path) + 1 for path in lowered[:-1]), initial=0))
+        # one byte per path, 1 if it contains the char, read as a little endian integer
+        self._columns: dict[str, int] = {
+            c: int.from_bytes(bytes(map(operator.contains, lowered, repeat(c))), "little") for c in self.column_chars
+        }
+        self._all: int = int.from_bytes(b"\x01" * len(lowered), "little")
+        # the last query, the indexes of all paths before `resume` matching it, and `resume`
+        self._cache: tuple[str, list[int], int] | None = None
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def match(self, query: str, limit: int = 50) -> list[str]:
+        """
+        returns up to `limit` paths containing the chars of `query` in that order, ignoring case and whitespace, best first.
+        Matches in the file name come before matches in the directories, contiguous matches before scattered ones,
+        short paths before long ones.
+        """
+        needle = "".join(query.lower().split())
+        if not needle:
+            return self.paths[:limit]
+
+        chars = [re.escape(c) for c in needle]
+        # every char is looked for from the previous one on without backtracking, so a path is scanned once
+        scan = re.compile("".join(f"[^{c}\n]*+{c}" for c in chars))
+        # the shortest span containing the chars, to rank how contiguous a match is
+        fuzzy = re.compile(".*?".join(chars))
+
+        candidates = self._candidates(needle, scan)
+        # ties go to the shorter path, which comes first
+        scored = [(self._score(needle, fuzzy, self.paths[i].lower()), -i) for i in candidates]
+        return [self.paths[-negated] for _, negated in heapq.nlargest(limit, scored)]
+
+    def _candidates(self, needle: str, scan: re.Pattern[str]) -> list[int]:
+        """returns the indexes of up to `score_limit` matching paths, the shortest ones"""
+        candidates: list[int] = []
+        resume = 0
+        # typing on narrows down the candidates of the previous query, paths after them are only checked if too few are left
+        if self._cache and needle.startswith(self._cache[0]):
+            _, previous, resume = self._cache
+            candidates = [i for i in previous if scan.match(self._text, self._starts[i])]
+
+        if len(candidates) < self.score_limit and resume < len(self.paths):
+            mask = self._all
+            for c in set(needle):
+                mask &= self._column(c)
+
+            start, resume = resume, len(self.paths)
+            for m in _CANDIDATE.finditer(mask.to_bytes(len(self.paths), "little"), start):
+                i = m.start()
+                if scan.match(self._text, self._starts[i]):
+                    candidates.append(i)
+                    if len(candidates) >= self.score_limit:
+                        resume = i + 1
+                        break
+
+        self._cache = (needle, candidates, resume)
+        return candidates
+
+    def _column(self, c: str) -> int:
+        """returns the column of a char, the columns of uncommon chars are built when they are first typed"""
+        column = self._columns.get(c)
+        if column is None:
+            column = int.from_bytes(bytes(map(operator.contains, self._text.split("\n"), repeat(c))), "little")
+            self._columns[c] = column
+        return column
+
+    @staticmethod
+    def _score(needle: str, fuzzy: re.Pattern[str], path: str) -> int:
+        name = path[path.rfind("/") + 1:]
+        if name.startswith(needle):
+            score = 3000
+        elif needle in name:
+            score = 2000
+        elif needle in path:
+            score = 1000
+        else:
+            # the fewer chars between the matched ones the better
+            m = fuzzy.search(path)
+            score = 500 - (m.end() - m.start() - len(needle)) if m else 0
+        return score - len(path)
+
+
+class ProjectIndex:
+    """
+    Paths of all files below a directory, relative to it, to find files by typing a part of their name.
+    The files are collected by a crawler on a worker thread, which respects .gitignore files and skips hidden entries,
+    and kept up to date by watching the directories. Directories beyond the limit of watched ones are looked through
+    for changes on a worker every `sweep_interval` instead. Searching goes through `matcher`, which is rebuilt on a worker
+    whenever the paths changed, so it lags a moment behind the directory.
+    """
+
+    batch_size: int = 5000
+    # directories beyond this many are not watched, file monitors are limited by the system
+    max_watched_directories: int = 4096
+    # changes are collected for this many milliseconds and applied together
+    merge_interval: int = 200
+    # while paths keep changing, like during the crawl, the matcher is rebuilt at most once per this many milliseconds
+    rebuild_interval: int = 500
+    # directories that are not watched are looked through for changes once per this many milliseconds
+    sweep_interval: int = 5000
+
+    def __init__(self, root: pathlib.Path):
+        self.root: pathlib.Path = root
+        # whether the crawler walked the whole directory
+        self.complete: bool = False
+        # the paths found so far, in no particular order
+        self._paths: list[str] = []
+        self._members: set[str] = set()
+        # matcher of the paths as they were when it was built last, None until it was built once
+        self.matcher: PathMatcher | None = None
+        self._rebuild_source: int = 0
+        self._rebuilding: bool = False
+        # whether the paths changed since the matcher was built
+        self._stale: bool = False
+        self._cancelled: threading.Event = threading.Event()
+        # watched directories and the ignore rules in effect in them, by their path relative to the root
+        self._monitors: dict[str, Gio.FileMonitor] = {}
+        self._chains: dict[str, IgnoreChain] = {}
+        self._unwatched: list[tuple[str, IgnoreChain]] = []
+        self._watch_source: int = 0
+        # directories that are not watched, since the limit was reached or watching failed, and the ignore rules in effect in them.
+        # Changes in them are found by sweeping, see `_sweep`
+        self.unwatched_directories: dict[str, IgnoreChain] = {}
+        # (mtime in ns, size) of the files of the unwatched directories at the last sweep, and the directories swept
+        self._stats: dict[str, tuple[int, int]] = {}
+        self._swept: set[str] = set()
+        self._sweep_source: int = 0
+        self._sweeping: bool = False
+        # paths changed since the last update with whether they were added (True), removed (False) or written to (None)
+        self._pending: dict[str, bool | None] = {}
+        # watched directories whose .gitignore was added, removed or written to since the last update
+        self._ignores_changed: set[str] = set()
+        self._merge_source: int = 0
+        # called whenever a new matcher is ready
+        self.on_changed: Callable[[], None] | None = None
+        # called with the paths of files that were added, removed or written to after the crawl, for indexes of their content
+        self.on_files_changed: Callable[[set[str]], None] | None = None
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def match(self, query: str, limit: int = 50) -> list[str]:
+        """returns up to `limit` paths matching `query` best first, see `PathMatcher.match`. Nothing until the matcher was built"""
+        return self.matcher.match(query, limit) if self.matcher else []
+
+    def start(self):
+        """starts crawling the directory on a worker thread, the paths become available batch by batch"""
+        root = self.root
+        cancelled = self._cancelled
+
+        def work():
+            for files, directories in crawl(root, "", (), cancelled, self.batch_size):
+                GLib.idle_add(self._on_batch, files, directories)
+
+        run_in_worker(work, self._on_crawled)
+
+    def stop(self):
+        """stops crawling and watching, the index must not be used afterwards"""
+        self._cancelled.set()
+        for monitor in self._monitors.values():
+            monitor.cancel()
+        self._monitors.clear()
+        for source in (self._watch_source, self._merge_source, self._rebuild_source, self._sweep_source):
+            if source:
+                GLib.source_remove(source)
+        self._watch_source = self._merge_source = self._rebuild_source = self._sweep_source = 0
+
+    def _on_batch(self, files: list[str], directories: list[tuple[str, IgnoreChain]]) -> bool:
+        """Internal callback for when the crawler found a batch of files"""
+        if self._cancelled.is_set():
+            return GLib.SOURCE_REMOVE
+
+        self._add(files)
+        self._watch(directories)
+        return GLib.SOURCE_REMOVE
+
+    def _on_crawled(self, _result: None):
+        """Internal callback for when the crawler is done"""
+        if self._cancelled.is_set():
+            return
+
+        self.complete = True
+        # the last batch should not wait for the rebuild interval
+        if self._rebuild_source:
+            GLib.source_remove(self._rebuild_source)
+            self._rebuild_source = 0
+            self._rebuild()
+
+    def _invalidate(self):
+        """rebuilds the matcher once the rebuild interval passed, or after the running rebuild"""
+        self._stale = True
+        if not self._rebuild_source and not self._rebuilding:
+            self._rebuild_source = GLib.timeout_add(self.rebuild_interval, self._on_rebuild_timeout)
+
+    def _on_rebuild_timeout(self) -> bool:
+        self._rebuild_source = 0
+        self._rebuild()
+        return GLib.SOURCE_REMOVE
+
+    def _rebuild(self):
+        self._stale = False
+        self._rebuilding = True
+        paths = list(self._paths)
+        run_in_worker(lambda: PathMatcher(paths), self._on_rebuilt)
+
+    def _on_rebuilt(self, matcher: PathMatcher | None):
+        """Internal callback for when a matcher was built on a worker"""
+        self._rebuilding = False
+        if self._cancelled.is_set():
+            return
+
+        if matcher is not None:
+            self.matcher = matcher
+            if self.on_changed:
+                self.on_changed()
+        if self._stale:
+            self._invalidate()
+
+    def _watch(self, directories: list[tuple[str, IgnoreChain]]):
+        """watches directories for changes, monitors are created in small steps so the main loop is not blocked"""
+        self._unwatched.extend(directories)
+        if not self._watch_source:
+            self._watch_source = GLib.idle_add(self._on_watch_idle, priority=GLib.PRIORITY_LOW)
+
+    def _on_watch_idle(self) -> bool:
+        for _ in range(100):
+            if not self._unwatched or len(self._monitors) >= self.max_watched_directories:
+                self.unwatched_directories.update(self._unwatched)
+                self._unwatched.clear()
+                self._watch_source = 0
+                self._schedule_sweep()
+                return GLib.SOURCE_REMOVE
+
+            directory, chain = self._unwatched.pop()
+            try:
+                monitor = Gio.File.new_for_path(str(self.root / directory)).monitor_directory(
+                    Gio.FileMonitorFlags.WATCH_MOVES, None
+                )
+            except GLib.Error as e:
+                print(e)
+                self.unwatched_directories[directory] = chain
+                continue
+
+            monitor.connect("changed", self._on_changed, directory)
+            self._monitors[directory] = monitor
+            self._chains[directory] = chain
+
+        return GLib.SOURCE_CONTINUE
+
+    def _schedule_sweep(self):
+        if self.unwatched_directories and not self._sweep_source and not self._sweeping and not self._cancelled.is_set():
+            self._sweep_source = GLib.timeout_add(self.sweep_interval, self._on_sweep_timeout)
+
+    def _on_sweep_timeout(self) -> bool:
+        self._sweep_source = 0
+        if not self._sweeping:
+            self._sweep()
+        return GLib.SOURCE_REMOVE
+
+    def _sweep(self):
+        """
+        looks through the unwatched directories for files added, removed or written to since the last sweep on a worker,
+        directories added to them are crawled. The first sweep of a directory only records the state of its files
+        """
+        root = self.root
+        cancelled = self._cancelled
+        directories = dict(self.unwatched_directories)
+        known = set(directories) | set(self._monitors)
+        self._sweeping = True
+
+        def work() -> Sweep:
+            stats: dict[str, tuple[int, int]] = {}
+            files: list[str] = []
+            walked: list[tuple[str, IgnoreChain]] = []
+            gone: set[str] = set()
+            for directory, chain in directories.items():
+                if cancelled.is_set():
+                    break
+                try:
+                    with os.scandir(root / directory) as entries:
+                        found = list(entries)
+                except FileNotFoundError:
+                    gone.add(directory)
+                    continue
+                except OSError:
+                    continue
+
+                for entry in found:
+                    path = f"{directory}/{entry.name}" if directory else entry.name
+                    try:
+                        is_dir = entry.is_dir()
+                        if entry.name.startswith(".") or (is_dir and entry.is_symlink()) or is_ignored(chain, path, is_dir):
+                            continue
+                        if not is_dir:
+                            stat = entry.stat()
+                            stats[path] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        continue
+
+                    if is_dir and path not in known:
+                        for batch, batch_walked in crawl(root, path, chain, cancelled, self.batch_size):
+                            files.extend(batch)
+                            walked.extend(batch_walked)
+            return stats, files, walked, gone
+
+        def apply(result: Sweep | None):
+            self._sweeping = False
+            if self._cancelled.is_set():
+                return
+            if result:
+                self._on_swept(set(directories), *result)
+            self._schedule_sweep()
+
+        run_in_worker(work, apply)
+
+    def _on_swept(
+        self,
+        directories: set[str],
+        stats: dict[str, tuple[int, int]],
+        files: list[str],
+        walked: list[tuple[str, IgnoreChain]],
+        gone: set[str],
+    ):
+        """Internal callback for when the unwatched directories were swept, applies the changes found"""
+        for directory in gone:
+            self.unwatched_directories.pop(directory, None)
+        old = self._stats
+        # only files of directories swept before are compared, the others are seen for the first time
+        compared = {path for path in stats.keys() | old.keys() if path.rpartition("/")[0] in self._swept}
+        added = {path for path in compared if path in stats and path not in old}
+        removed = {path for path in compared if path in old and path not in stats}
+        written = {path for path in compared if path in stats and path in old and stats[path] != old[path]}
+
+        self._stats = stats
+        self._swept = directories
+        self._remove(removed)
+        self._add([*added, *files])
+        self._watch(walked)
+        if self.on_files_changed and (added or removed or written or files):
+            self.on_files_changed(added | removed | written | set(files))
+
+    def _on_changed(
+        self, _monitor: Gio.FileMonitor, file: Gio.File, other: Gio.File | None, event: Gio.FileMonitorEvent, directory: str
+    ):
+        """Internal callback for when an entry of a watched directory was created, deleted or renamed"""
+        match event:
+            case Gio.FileMonitorEvent.CREATED | Gio.FileMonitorEvent.MOVED_IN:
+                self._change(directory, file.get_basename(), True)
+            case Gio.FileMonitorEvent.DELETED | Gio.FileMonitorEvent.MOVED_OUT:
+                self._change(directory, file.get_basename(), False)
+            case Gio.FileMonitorEvent.RENAMED:
+                self._change(directory, file.get_basename(), False)
+                if other:
+                    self._change(directory, other.get_basename(), True)
+            case Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+                self._change(directory, file.get_basename(), None)
+            case _:
+                return
+
+    def _change(self, directory: str, name: str | None, added: bool | None):
+        if name == ".gitignore":
+            self._ignores_changed.add(directory)
+            if not self._merge_source:
+                self._merge_source = GLib.timeout_add(self.merge_interval, self._on_merge_timeout)
+            return
+
+        if not name or name.startswith("."):
+            return
+
+        path = f"{directory}/{name}" if directory else name
+        # a file written to right after it was created is still new
+        if added is None and path in self._pending:
+            return
+        self._pending[path] = added
+        if not self._merge_source:
+            self._merge_source = GLib.timeout_add(self.merge_interval, self._on_merge_timeout)
+
+    def _on_merge_timeout(self) -> bool:
+        """applies the changes collected in the meantime, added directories are crawled on a worker"""
+        self._merge_source = 0
+        pending = self._pending
+        self._pending = {}
+
+        ignores_changed = self._ignores_changed
+        self._ignores_changed = set()
+        # the subtree of a directory contains the ones of the directories below it
+        for directory in ignores_changed:
+            if not any(_is_below(other, directory) for other in ignores_changed if other != directory):
+                self._refilter(directory)
+
+        removed = {path for path, added in pending.items() if added is False}
+        self._remove(removed)
+
+        # ignored files are in watched directories as well, only the ones of the index are passed on
+        written = {path for path, added in pending.items() if added is None and path in self._members}
+        if self.on_files_changed and (removed or written):
+            self.on_files_changed(removed | written)
+
+        added = [(path, self._chains.get(path.rpartition("/")[0], ())) for path, added in pending.items() if added]
+        if not added:
+            return GLib.SOURCE_REMOVE
+
+        root = self.root
+        cancelled = self._cancelled
+
+        def work() -> tuple[list[str], list[tuple[str, IgnoreChain]]]:
+            files: list[str] = []
+            directories: list[tuple[str, IgnoreChain]] = []
+            for path, chain in added:
+                full = root / path
+                if not os.path.lexists(full):
+                    continue
+                is_dir = full.is_dir() and not full.is_symlink()
+                if is_ignored(chain, path, is_dir):
+                    continue
+                if not is_dir:
+                    files.append(path)
+                    continue
+                for batch, walked in crawl(root, path, chain, cancelled, self.batch_size):
+                    files.extend(batch)
+                    directories.extend(walked)
+            return files, directories
+
+        def apply(result: tuple[list[str], list[tuple[str, IgnoreChain]]] | None):
+            if not result or self._cancelled.is_set():
+                return
+            files, directories = result
+            self._add(files)
+            self._watch(directories)
+            if self.on_files_changed and files:
+                self.on_files_changed(set(files))
+
+        run_in_worker(work, apply)
+        return GLib.SOURCE_REMOVE
+
+    def _refilter(self, directory: str):
+        """
+        applies the ignore rules below a watched directory anew after its .gitignore changed, the subtree is crawled again
+        on a worker. Files that are ignored now are removed, the ones that are not ignored anymore are added
+        """
+        chain = self._chains.get(directory)
+        if chain is None:
+            return
+
+        # the crawl reads the .gitignore of the directory again, so only the rules of the directories above it are kept
+        chain = tuple(entry for entry in chain if entry[0] != directory)
+        root = self.root
+        cancelled = self._cancelled
+
+        def work() -> tuple[list[str], list[tuple[str, IgnoreChain]]]:
+            files: list[str] = []
+            walked: list[tuple[str, IgnoreChain]] = []
+            for batch, batch_walked in crawl(root, directory, chain, cancelled, self.batch_size):
+                files.extend(batch)
+                walked.extend(batch_walked)
+            return files, walked
+
+        def apply(result: tuple[list[str], list[tuple[str, IgnoreChain]]] | None):
+            if result and not self._cancelled.is_set():
+                self._on_refiltered(directory, *result)
+
+        run_in_worker(work, apply)
+
+    def _on_refiltered(self, directory: str, files: list[str], walked: list[tuple[str, IgnoreChain]]):
+        """Internal callback for when the subtree of a directory was crawled again after its .gitignore changed"""
+        found = set(files)
+        removed = {path for path in self._paths if _is_below(directory, path) and path not in found}
+        added = [path for path in files if path not in self._members]
+
+        # directories that are ignored now are not watched anymore, the others get the new rules
+        chains = dict(walked)
+        for d in [d for d in self._monitors if _is_below(directory, d) and d not in chains]:
+            self._monitors.pop(d).cancel()
+            self._chains.pop(d, None)
+        for d in [d for d in self.unwatched_directories if _is_below(directory, d) and d not in chains]:
+            del self.unwatched_directories[d]
+        # directories waiting to be watched as well
+        self._unwatched = [
+            (d, chains.get(d, chain)) for d, chain in self._unwatched if not _is_below(directory, d) or d in chains
+        ]
+        queued = {d for d, _ in self._unwatched}
+
+        unwatched: list[tuple[str, IgnoreChain]] = []
+        for d, chain in walked:
+            if d in queued:
+                continue
+            if d in self._monitors:
+                self._chains[d] = chain
+            elif d in self.unwatched_directories:
+                self.unwatched_directories[d] = chain
+            else:
+                unwatched.append((d, chain))
+
+        self._remove(removed)
+        self._add(added)
+        self._watch(unwatched)
+        if self.on_files_changed and (removed or added):
+            self.on_files_changed(removed | set(added))
+
+    def _add(self, files: list[str]):
+        files = [f for f in files if f not in self._members]
+        if not files:
+            return
+
+        self._paths.extend(files)
+        self._members.update(files)
+        self._invalidate()
+
+    def _remove(self, paths: set[str]):
+        """removes paths, removed directories take the files below them along"""
+        if not paths:
+            return
+
+        prefixes = tuple(f"{path}/" for path in paths)
+        removed = {p for p in self._paths if p in paths or p.startswith(prefixes)}
+
+        for directory in [d for d in self._monitors if d in paths or d.startswith(prefixes)]:
+            self._monitors.pop(directory).cancel()
+            self._chains.pop(directory, None)
+        for directory in [d for d in self.unwatched_directories if d in paths or d.startswith(prefixes)]:
+            del self.unwatched_directories[directory]
+
+        if not removed:
+            return
+
+        self._paths = [p for p in self._paths if p not in removed]
+        self._members -= removed
+        self._invalidate()
@@ -0,0 +1,127 @@
+from typing import cast
+
+import gi
+
+gi.require_version("Gtk", "4.0")
+gi.require_version("Adw", "1")
+
+from gi.repository import Gtk, GLib, Adw, Gdk, Pango  # pyright: ignore[reportMissingModuleSource]
+
+from bracket.project_index import ProjectIndex
+from bracket.utils import Args
+
+
+class QuickOpen(Adw.Dialog):
+    """
+    Dialog to open a file of the working directory by typing a part of its path, see `ProjectIndex.match`.
+    Up and Down move the selection, Enter opens the selected file in the window the dialog was presented on.
+    """
+
+    # how many matches are listed
+    limit: int = 50
+
+    def __init__(self, index: ProjectIndex):
+        super().__init__(title="Quick Open", content_width=640, content_height=480)
+        self._index: ProjectIndex = index
+
+        self._entry: Gtk.SearchEntry = Gtk.SearchEntry(placeholder_text="Search files by name", search_delay=50)
+        self._entry.connect("search-changed", self._on_search_changed)
+        self._entry.connect("activate", self._on_entry_activate)
+        self._entry.connect("stop-search", lambda *_args: self.close())
+
+        keys = Gtk.EventControllerKey()
+        keys.connect("key-pressed", self._on_key_pressed)
+        self._entry.add_controller(keys)
+
+        # the matching paths, relative to the root of the index
+        self._results: Gtk.StringList = Gtk.StringList()
+        self._selection: Gtk.SingleSelection = Gtk.SingleSelection(model=self._results)
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self._on_factory_setup)
+        factory.connect("bind", self._on_factory_bind)
+
+        self._list: Gtk.ListView = Gtk.ListView(model=self._selection, factory=factory, single_click_activate=True)
+        self._list.connect("activate", self._on_list_activate)
+
+        scrolled = Gtk.ScrolledWindow(child=self._list, vexpand=True)
+        self._status: Gtk.Label = Gtk.Label(xalign=0, css_classes=["dim-label", "caption"])
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        for widget in (self._entry, scrolled, self._status):
+            box.append(widget)
+        box.set_margin_top(12)
+        box.set_margin_bottom(12)
+        box.set_margin_start(12)
+        box.set_margin_end(12)
+
+        self.set_child(box)
+        self.set_focus(self._entry)
+
+        # the list follows the index while it is crawled or changes
+        index.on_changed = self._update
+        self.connect("closed", self._on_closed)
+        self._update()
+
+    def _on_closed(self, *_args: Args):
+        if self._index.on_changed == self._update:
+            self._index.on_changed = None
+
+    def _update(self):
+        """lists the matches of the current query"""
+        matches = self._index.match(self._entry.get_text(), self.limit)
+        self._results.splice(0, self._results.get_n_items(), matches)
+        if matches:
+            self._selection.set_selected(0)
+            self._list.scroll_to(0, Gtk.ListScrollFlags.NONE, None)
+
+        count = len(self._index)
+        if not self._index.complete:
+            self._status.set_text(f"Indexing… {count} files")
+        else:
+            self._status.set_text(f"{count} files")
+
+    def _on_search_changed(self, *_args: Args):
+        self._update()
+
+    def _on_key_pressed(self, _controller: Gtk.EventControllerKey, keyval: int, _keycode: int, _state: Gdk.ModifierType) -> bool:
+        """moves the selection with Up and Down while the entry keeps the focus"""
+        step = {Gdk.KEY_Up: -1, Gdk.KEY_Down: 1}.get(keyval)
+        count = self._results.get_n_items()
+        if step is None or not count:
+            return False
+
+        position = self._selection.get_selected()
+        position = 0 if position == Gtk.INVALID_LIST_POSITION else (position + step) % count
+        self._selection.set_selected(position)
+        self._list.scroll_to(position, Gtk.ListScrollFlags.NONE, None)
+        return True
+
+    def _on_entry_activate(self, *_args: Args):
+        self._open(self._selection.get_selected())
+
+    def _on_list_activate(self, _list: Gtk.ListView, position: int):
+        self._open(position)
+
+    def _open(self, position: int):
+        """opens the path at a position of the list and closes the dialog"""
+        item = cast(Gtk.StringObject | None, self._results.get_item(position))
+        if not item:
+            return
+
+        # the matcher lags behind the directory, so the file may be gone
+        path = self._index.root / item.get_string()
+        if not path.is_file():
+            return
+
+        self.activate_action("win.file-path-open", GLib.Variant("(si)", (str(path), -1)))
+        self.close()
+
+    def _on_factory_setup(self, _factory: Gtk.SignalListItemFactory, list_item: Gtk.ListItem):
+        # long paths lose their start, the file name at the end is what is looked for
+        label = Gtk.Label(xalign=0, ellipsize=Pango.EllipsizeMode.START)
+        list_item.set_child(label)
+
+    def _on_factory_bind(self, _factory: Gtk.SignalListItemFactory, list_item: Gtk.ListItem):
+        label = cast(Gtk.Label, list_item.get_child())
+        label.set_text(cast(Gtk.StringObject, list_item.get_item()).get_string())
@@ -0,0 +1,106 @@
+import time
+from typing import Callable
+
+from gi.repository import GLib  # pyright: ignore[reportMissingModuleSource]
+
+
+class HighlightScheduler:
+    """
+    Merges bursts of highlight requests (pasting, holding down a key, ...) into a single highlight pass started from the GLib main loop.
+    Every request bumps `generation`, so work started for an older generation can tell that the buffer changed since.
+    The pass is delayed depending on how long passes took so far: cheap passes run almost right away,
+    expensive ones wait a bit longer so more edits can be merged into them.
+    A pass may finish asynchronously, it lasts until `done` is called and only one pass runs at a time,
+    requests made while it runs are merged into a single pass started afterwards.
+    """
+
+    # bounds of the delay in milliseconds between the first request of a burst and the pass
+    min_delay: int = 0
+    max_delay: int = 200
+    # weight of the newest measurement in the running average of the cost of a pass
+    smoothing: float = 0.3
+
+    def __init__(self, callback: Callable[[], None]):
+        self._callback: Callable[[], None] = callback
+        # id of the pending GLib source, None if no pass is scheduled
+        self._source: int | None = None
+        # start time of the running pass, None if no pass is running
+        self._started: float | None = None
+        # whether requests came in while the pass was running
+        self._rerun: bool = False
+        # running average of the duration of a pass in milliseconds
+        self.cost: float = 0.0
+
+        self.generation: int = 0
+        # number of passes run so far
+        self.run: int = 0
+
+    @property
+    def pending(self) -> bool:
+        """whether a pass is scheduled or still running"""
+        return self._source is not None or self._started is not None
+
+    @property
+    def delay(self) -> int:
+        """delay in milliseconds for the next pass, twice the average cost of a pass within the bounds"""
+        return int(min(max(2 * self.cost, self.min_delay), self.max_delay))
+
+    def is_current(self, generation: int) -> bool:
+        """whether no request was made since `generation`"""
+        return generation == self.generation
+
+    def request(self):
+        """
+        requests a highlight pass, it is merged into the pending one if there is one
+        """
+        self.generation += 1
+
+        if self._source is not None:
+            return
+
+        if self._started is not None:
+            self._rerun = True
+            return
+
+        self._schedule()
+
+    def _schedule(self):
+        """adds the GLib source starting the next pass"""
+        # idle priority lets input and drawing go first, so typing is not slowed down by highlighting
+        delay = self.delay
+        if delay > 0:
+            self._source = GLib.timeout_add(delay, self._on_timeout, priority=GLib.PRIORITY_DEFAULT_IDLE)
+        else:
+            self._source = GLib.idle_add(self._on_timeout, priority=GLib.PRIORITY_DEFAULT_IDLE)
+
+    def cancel(self):
+        """removes the pending pass if there is one, a running pass is not interrupted but no pass follows it"""
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
+        self._rerun = False
+
+    def done(self):
+        """
+        marks the running pass as finished and measures its duration, starts the next pass if requests came in while it ran
+        """
+        if self._started is None:
+            return
+
+        cost = (time.perf_counter() - self._started) * 1000
+        self._started = None
+
+        self.run += 1
+        self.cost = cost if self.run == 1 else self.smoothing * cost + (1 - self.smoothing) * self.cost
+
+        if self._rerun:
+            self._rerun = False
+            self._schedule()
+
+    def _on_timeout(self, *_args: object) -> bool:
+        """starts the pass"""
+        self._source = None
+        self._started = time.perf_counter()
+        self._callback()
+
+        return GLib.SOURCE_REMOVE
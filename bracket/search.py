@@ -0,0 +1,233 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+import multiprocessing
+import os
+import pathlib
+import re
+import threading
+from typing import Callable, Iterator
+
+from gi.repository import GLib  # pyright: ignore[reportMissingModuleSource]
+
+from bracket.project_index import crawl
+from bracket.workers import run_in_worker
+
+# a line containing a match: (path relative to the root, line, offset of the match in chars, text of the line)
+type SearchMatch = tuple[str, int, int, str]
+
+# files larger than this many bytes are not searched, they are hardly source code
+max_file_size: int = 16 << 20
+# the text of a line is cut after this many bytes, minified files have lines of megabytes
+max_line_length: int = 500
+# files with a NUL byte in the first this many bytes are taken for binary files and skipped
+binary_probe: int = 8192
+
+
+@lru_cache(maxsize=8)
+def _compile(pattern: bytes, flags: int) -> re.Pattern[bytes]:
+    return re.compile(pattern, flags)
+
+
+def search_files(root: str, paths: list[str], pattern: bytes, flags: int) -> list[SearchMatch]:
+    """
+    returns the lines of files below `root` that match `pattern`, one match per line.
+    Runs in a worker process, so it only takes and returns plain data
+    """
+    regex = _compile(pattern, flags)
+    matches: list[SearchMatch] = []
+
+    for path in paths:
+        try:
+            with open(os.path.join(root, path), "rb") as file:
+                data = file.read(max_file_size + 1)
+        except OSError:
+            continue
+
+        if len(data) > max_file_size or b"\0" in data[:binary_probe]:
+            continue
+
+        line = 0
+        counted = 0
+        m = regex.search(data)
+        while m:
+            start = m.start()
+            line += data.count(b"\n", counted, start)
+            line_start = data.rfind(b"\n", 0, start) + 1
+            line_end = data.find(b"\n", start)
+            if line_end == -1:
+                line_end = len(data)
+
+            column = len(data[line_start:start].decode("utf-8", "replace"))
+            text = data[line_start:min(line_end, line_start + max_line_length)].decode("utf-8", "replace")
+            matches.append((path, line, column, text))
+
+            # the rest of the line is skipped, it is listed once
+            counted = start
+            m = regex.search(data, line_end + 1) if line_end < len(data) else None
+
+    return matches
+
+
+# processes searching files, matching holds the GIL so threads would not use more than one core
+process_count: int = os.cpu_count() or 1
+_processes: ProcessPoolExecutor | None = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    returns the process-wide pool searching files. Processes are spawned and not forked, forking a process running GTK and threads is not safe
+    """
+    global _processes
+    if _processes is None:
+        _processes = ProcessPoolExecutor(max_workers=process_count, mp_context=multiprocessing.get_context("spawn"))
+    return _processes
+
+
+def warm_up():
+    """starts the processes of the pool, so the first search does not wait for them"""
+    pool = get_process_pool()
+    for _ in range(process_count):
+        pool.submit(os.getpid)
+
+
+def compile_query(query: str, regex: bool = False) -> tuple[bytes, int]:
+    """
+    returns the pattern and flags `search_files` takes for a query, the query is taken literally unless `regex` is set.
+    Case is ignored unless the query has an uppercase letter. Raises re.error for invalid regular expressions
+    """
+    pattern = query.encode("utf-8") if regex else re.escape(query.encode("utf-8"))
+    flags = 0 if any(c.isupper() for c in query) else re.IGNORECASE
+    # fails here, on the main thread, and not in every worker process
+    _compile(pattern, flags | re.MULTILINE)
+    return pattern, flags | re.MULTILINE
+
+
+class FileSearch:
+    """
+    Searches the files below a directory for a query, see `compile_query`.
+    A thread walks the directory like the project index does, leaving out hidden and ignored files, and hands the files
+    in small batches to the process pool. The matches of every batch are passed to `on_matches` on the main loop
+    as soon as it is done, so the first ones show up long before the whole directory is searched.
+    `on_done` is called once every batch is done, or the search stopped at `max_matches`.
+    After `cancel` neither is called anymore. With `paths` only those files are searched, like the candidates of an index.
+    """
+
+    # files per batch, small batches give the first matches early and make cancelling quick
+    batch_size: int = 32
+    # batches queued per process, more keep the processes busy, fewer make cancelling quicker
+    queued_per_process: int = 4
+    # the search stops after this many matches
+    max_matches: int = 10000
+
+    def __init__(
+        self,
+        root: pathlib.Path,
+        pattern: bytes,
+        flags: int,
+        on_matches: Callable[[list[SearchMatch]], None],
+        on_done: Callable[[], None],
+        paths: list[str] | None = None,
+    ):
+        self.root: pathlib.Path = root
+        self.paths: list[str] | None = paths
+        self._pattern: bytes = pattern
+        self._flags: int = flags
+        self.on_matches: Callable[[list[SearchMatch]], None] = on_matches
+        self.on_done: Callable[[], None] = on_done
+        self.match_count: int = 0
+        self.file_count: int = 0
+        self._cancelled: threading.Event = threading.Event()
+        self._futures: set[Future[list[SearchMatch]]] = set()
+        self._lock: threading.Lock = threading.Lock()
+        # batches submitted, None until the walk is done and the number is final, and batches whose matches arrived
+        self._submitted: int | None = None
+        self._delivered: int = 0
+
+    def start(self):
+        run_in_worker(self._submit_all, self._on_submitted)
+
+    def cancel(self):
+        """stops the search, batches that did not start yet are dropped"""
+        self._cancelled.set()
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+
+    def _submit_all(self) -> int:
+        """walks the directory and submits the files batch by batch, runs on a worker thread"""
+        pool = get_process_pool()
+        slots = threading.Semaphore(self.queued_per_process * process_count)
+        root = str(self.root)
+        submitted = 0
+
+        for files in self._files():
+            for i in range(0, len(files), self.batch_size):
+                # waits for a free slot, so the walk does not run ahead of the search by the whole directory
+                while not slots.acquire(timeout=0.1):
+                    if self._cancelled.is_set():
+                        return submitted
+                if self._cancelled.is_set():
+                    return submitted
+
+                batch = files[i:i + self.batch_size]
+                future = pool.submit(search_files, root, batch, self._pattern, self._flags)
+                with self._lock:
+                    self._futures.add(future)
+                future.add_done_callback(lambda future, count=len(batch): self._on_batch_done(future, count, slots))
+                submitted += 1
+
+        return submitted
+
+    def _files(self) -> Iterator[list[str]]:
+        if self.paths is not None:
+            yield self.paths
+            return
+
+        for files, _directories in crawl(self.root, "", (), self._cancelled, self.batch_size):
+            yield files
+
+    def _on_batch_done(self, future: Future[list[SearchMatch]], count: int, slots: threading.Semaphore):
+        """called on the thread that finished the batch, the matches are passed on on the main loop"""
+        slots.release()
+        with self._lock:
+            self._futures.discard(future)
+
+        matches: list[SearchMatch] = []
+        if not future.cancelled():
+            try:
+                matches = future.result()
+            except Exception as e:
+                print(e)
+        GLib.idle_add(self._deliver, matches, count)
+
+    def _deliver(self, matches: list[SearchMatch], count: int) -> bool:
+        if self._cancelled.is_set():
+            return GLib.SOURCE_REMOVE
+
+        self._delivered += 1
+        self.file_count += count
+        if matches:
+            matches = matches[:self.max_matches - self.match_count]
+            self.match_count += len(matches)
+            self.on_matches(matches)
+
+        if self.match_count >= self.max_matches:
+            self.cancel()
+            self.on_done()
+        else:
+            self._check_done()
+        return GLib.SOURCE_REMOVE
+
+    def _on_submitted(self, submitted: int | None):
+        """Internal callback for when every batch is submitted"""
+        if self._cancelled.is_set():
+            return
+        self._submitted = submitted or 0
+        self._check_done()
+
+    def _check_done(self):
+        if self._submitted is not None and self._delivered >= self._submitted:
+            # nothing is left to cancel, setting it keeps `on_done` from being called twice
+            self._cancelled.set()
+            self.on_done()
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import pathlib
+import threading
+from typing import Any, TypedDict
+
+from gi.repository import GLib  # pyright: ignore[reportMissingModuleSource]
+
+from bracket.files import write_atomic
+from bracket.workers import run_in_worker
+
+
+class TabState(TypedDict):
+    """a tab as it is stored in the session: its file, the offset of the cursor and the first visible line"""
+    path: str
+    cursor: int
+    top_line: int
+
+
+class DirectoryState(TypedDict):
+    """the tabs of the window of a working directory and the index of the selected one"""
+    tabs: list[TabState]
+    selected: int
+
+
+# (first line, last line exclusive, spans packed as for `TagApplier.apply`, hash of the file content they were stored for)
+type CachedSpans = tuple[int, int, bytes, bytes]
+
+
+def _data_dir(base: str) -> pathlib.Path:
+    return pathlib.Path(base) / "bracket"
+
+
+class Session:
+    """
+    Remembers the tabs of every window by its working directory, so they are opened again with the directory,
+    and the directories of the windows open when the app was closed, so they are opened again on the next launch.
+    Stored as JSON in the user state directory, a missing or broken file is an empty session.
+    """
+
+    def __init__(self, path: pathlib.Path | None = None):
+        self.path: pathlib.Path = path or _data_dir(GLib.get_user_state_dir()) / "session.json"
+        self._data: dict[str, Any] = self._read()
+        # writes are numbered, so a write that reaches the worker after a newer one does not replace it
+        self._requested: int = 0
+        self._written: int = 0
+        self._write_lock: threading.Lock = threading.Lock()
+
+    def _read(self) -> dict[str, Any]:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    @property
+    def windows(self) -> list[pathlib.Path]:
+        """working directories of the windows that were open when the app was closed last time"""
+        return [pathlib.Path(d) for d in self._data.get("windows", []) if isinstance(d, str)]
+
+    def set_windows(self, directories: list[pathlib.Path]):
+        self._data["windows"] = [str(d) for d in directories]
+
+    def directory(self, directory: pathlib.Path) -> DirectoryState | None:
+        """returns the tabs stored for a working directory, None if there are none"""
+        state = self._data.get("directories", {}).get(str(directory))
+        if not isinstance(state, dict) or not isinstance(state.get("tabs"), list):
+            return None
+        return state  # pyright: ignore[reportReturnType]
+
+    def set_directory(self, directory: pathlib.Path, state: DirectoryState):
+        self._data.setdefault("directories", {})[str(directory)] = state
+
+    def write(self):
+        """
+        writes the session to disk on a worker, the session is serialized right away so later changes are not written.
+        Errors are printed since a lost session is not worth interrupting anything
+        """
+        self._requested += 1
+        number = self._requested
+        path = self.path
+        text = json.dumps(self._data, indent=2)
+
+        def work():
+            with self._write_lock:
+                if number < self._written:
+                    return
+                write_atomic(path, text, fsync=False)
+                self._written = number
+
+        run_in_worker(work, lambda _result: None)
+
+
+class SpanCache:
+    """
+    Keeps the spans of the lines that were visible when a file was closed, so the file is colored right away when it is
+    opened again instead of once it is parsed. The highlighting done after loading checks the cached spans and replaces the wrong ones.
+    An entry is only used while the file has the modification time and size it was stored with,
+    and for the same names of the theme, since spans refer to tags by their index in the names.
+    Stored in the user cache directory, one file per file: a JSON header line followed by the packed spans.
+    """
+
+    # the least recently stored entries are removed beyond this many
+    max_entries: int = 256
+
+    def __init__(self, directory: pathlib.Path | None = None):
+        self.directory: pathlib.Path = directory or _data_dir(GLib.get_user_cache_dir()) / "spans"
+        # entries are written and pruned on workers one at a time, so pruning does not race another write
+        self._lock: threading.Lock = threading.Lock()
+
+    def _entry(self, path: pathlib.Path) -> pathlib.Path:
+        """the cache file of a file, named by the hash of its canonical path"""
+        key = hashlib.blake2b(str(path.resolve()).encode("utf-8"), digest_size=16).hexdigest()
+        return self.directory / f"{key}.spans"
+
+    @staticmethod
+    def _names_key(names: list[str]) -> str:
+        return hashlib.blake2b("\0".join(names).encode("utf-8"), digest_size=8).hexdigest()
+
+    def lookup(self, path: pathlib.Path, names: list[str]) -> CachedSpans | None:
+        """returns the spans stored for a file if they were stored for the file as it is on disk now, None otherwise"""
+        try:
+            stat = path.stat()
+            with self._entry(path).open("rb") as file:
+                header = json.loads(file.readline())
+                packed = file.read()
+        except (OSError, ValueError):
+            return None
+
+        try:
+            if (header["mtime"], header["size"], header["names"]) != (stat.st_mtime_ns, stat.st_size, self._names_key(names)):
+                return None
+            return header["start"], header["end"], packed, bytes.fromhex(header["hash"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def store(
+        self, path: pathlib.Path, disk_state: tuple[int, int, bytes], names: list[str], start: int, end: int, packed: bytes
+    ):
+        """
+        stores the spans of the lines `start` to `end` of a file, `disk_state` is (mtime in ns, size, hash of the content).
+        The entry is written on a worker
+        """
+        mtime, size, digest = disk_state
+        header = {
+            "mtime": mtime,
+            "size": size,
+            "hash": digest.hex(),
+            "names": self._names_key(names),
+            "start": start,
+            "end": end,
+        }
+
+        data = json.dumps(header).encode("utf-8") + b"\n" + packed
+
+        def work():
+            with self._lock:
+                write_atomic(self._entry(path), data, fsync=False)
+                self._prune()
+
+        run_in_worker(work, lambda _result: None)
+
+    def discard(self, path: pathlib.Path):
+        """removes the entry of a file, for spans that turned out to be wrong"""
+        self._entry(path).unlink(missing_ok=True)
+
+    def _prune(self):
+        """removes the oldest entries beyond `max_entries`"""
+        entries = list(self.directory.glob("*.spans"))
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        for entry in entries[:len(entries) - self.max_entries]:
+            entry.unlink(missing_ok=True)
+
+
+_span_cache: SpanCache | None = None
+
+
+def get_span_cache() -> SpanCache:
+    """returns the process-wide span cache"""
+    global _span_cache
+    if _span_cache is None:
+        _span_cache = SpanCache()
+    return _span_cache
@@ -6,14 +6,148 @@ from gi.repository import (
     Gtk,
 )  # pyright: ignore[reportMissingModuleSource]
 from bracket.dialogs import UnsavedResponse, request_open_file, unsaved_dialog
+from bracket.document import Document, canonical_path, find_document
 from bracket.editor import Editor
+from bracket.profiling import startup
+from bracket.session import DirectoryState, TabState
+from bracket.viewer import LargeFileViewer
 
+from collections import OrderedDict
 import pathlib
 from typing import cast
 
 from bracket.utils import Args, KwArgs
 
 
+class EditorPage(Adw.Bin):
+    """
+    Child of the tab pages showing editors. It holds the editor wrapped in a scrolled window or, while the page is not loaded,
+    only the path of its file, so pages that were never looked at or were unloaded to save memory cost next to nothing.
+    The cursor and the scroll position are kept while the page is unloaded and restored when it is loaded again.
+    """
+
+    def __init__(
+        self, editor: Editor | None = None, path: pathlib.Path | None = None, cursor: int = 0, top_line: int = 0
+    ):
+        super().__init__()
+        self.path: pathlib.Path | None = path
+        self.editor: Editor | None = None
+        # offset of the cursor and first visible line, restored when the page is loaded again
+        self._cursor: int = cursor
+        self._top_line: int = top_line
+
+        if editor:
+            self._show(editor)
+
+    def _show(self, editor: Editor):
+        """
+        wraps an editor in its own scrolled window, so the editor only has to lay out and highlight the visible lines
+        """
+        self.editor = editor
+        self.set_child(
+            Gtk.ScrolledWindow(
+                child=editor,
+                hscrollbar_policy=Gtk.PolicyType.ALWAYS,
+                vscrollbar_policy=Gtk.PolicyType.AUTOMATIC,
+            )
+        )
+
+    def load(self) -> Editor:
+        """
+        creates the editor of the page, the file is only read if it is not open elsewhere already
+        """
+        assert self.path is not None
+
+        document = find_document(self.path)
+        editor = Editor(document)
+        self._show(editor)
+
+        if document:
+            self._restore()
+            return editor
+
+        def on_loaded(_editor: Editor, completed: bool):
+            if completed:
+                self._restore()
+
+        editor.connect("loaded", on_loaded)
+        editor.open_file(self.path)
+        return editor
+
+    def unload(self):
+        """
+        drops the editor of the page, remembering its file, cursor and scroll position
+        """
+        if not self.editor:
+            return
+
+        self._remember()
+        self.path = self.editor.path
+
+        self.editor.close()
+        self.editor = None
+        self.set_child(None)
+
+    def state(self) -> TabState | None:
+        """returns the file, cursor and scroll position of the page to be stored in the session, None for untitled files"""
+        self._remember()
+        path = self.editor.path if self.editor else self.path
+        if not path:
+            return None
+        return {"path": str(path), "cursor": self._cursor, "top_line": self._top_line}
+
+    def _remember(self):
+        """copies the cursor and the first visible line of the editor, an editor still loading keeps the ones it is restored to"""
+        if not self.editor or self.editor.get_property("loading"):
+            return
+
+        buffer = self.editor.document.buffer
+        self._cursor = buffer.get_iter_at_mark(buffer.get_insert()).get_offset()
+        top, _ = self.editor.get_line_at_y(self.editor.get_visible_rect().y)
+        self._top_line = top.get_line()
+
+    def go_to_line(self, line: int):
+        """puts the cursor at the start of a line and scrolls to it, once the file is loaded if it is still loading"""
+        editor = self.editor
+        if not editor:
+            return
+
+        if not editor.get_property("loading"):
+            self._show_line(line)
+            return
+
+        def on_loaded(_editor: Editor, completed: bool):
+            editor.disconnect(handler)
+            if completed:
+                self._show_line(line)
+
+        handler = editor.connect("loaded", on_loaded)
+
+    def _show_line(self, line: int):
+        if not self.editor:
+            return
+
+        buffer = self.editor.document.buffer
+        _, it = buffer.get_iter_at_line(line)
+        buffer.place_cursor(it)
+        self.editor.scroll_to_mark(buffer.get_insert(), 0, True, 0, 0.3)
+        self.editor.grab_focus()
+
+    def _restore(self):
+        """moves the cursor and the scroll position back to where they were when the page was unloaded"""
+        if not self.editor:
+            return
+
+        buffer = self.editor.document.buffer
+        buffer.place_cursor(buffer.get_iter_at_offset(self._cursor))
+
+        # scrolling to a mark waits until the lines above it are laid out, scrolling to an iter does not
+        _, top = buffer.get_iter_at_line(self._top_line)
+        mark = buffer.get_mark("restored-scroll") or buffer.create_mark("restored-scroll", top, True)
+        buffer.move_mark(mark, top)
+        self.editor.scroll_to_mark(mark, 0, True, 0, 0)
+
+
 @Gtk.Template(resource_path="/io/github/bracket/tabview.ui")
 # kann nicht von Adw.ToolbarView verbt werden maaaan
 class EditorTabView(Adw.Bin):
@@ -21,29 +155,149 @@ class EditorTabView(Adw.Bin):
     bar: Adw.TabBar = cast(Adw.TabBar, Gtk.Template.Child("tab-bar"))
     view: Adw.TabView = cast(Adw.TabView, Gtk.Template.Child("tab-view"))
 
-    opened_files: dict[pathlib.Path, tuple[Adw.TabPage, Editor]] = {}
+    # files larger than this many bytes are opened in a read-only viewer instead of an editor
+    large_file_threshold: int = 256 << 20
+    # estimated bytes the loaded documents may take before the least recently used clean ones are unloaded
+    memory_budget: int = 512 << 20
 
     def __init__(self, **_kwargs: KwArgs):
         super().__init__()
         # Connect the tab view to the tab bar
         self.bar.set_view(self.view)
-        self.new_file()
+        # the indicator of a page is a stop button while its file loads
+        self.view.connect("indicator-activated", self._on_indicator_activated)
+        # the page showing each document, kept up to date as pages are added, closed or moved to other windows
+        self.opened_files: dict[Document, tuple[Adw.TabPage, Editor]] = {}
+        # pages that are not loaded by the canonical path of their file
+        self._unloaded: dict[pathlib.Path, Adw.TabPage] = {}
+        # pages of read-only viewers by the canonical path of their file
+        self._viewers: dict[pathlib.Path, Adw.TabPage] = {}
+        # loaded pages from the least to the most recently selected one
+        self._recent: OrderedDict[Adw.TabPage, None] = OrderedDict()
+        self.view.connect("page-attached", self._on_page_attached)
+        self.view.connect("page-detached", self._on_page_detached)
+        self.view.connect("notify::selected-page", self._on_page_selected)
+        with startup.phase("first editor"):
+            self.new_file()
 
-    def open_file(self, path: pathlib.Path):
+    def open_file(
+        self, path: pathlib.Path, lazy: bool = False, cursor: int = 0, top_line: int = 0
+    ) -> Adw.TabPage | None:
         """
-        opens a path to a file in the tabview.
+        opens a path to a file in the tabview and returns the page showing it.
+        with `lazy` the page only holds the path and is not selected, the file is read once the page is selected,
+        then the cursor is put at the offset `cursor` and the view scrolled to `top_line`.
         path may not be a valid file, in which case it will simply not open
+        files larger than `large_file_threshold` are opened read-only in a `LargeFileViewer`
+        files that are open already are not read again: the page showing them is selected,
+        or, if they are open in another window, a new editor shows the same document
         """
+        if path.is_file() and path.stat().st_size > self.large_file_threshold:
+            return self._open_viewer(path)
+
+        document = find_document(path)
+        if document and document in self.opened_files:
+            page, _ = self.opened_files[document]
+            self.view.set_selected_page(page)
+            return page
+
+        unloaded = self._unloaded.get(canonical_path(path))
+        if unloaded:
+            self.view.set_selected_page(unloaded)
+            return unloaded
+
+        if lazy:
+            page = self.view.append(EditorPage(path=path, cursor=cursor, top_line=top_line))
+            page.set_title(path.name)
+            return page
 
-        editor = Editor()
-        editor.open_file(path)
-        page = self.view.append(editor)
+        editor = Editor(document)
+        page = self.view.append(EditorPage(editor))
 
         name = pathlib.Path(path).name
         page.set_title(name)
-        self._setup_editor_bindings(page, editor)
+        self._setup_editor(page, editor)
         self.view.set_selected_page(page)
 
+        # the file is loaded asynchronously, the page shows the progress meanwhile
+        if not document:
+            editor.open_file(path)
+        return page
+
+    def open_files(self, paths: list[pathlib.Path]):
+        """
+        opens files lazily, only the last one is loaded and selected right away
+        """
+        for path in paths:
+            self.open_file(path, lazy=True)
+
+        if paths:
+            self.open_file(paths[-1])
+
+    def restore_session(self, state: DirectoryState):
+        """
+        reopens the tabs stored in a session lazily, only the tab that was selected is loaded.
+        Files that do not exist anymore are left out
+        """
+        pages: list[Adw.TabPage | None] = []
+        for tab in state["tabs"]:
+            try:
+                path = pathlib.Path(tab["path"])
+                cursor, top_line = int(tab["cursor"]), int(tab["top_line"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            pages.append(self.open_file(path, lazy=True, cursor=cursor, top_line=top_line) if path.is_file() else None)
+
+        selected = state.get("selected", 0)
+        if isinstance(selected, int) and 0 <= selected < len(pages) and pages[selected]:
+            self.view.set_selected_page(pages[selected])
+
+    def session_state(self) -> DirectoryState:
+        """
+        returns the tabs to be stored in the session, the spans of their visible lines are stored in the span cache meanwhile
+        """
+        tabs: list[TabState] = []
+        selected = 0
+
+        for i in range(self.view.get_n_pages()):
+            page = self.view.get_nth_page(i)
+            child = page.get_child()
+
+            state: TabState | None = None
+            if isinstance(child, EditorPage):
+                state = child.state()
+                if child.editor:
+                    child.editor.document.store_spans()
+            elif isinstance(child, LargeFileViewer):
+                state = {"path": str(child.path), "cursor": 0, "top_line": 0}
+
+            if not state:
+                continue
+            if page is self.view.get_selected_page():
+                selected = len(tabs)
+            tabs.append(state)
+
+        return {"tabs": tabs, "selected": selected}
+
+    def _open_viewer(self, path: pathlib.Path) -> Adw.TabPage | None:
+        """opens a file in a read-only viewer, for files too large to be edited, the page of the viewer is selected if it is open already"""
+        page = self._viewers.get(canonical_path(path))
+        if page:
+            self.view.set_selected_page(page)
+            return page
+
+        try:
+            viewer = LargeFileViewer(path)
+        except (OSError, ValueError) as e:
+            print(e)
+            return None
+
+        page = self.view.append(viewer)
+        page.set_title(path.name)
+        page.set_tooltip(f"{path.name} is opened read-only because of its size")
+        self.view.set_selected_page(page)
+        return page
+
     def open_file_with_dialog(self):
         def on_open(f: Gio.File | None):
             if not f:
@@ -60,7 +314,77 @@ class EditorTabView(Adw.Bin):
         if not page:
             return None
 
-        return cast(Editor, page.get_child())
+        return self._get_editor(page)
+
+    def _get_editor(self, page: Adw.TabPage) -> Editor | None:
+        """
+        returns the editor shown by a page.
+        returns None for pages that are not loaded and pages showing a file in a read-only viewer
+        """
+        child = page.get_child()
+        if isinstance(child, EditorPage):
+            return child.editor
+        return None
+
+    def _setup_editor(self, page: Adw.TabPage, editor: Editor):
+        """connects a new editor to its page and marks the page as recently used"""
+        self._setup_editor_bindings(page, editor)
+        self._setup_loading_indicator(page, editor)
+        self.opened_files[editor.document] = (page, editor)
+        self._recent[page] = None
+        self._recent.move_to_end(page)
+        self._evict()
+
+    def _on_page_selected(self, *_args: Args):
+        """Internal callback for when another page is selected, loads it if needed and marks it as recently used"""
+        page = self.view.get_selected_page()
+        if not page:
+            return
+
+        child = page.get_child()
+        if not isinstance(child, EditorPage):
+            return
+
+        if not child.editor and child.path:
+            self._unloaded.pop(canonical_path(child.path), None)
+            self._setup_editor(page, child.load())
+            return
+
+        if page in self._recent:
+            self._recent.move_to_end(page)
+
+    def _evict(self):
+        """
+        unloads the least recently selected pages until the loaded documents fit into `memory_budget`.
+        Only pages that are not selected, whose document is saved to a file, loaded and not shown anywhere else are unloaded,
+        untitled documents could not be loaded again
+        """
+        sizes = {page: self._get_document_size(page) for page in self._recent}
+        total = sum(sizes.values())
+        selected = self.view.get_selected_page()
+
+        for page in list(self._recent):
+            if total <= self.memory_budget:
+                return
+
+            editor = self._get_editor(page)
+            if page is selected or not editor or editor.path is None:
+                continue
+            if not editor.is_saved() or editor.get_property("loading") or len(editor.document.views) > 1:
+                continue
+
+            child = cast(EditorPage, page.get_child())
+            self.opened_files.pop(editor.document, None)
+            del self._recent[page]
+            child.unload()
+            if child.path:
+                self._unloaded[canonical_path(child.path)] = page
+            total -= sizes[page]
+
+    def _get_document_size(self, page: Adw.TabPage) -> int:
+        """estimated memory of the document of a page"""
+        editor = self._get_editor(page)
+        return editor.document.estimated_size() if editor else 0
 
     def _setup_editor_bindings(self, page: Adw.TabPage, editor: Editor):
         editor.bind_property(
@@ -70,29 +394,98 @@ class EditorTabView(Adw.Bin):
             GObject.BindingFlags.BIDIRECTIONAL | GObject.BindingFlags.SYNC_CREATE,
         )
 
+    def _setup_loading_indicator(self, page: Adw.TabPage, editor: Editor):
+        """
+        shows the progress of loading a file on its page, the page is closed if loading fails or is cancelled
+        """
+        editor.bind_property("loading", page, "loading", GObject.BindingFlags.SYNC_CREATE)
+
+        def on_progress(*_args: Args):
+            if editor.get_property("loading"):
+                page.set_tooltip(f"Loading {editor.get_property('progress'):.0%}")
+
+        def on_loading(*_args: Args):
+            loading = cast(bool, editor.get_property("loading"))
+            page.set_indicator_icon(Gio.ThemedIcon.new("process-stop-symbolic") if loading else None)
+            page.set_indicator_tooltip("Stop Loading" if loading else "")
+            page.set_indicator_activatable(loading)
+            if not loading:
+                page.set_tooltip("")
+
+        def on_loaded(_editor: Editor, completed: bool):
+            # pages closed while loading have their editor removed from the window already
+            if not completed and editor.get_root():
+                self.view.close_page(page)
+
+        editor.connect("notify::progress", on_progress)
+        editor.connect("notify::loading", on_loading)
+        editor.connect("loaded", on_loaded)
+
+    def _on_page_attached(self, _view: Adw.TabView, page: Adw.TabPage, _position: int):
+        """Internal callback for when a page is added to the view, indexes it by its document"""
+        editor = self._get_editor(page)
+        if editor:
+            self.opened_files[editor.document] = (page, editor)
+            self._recent[page] = None
+
+        child = page.get_child()
+        if isinstance(child, EditorPage) and not child.editor and child.path:
+            self._unloaded[canonical_path(child.path)] = page
+        elif isinstance(child, LargeFileViewer):
+            self._viewers[canonical_path(child.path)] = page
+
+    def _on_page_detached(self, _view: Adw.TabView, page: Adw.TabPage, _position: int):
+        """Internal callback for when a page is closed or moved to another view, removes it from the index"""
+        editor = self._get_editor(page)
+        if editor and self.opened_files.get(editor.document, (None,))[0] is page:
+            del self.opened_files[editor.document]
+        self._recent.pop(page, None)
+
+        child = page.get_child()
+        if isinstance(child, EditorPage) and not child.editor and child.path:
+            self._unloaded.pop(canonical_path(child.path), None)
+        elif isinstance(child, LargeFileViewer) and self._viewers.get(canonical_path(child.path)) is page:
+            del self._viewers[canonical_path(child.path)]
+
+    def _on_indicator_activated(self, _view: Adw.TabView, page: Adw.TabPage):
+        """Internal callback for when the indicator of a page is clicked, it stops loading the file of the page"""
+        editor = self._get_editor(page)
+        if editor:
+            editor.cancel_loading()
+
     @Gtk.Template.Callback()
     def _on_close(
         self, view: Adw.TabView, page: Adw.TabPage, *_args: Args, **_kwargs: KwArgs
     ):
-        editor: Editor = cast(Editor, page.get_child())
+        editor = self._get_editor(page)
 
-        if editor.is_saved():
+        # viewers are read-only and unloaded pages saved, so there is nothing to save
+        if not editor:
+            child = page.get_child()
+            if isinstance(child, LargeFileViewer):
+                child.close()
             view.close_page_finish(page, True)
             return Gdk.EVENT_STOP
 
+        def finish(close: bool):
+            # the editor stops loading and watching its file once its page is gone
+            if close:
+                editor.close()
+            view.close_page_finish(page, close)
+
+        # other editors still show the document, so nothing is lost
+        if editor.is_saved() or len(editor.document.views) > 1:
+            finish(True)
+            return Gdk.EVENT_STOP
+
         def cb(res: UnsavedResponse):
             match res:
                 case "save":
-
-                    def cb(close: bool):
-                        view.close_page_finish(page, close)
-
-                    editor.write_to_file(cb)
-
+                    editor.write_to_file(finish)
                 case "cancel":
-                    view.close_page_finish(page, False)
+                    finish(False)
                 case "discard":
-                    view.close_page_finish(page, True)
+                    finish(True)
 
         print("file unsaved")
         unsaved_dialog(cb, editor.get_filename())
@@ -108,9 +501,9 @@ class EditorTabView(Adw.Bin):
     def new_file(self) -> Editor:
         editor = Editor(saved=True)
 
-        page = self.view.prepend(editor)
+        page = self.view.prepend(EditorPage(editor))
 
-        self._setup_editor_bindings(page, editor)
+        self._setup_editor(page, editor)
 
         self.view.set_selected_page(page)
 
@@ -121,3 +514,17 @@ class EditorTabView(Adw.Bin):
 
         if page:
             self.view.close_page(page)
+
+    def close_all(self):
+        """
+        closes the editors and viewers of all pages without asking to save, to be called once the window is closed.
+        The documents stop watching their files and leave the index unless another window shows them
+        """
+        for i in range(self.view.get_n_pages()):
+            child = self.view.get_nth_page(i).get_child()
+            if isinstance(child, EditorPage) and child.editor:
+                child.editor.close()
+            elif isinstance(child, LargeFileViewer):
+                child.close()
+        # the viewers are closed, opening their files again has to make new ones
+        self._viewers.clear()
@@ -0,0 +1,116 @@
+from array import array
+
+from gi.repository import Gtk  # pyright: ignore[reportMissingModuleSource]
+
+
+class TagApplier:
+    """
+    Applies the spans returned by `Highlighter.highlight_spans` to a buffer as tags.
+    It remembers the spans applied to every line, so reapplying only touches the spans that changed.
+    Kept apart from the editor so it can be used, and benchmarked, with a plain Gtk.TextBuffer.
+    """
+
+    def __init__(self, buffer: Gtk.TextBuffer, tags: list[Gtk.TextTag | None]):
+        self._buffer: Gtk.TextBuffer = buffer
+        # tags in the order of the recognized names, the highlighter refers to them by index
+        self._tags: list[Gtk.TextTag | None] = tags
+        # per line the spans whose tags are applied to it, flattened to (start, end, tag index, start, end, ...)
+        # None if the tags of the line are unknown because its text was edited, tags move along with the text they are applied to
+        self._applied: list[tuple[int, ...] | None] = [()]
+
+    def lines_inserted(self, line: int, count: int):
+        """
+        marks `line` as edited and inserts `count` lines after it, to be called before the text is inserted
+        """
+        self._applied[line + 1:line + 1] = [None] * count
+        self._applied[line] = None
+
+    def lines_removed(self, start: int, end: int):
+        """
+        marks `start` as edited and removes the lines after it up to and including `end`, to be called before the text is deleted
+        """
+        del self._applied[start + 1:end + 1]
+        self._applied[start] = None
+
+    def apply(self, start: int, end: int, packed: bytes):
+        """
+        Brings the tags of the lines `start` to `end`, end exclusive, up to date with the spans returned by `Highlighter.highlight_spans`.
+        """
+        # the spans are packed as (line, start, end, tag index) quadruples of integers, sorted by position
+        spans = memoryview(packed).cast("I")
+
+        # group the spans by line, spans outside of the lines are left out
+        end = min(end, len(self._applied))
+        lines: list[list[int]] = [[] for _ in range(start, end)]
+        for i in range(0, len(spans), 4):
+            if start <= spans[i] < end:
+                lines[spans[i] - start].extend(spans[i + 1:i + 4])
+
+        for offset, line_spans in enumerate(lines):
+            self.apply_line(start + offset, tuple(line_spans))
+
+    def export(self, start: int, end: int) -> bytes:
+        """
+        returns the spans applied to the lines `start` to `end`, end exclusive, packed the way `apply` takes them.
+        lines whose tags are unknown are left out
+        """
+        packed = array("I")
+        for line in range(start, min(end, len(self._applied))):
+            spans = self._applied[line]
+            if not spans:
+                continue
+            for i in range(0, len(spans), 3):
+                packed.extend((line, *spans[i:i + 3]))
+        return packed.tobytes()
+
+    def apply_line(self, line: int, spans: tuple[int, ...]):
+        """
+        Brings the tags of a line from the spans applied to it last time to `spans`.
+        Only spans that were removed or added are touched, so an unchanged line costs nothing.
+        """
+        applied = self._applied[line]
+
+        if applied == spans:
+            return
+
+        new = {spans[i:i + 3] for i in range(0, len(spans), 3)}
+
+        if applied is None:
+            # the tags of the line are unknown, so all of them are replaced
+            line_start = self._line_iter(line)
+            line_end = line_start.copy()
+            if not line_end.ends_line():
+                line_end.forward_to_line_end()
+            self._buffer.remove_all_tags(line_start, line_end)
+            added = new
+        else:
+            old = {applied[i:i + 3] for i in range(0, len(applied), 3)}
+            added = new - old
+
+            for span_start, span_end, index in old - new:
+                tag = self._tags[index]
+                if tag:
+                    self._buffer.remove_tag(tag, self._iter_at(line, span_start), self._iter_at(line, span_end))
+
+        # removing happens first, since removed spans may overlap added ones with the same tag
+        for span_start, span_end, index in added:
+            tag = self._tags[index]
+            if tag:
+                self._buffer.apply_tag(tag, self._iter_at(line, span_start), self._iter_at(line, span_end))
+
+        self._applied[line] = spans
+
+    def _line_iter(self, line: int) -> Gtk.TextIter:
+        """
+        returns an iter at the start of a line, lines past the last one are mapped to the end of the buffer
+        """
+        if line >= self._buffer.get_line_count():
+            return self._buffer.get_end_iter()
+
+        _, it = self._buffer.get_iter_at_line(line)
+        return it
+
+    def _iter_at(self, line: int, offset: int) -> Gtk.TextIter:
+        """returns an iter at a char offset in a line"""
+        _, it = self._buffer.get_iter_at_line_offset(line, offset)
+        return it
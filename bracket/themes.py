@@ -1,17 +1,18 @@
-from collections.abc import Generator
 import pathlib
+from typing import Any
 from gi.repository import Gtk, Pango
 import json
 
+# path of the theme loaded by default
+DEFAULT_THEME = pathlib.Path(__file__).parent.resolve() / "theme.json"
 
-def load_theme_from_file(
-    path: pathlib.Path,
-) -> Generator[tuple[str, Gtk.TextTag]] | None:
+
+def read_theme_file(path: pathlib.Path) -> dict[str, dict[str, Any]] | None:
     """
-    function to load a theme from a JSON file and returns the Gtk.TextTags used for styling in a generators
+    function to read a theme from a JSON file, returns a dict mapping tag names to their style info
     if parsing fails it returns `None`
     """
-    
+
     # if the file is not existent it returns
     if not path.is_file():
         return None
@@ -19,7 +20,8 @@ def load_theme_from_file(
     # load the content - may fail so we do handle corresponding errors and  return
     content = None
     try:
-        content = json.load(path.open("r"))
+        with path.open("r") as file:
+            content = json.load(file)
 
     except Exception as e:
         print(e)
@@ -28,32 +30,99 @@ def load_theme_from_file(
     if not isinstance(content, dict):
         return None
 
-    # loop over the json list where k is the tag name and v is a dict containing style info
-    for k, v in content.items():
-        # if the item is npt properly parsed skip it
-        if not isinstance(v, dict) or not isinstance(k, str):
-            continue
-
-        # make a new tag
-        tag = Gtk.TextTag.new(k)
-
-        # retrieve style information
-        color = v.get("color")
-        font_style = v.get("font_style")
-        font_weight = v.get("font_weight")
-
-        # if the inforamtion is properly parsed apply it to the tag
-        if isinstance(color, str):
-            tag.set_property("foreground", color)
-        if isinstance(font_weight, int):
-            tag.set_property("weight", font_weight)
-        if isinstance(font_style, str):
-            styles = {
-                "italic": Pango.Style.ITALIC,
-                "oblique": Pango.Style.OBLIQUE,
-            }
-            style = styles.get(font_style)
-            tag.set_property("style", style)
-
-        # yield the tag and the tag name
-        yield k, tag
+    # k is the tag name and v is a dict containing style info, items that are not properly parsed are skipped
+    return {k: v for k, v in content.items() if isinstance(k, str) and isinstance(v, dict)}
+
+
+def style_tag(tag: Gtk.TextTag, style: dict[str, Any]):
+    """
+    applies the style info of a theme to a tag, styles the tag had before are removed
+    """
+    # unset the previous style so properties missing from the new one fall back to the defaults
+    tag.set_property("foreground-set", False)
+    tag.set_property("weight-set", False)
+    tag.set_property("style-set", False)
+
+    # retrieve style information
+    color = style.get("color")
+    font_style = style.get("font_style")
+    font_weight = style.get("font_weight")
+
+    # if the inforamtion is properly parsed apply it to the tag
+    if isinstance(color, str):
+        tag.set_property("foreground", color)
+    if isinstance(font_weight, int):
+        tag.set_property("weight", font_weight)
+    if isinstance(font_style, str):
+        styles = {
+            "italic": Pango.Style.ITALIC,
+            "oblique": Pango.Style.OBLIQUE,
+        }
+        pango_style = styles.get(font_style)
+        if pango_style is not None:
+            tag.set_property("style", pango_style)
+
+
+def _new_tag(name: str, style: dict[str, Any]) -> Gtk.TextTag:
+    tag = Gtk.TextTag.new(name)
+    style_tag(tag, style)
+    return tag
+
+
+class ThemeRegistry:
+    """
+    Owns the tags used for highlighting, one set of tags in one Gtk.TextTagTable shared by all buffers.
+    Loading a theme restyles the existing tags in place, so editors pick up a new theme without being rebuilt.
+    The names of the tags are the names the highlighters recognize, tags are never removed so their index stays valid,
+    names missing from a newer theme keep their tag but lose its style.
+    """
+
+    def __init__(self):
+        self.tag_table: Gtk.TextTagTable = Gtk.TextTagTable()
+        # names of the tags in the order they were added, highlighters refer to the tags by index into it
+        self.names: list[str] = []
+        # path of the loaded theme, None if no theme was loaded yet
+        self.path: pathlib.Path | None = None
+
+    def load(self, path: pathlib.Path) -> bool:
+        """
+        loads a theme and applies it to the tags, returns False if the theme could not be read.
+        """
+        theme = read_theme_file(path)
+        if theme is None:
+            return False
+
+        for name in self.names:
+            tag = self.tag_table.lookup(name)
+            if tag is not None and name not in theme:
+                style_tag(tag, {})
+
+        for name, style in theme.items():
+            tag = self.tag_table.lookup(name)
+            if tag is None:
+                tag = _new_tag(name, style)
+                self.tag_table.add(tag)
+                self.names.append(name)
+            else:
+                style_tag(tag, style)
+
+        self.path = path
+        return True
+
+    def tags(self) -> list[Gtk.TextTag | None]:
+        """returns the tags in the order of `names`"""
+        return [self.tag_table.lookup(name) for name in self.names]
+
+
+_registry: ThemeRegistry | None = None
+
+
+def get_theme_registry() -> ThemeRegistry:
+    """
+    returns the process-wide theme registry, the default theme is loaded the first time it is requested
+    """
+    global _registry
+    if _registry is None:
+        _registry = ThemeRegistry()
+        _registry.load(DEFAULT_THEME)
+    return _registry
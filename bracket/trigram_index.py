@@ -0,0 +1,377 @@
+from array import array
+from collections import defaultdict
+from concurrent.futures import as_completed
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+from typing import Any, Callable
+
+from gi.repository import GLib  # pyright: ignore[reportMissingModuleSource]
+
+from bracket.files import write_atomic
+from bracket.project_index import crawl
+from bracket.search import binary_probe, get_process_pool, max_file_size
+from bracket.workers import run_in_worker
+
+# an indexed file: (path relative to the root, mtime in ns, size), None once the file is removed or indexed again
+type IndexedFile = tuple[str, int, int] | None
+# what `file_trigrams` returns for a file: (path, mtime in ns, size, its distinct trigrams joined)
+type FileTrigrams = tuple[str, int, int, bytes]
+
+
+def file_trigrams(root: str, paths: list[str]) -> list[FileTrigrams]:
+    """
+    returns the distinct trigrams of the lowercased content of files below `root`, files that can not be read are left out.
+    Binary and large files get no trigrams, since they are not searched anyway. Runs in a worker process
+    """
+    res: list[FileTrigrams] = []
+    for path in paths:
+        full = os.path.join(root, path)
+        try:
+            stat = os.stat(full)
+            with open(full, "rb") as file:
+                data = file.read(max_file_size + 1)
+        except OSError:
+            continue
+
+        if len(data) > max_file_size or b"\0" in data[:binary_probe]:
+            res.append((path, stat.st_mtime_ns, stat.st_size, b""))
+            continue
+
+        data = data.lower()
+        trigrams = {data[i:i + 3] for i in range(len(data) - 2)}
+        res.append((path, stat.st_mtime_ns, stat.st_size, b"".join(trigrams)))
+    return res
+
+
+def required_literals(query: str, regex: bool) -> list[bytes]:
+    """
+    returns parts of a query every match contains, for the index to look up. Only plain runs of a regular expression
+    are taken, patterns with alternatives or groups give none, since their parts may be optional
+    """
+    if not regex:
+        return [query.encode("utf-8")]
+
+    literals: list[str] = []
+    run = ""
+    i = 0
+    while i < len(query):
+        c = query[i]
+        if c == "\\" and i + 1 < len(query):
+            # escaped letters and digits are classes, assertions or references, other escaped chars are themselves
+            if query[i + 1].isalnum():
+                literals.append(run)
+                run = ""
+                i += 2
+                continue
+            token = query[i + 1]
+            i += 2
+        elif c in "|()":
+            return []
+        elif c == "[":
+            end = query.find("]", i + 2)
+            if end == -1:
+                return []
+            literals.append(run)
+            run = ""
+            i = end + 1
+            continue
+        elif c in ".^$*+?{":
+            literals.append(run)
+            run = ""
+            # the count of a quantifier is no text
+            i = query.find("}", i) + 1 if c == "{" and "}" in query[i:] else i + 1
+            continue
+        else:
+            token = c
+            i += 1
+
+        # a quantified char may be missing or repeated, the run ends before it
+        if i < len(query) and query[i] in "*?{+":
+            literals.append(run + token if query[i] == "+" else run)
+            run = ""
+            continue
+        run += token
+
+    literals.append(run)
+    return [literal.encode("utf-8") for literal in literals if len(literal.encode("utf-8")) >= 3]
+
+
+class TrigramIndex:
+    """
+    Index of the trigrams, runs of three bytes, in the content of the files below a directory, to find the files that may
+    contain a text without reading all of them, see `candidates`. Trigrams are taken from the lowercased content,
+    so the files found are a superset of the ones matching with or without case.
+    Stored in the user cache directory, one file per directory: a JSON header line with the indexed files
+    followed by the posting lists, for every trigram the numbers of the files containing it.
+    `start` reads the stored index and brings it up to date with the directory on a worker, files whose modification
+    time or size changed are indexed again, in the search processes. Later changes are passed in with `refresh`,
+    files changed but not indexed again yet are always candidates.
+    A file indexed again gets a new number, the old one stays in the posting lists until the index is written compacted.
+    """
+
+    version: int = 1
+    # files per batch handed to the search processes
+    batch_size: int = 64
+    # the posting lists are compacted when written once this share of the file numbers is unused
+    compact_ratio: float = 0.25
+
+    def __init__(self, root: pathlib.Path, path: pathlib.Path | None = None):
+        self.root: pathlib.Path = root
+        key = hashlib.blake2b(str(root.resolve()).encode("utf-8"), digest_size=16).hexdigest()
+        self.path: pathlib.Path = path or pathlib.Path(GLib.get_user_cache_dir()) / "bracket" / "trigrams" / f"{key}.index"
+        # whether the index is up to date with the directory and can be used
+        self.ready: bool = False
+        # time.time() when the index was last brought up to date, None before
+        self.updated: float | None = None
+        # size of the stored index in bytes
+        self.disk_size: int = 0
+        # called on the main loop once the index is ready
+        self.on_ready: Callable[[], None] | None = None
+
+        self._files: list[IndexedFile] = []
+        self._ids: dict[str, int] = {}
+        self._postings: defaultdict[bytes, array[int]] = defaultdict(lambda: array("I"))
+        # guards the files and postings, the worker updating them and the main loop reading them run at the same time
+        self._lock: threading.Lock = threading.Lock()
+        self._cancelled: threading.Event = threading.Event()
+        # whether the index changed since it was written
+        self._dirty: bool = False
+        # paths passed to `refresh` that are not indexed again yet, and the ones being indexed again on a worker
+        self._changed: set[str] = set()
+        self._refreshing: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def start(self):
+        """reads the stored index and updates it on a worker, the index is ready afterwards"""
+        run_in_worker(self._update, self._on_updated)
+
+    def stop(self):
+        """stops updating, changes not written yet are written on a worker"""
+        self._cancelled.set()
+        if self._dirty:
+            run_in_worker(self._write, lambda _result: None)
+
+    def refresh(self, paths: set[str]):
+        """
+        indexes files again that were written to, added or removed, given relative to the root.
+        Paths passed in before the index is ready are kept until it is, one refresh runs at a time
+        """
+        if self._cancelled.is_set():
+            return
+        self._changed.update(paths)
+        if self.ready and not self._refreshing:
+            self._start_refresh()
+
+    def _start_refresh(self):
+        paths = self._refreshing = self._changed
+        self._changed = set()
+        run_in_worker(lambda: self._refresh(paths), self._on_refreshed)
+
+    def _on_refreshed(self, _result: None):
+        """Internal callback for when changed files were indexed again, the ones changed meanwhile are next"""
+        self._refreshing = set()
+        if self._changed and not self._cancelled.is_set():
+            self._start_refresh()
+
+    def candidates(self, literals: list[bytes]) -> list[str] | None:
+        """
+        returns the paths of the files containing the trigrams of all `literals`, ignoring case, along with the files
+        changed since they were indexed. None if the index can not narrow the files down, because it is not ready or
+        the literals are too short
+        """
+        trigrams = {literal.lower()[i:i + 3] for literal in literals for i in range(len(literal) - 2)}
+        if not self.ready or not trigrams:
+            return None
+
+        with self._lock:
+            lists = sorted((self._postings.get(t, array("I")) for t in trigrams), key=len)
+            ids = set(lists[0])
+            for ids_of_trigram in lists[1:]:
+                if not ids:
+                    break
+                ids.intersection_update(ids_of_trigram)
+
+            files = [self._files[i] for i in sorted(ids)]
+
+        paths = [file[0] for file in files if file]
+        # the index may be behind for these, so they are searched whatever it says
+        unindexed = self._changed | self._refreshing
+        return paths + sorted(unindexed.difference(paths))
+
+    def describe(self) -> str:
+        """size and age of the index for people"""
+        if not self.ready or self.updated is None:
+            return "building text index…"
+
+        age = time.time() - self.updated
+        if age < 60:
+            freshness = "just now"
+        elif age < 3600:
+            freshness = f"{int(age // 60)} min ago"
+        else:
+            freshness = f"{int(age // 3600)} h ago"
+        return f"text index of {len(self)} files, {self.disk_size / (1 << 20):.1f} MiB, updated {freshness}"
+
+    def _on_updated(self, _result: None):
+        """Internal callback for when the index was brought up to date, the changes passed in meanwhile are indexed next"""
+        if self._cancelled.is_set():
+            return
+        self.ready = True
+        if self._changed:
+            self._start_refresh()
+        if self.on_ready:
+            self.on_ready()
+
+    def _update(self):
+        """reads the stored index and indexes the files that changed since, runs on a worker"""
+        self._read()
+
+        seen: set[str] = set()
+        stale: list[str] = []
+        for files, _directories in crawl(self.root, "", (), self._cancelled, 5000):
+            for path in files:
+                seen.add(path)
+                file = self._files[self._ids[path]] if path in self._ids else None
+                try:
+                    stat = os.stat(self.root / path)
+                except OSError:
+                    continue
+                if not file or (file[1], file[2]) != (stat.st_mtime_ns, stat.st_size):
+                    stale.append(path)
+
+        if self._cancelled.is_set():
+            return
+
+        with self._lock:
+            for path in [p for p in self._ids if p not in seen]:
+                self._forget(path)
+
+        pool = get_process_pool()
+        root = str(self.root)
+        futures = [
+            pool.submit(file_trigrams, root, stale[i:i + self.batch_size]) for i in range(0, len(stale), self.batch_size)
+        ]
+        for future in as_completed(futures):
+            if self._cancelled.is_set():
+                for future in futures:
+                    future.cancel()
+                return
+            self._add(future.result())
+
+        self.updated = time.time()
+        if self._dirty:
+            self._write()
+
+    def _refresh(self, paths: set[str]):
+        """indexes changed files again and forgets removed ones, runs on a worker"""
+        changed: list[str] = []
+        with self._lock:
+            for path in paths:
+                full = self.root / path
+                if full.is_file():
+                    changed.append(path)
+                    continue
+                # a removed directory takes the files below it along
+                prefix = f"{path}/"
+                for indexed in [p for p in self._ids if p == path or p.startswith(prefix)]:
+                    self._forget(indexed)
+
+        self._add(file_trigrams(str(self.root), changed))
+        self.updated = time.time()
+
+    def _forget(self, path: str):
+        """marks the number of a file unused, to be called with the lock held"""
+        self._files[self._ids.pop(path)] = None
+        self._dirty = True
+
+    def _add(self, files: list[FileTrigrams]):
+        with self._lock:
+            for path, mtime, size, trigrams in files:
+                if path in self._ids:
+                    self._forget(path)
+                file_id = len(self._files)
+                self._files.append((path, mtime, size))
+                self._ids[path] = file_id
+                postings = self._postings
+                for i in range(0, len(trigrams), 3):
+                    postings[trigrams[i:i + 3]].append(file_id)
+            self._dirty = True
+
+    def _read(self):
+        """reads the stored index, a missing, broken or outdated one leaves the index empty"""
+        try:
+            with self.path.open("rb") as file:
+                header: dict[str, Any] = json.loads(file.readline())
+                body = file.read()
+        except (OSError, ValueError):
+            return
+
+        if header.get("version") != self.version or header.get("root") != str(self.root):
+            return
+
+        files: list[IndexedFile] = [tuple(file) if file else None for file in header.get("files", [])]  # pyright: ignore[reportAssignmentType]
+        postings: defaultdict[bytes, array[int]] = defaultdict(lambda: array("I"))
+        view = memoryview(body)
+        position = 0
+        try:
+            # every list is the trigram, the number of files as an unsigned int and the numbers of the files
+            while position < len(view):
+                trigram = bytes(view[position:position + 3])
+                count = view[position + 3:position + 7].cast("I")[0]
+                ids = array("I")
+                ids.frombytes(view[position + 7:position + 7 + 4 * count])
+                postings[trigram] = ids
+                position += 7 + 4 * count
+        except (ValueError, TypeError, IndexError):
+            return
+
+        with self._lock:
+            self._files = files
+            self._ids = {file[0]: i for i, file in enumerate(files) if file}
+            self._postings = postings
+        self.disk_size = self.path.stat().st_size
+
+    def _write(self):
+        """writes the index to the cache, compacted if many file numbers are unused"""
+        with self._lock:
+            if len(self._files) - len(self._ids) > self.compact_ratio * len(self._files):
+                self._compact()
+
+            header = {"version": self.version, "root": str(self.root), "files": self._files}
+            parts = [json.dumps(header).encode("utf-8"), b"\n"]
+            for trigram, ids in self._postings.items():
+                parts.append(trigram)
+                parts.append(array("I", (len(ids),)).tobytes())
+                parts.append(ids.tobytes())
+            self._dirty = False
+
+        try:
+            write_atomic(self.path, b"".join(parts), fsync=False)
+            self.disk_size = self.path.stat().st_size
+        except OSError as e:
+            print(e)
+
+    def _compact(self):
+        """numbers the files from 0 again, leaving out unused numbers, to be called with the lock held"""
+        numbers = array("i", [-1]) * len(self._files)
+        files: list[IndexedFile] = []
+        for old, file in enumerate(self._files):
+            if file:
+                numbers[old] = len(files)
+                files.append(file)
+
+        postings: defaultdict[bytes, array[int]] = defaultdict(lambda: array("I"))
+        for trigram, ids in self._postings.items():
+            kept = array("I", [numbers[i] for i in ids if numbers[i] >= 0])
+            if kept:
+                postings[trigram] = kept
+
+        self._files = files
+        self._ids = {file[0]: i for i, file in enumerate(files) if file}
+        self._postings = postings
@@ -1,5 +1,128 @@
+import difflib
+from itertools import accumulate
 from typing import Any
 
 
 type Args = tuple[Any]
 type KwArgs = dict[str, Any]
+
+
+class LineRanges:
+    """
+    Set of lines stored as sorted, non-overlapping half-open intervals `[start, end)`.
+    Used by the editor to remember which lines are already highlighted.
+    """
+
+    def __init__(self):
+        self._ranges: list[tuple[int, int]] = []
+
+    def clear(self):
+        self._ranges.clear()
+
+    def copy(self) -> "LineRanges":
+        res = LineRanges()
+        res._ranges = list(self._ranges)
+        return res
+
+    def add(self, start: int, end: int):
+        """adds the lines `[start, end)`, merging them with touching or overlapping intervals"""
+        if start >= end:
+            return
+
+        res: list[tuple[int, int]] = []
+        for s, e in self._ranges:
+            # interval lies completely before or after the new one
+            if e < start or s > end:
+                res.append((s, e))
+                continue
+            # merge it into the new one
+            start, end = min(s, start), max(e, end)
+
+        res.append((start, end))
+        res.sort()
+        self._ranges = res
+
+    def remove(self, start: int, end: int):
+        """removes the lines `[start, end)`, intervals overlapping them are cut"""
+        res: list[tuple[int, int]] = []
+        for s, e in self._ranges:
+            if s < start:
+                res.append((s, min(e, start)))
+            if e > end:
+                res.append((max(s, end), e))
+        self._ranges = res
+
+    def missing(self, start: int, end: int) -> list[tuple[int, int]]:
+        """returns the intervals of `[start, end)` not contained in the set"""
+        res: list[tuple[int, int]] = []
+        pos = start
+        for s, e in self._ranges:
+            if e <= pos:
+                continue
+            if s >= end:
+                break
+            if s > pos:
+                res.append((pos, s))
+            pos = max(pos, e)
+
+        if pos < end:
+            res.append((pos, end))
+        return res
+
+    def shift(self, line: int, delta: int):
+        """
+        moves the intervals after `line` by `delta` lines, used when lines are inserted after `line` (positive delta)
+        or the lines following it are removed (negative delta)
+        """
+        def moved(b: int) -> int:
+            if b <= line:
+                return b
+            # boundaries inside of removed lines collapse onto the line after `line`
+            return b + delta if delta >= 0 else max(b + delta, line + 1)
+
+        res: list[tuple[int, int]] = []
+        for s, e in self._ranges:
+            s, e = moved(s), moved(e)
+            if s < e:
+                res.append((s, e))
+        self._ranges = res
+
+
+def _lines(text: str) -> list[str]:
+    """splits text into lines keeping their newlines, the last line is the text after the last newline"""
+    lines = text.split("\n")
+    return [line + "\n" for line in lines[:-1]] + [lines[-1]]
+
+
+def line_hunks(old: str, new: str) -> list[tuple[int, int, str]]:
+    """
+    returns the changes turning `old` into `new` as `(start, end, text)` hunks: the chars `start` to `end` of `old`,
+    end exclusive, are replaced by `text`. The hunks cover whole lines, are sorted and do not overlap,
+    applying them from the last to the first keeps the offsets of the ones before valid.
+    """
+    old_lines, new_lines = _lines(old), _lines(new)
+
+    # lines at the start and end are usually unchanged, skipping them keeps the diff itself small
+    prefix = 0
+    for a, b in zip(old_lines, new_lines):
+        if a != b:
+            break
+        prefix += 1
+    suffix = 0
+    for a, b in zip(reversed(old_lines[prefix:]), reversed(new_lines[prefix:])):
+        if a != b:
+            break
+        suffix += 1
+
+    old_middle = old_lines[prefix:len(old_lines) - suffix]
+    new_middle = new_lines[prefix:len(new_lines) - suffix]
+    # char offset of every line of the middle part of `old`, plus the end of the last one
+    offsets = list(accumulate((len(line) for line in old_middle), initial=sum(len(line) for line in old_lines[:prefix])))
+
+    matcher = difflib.SequenceMatcher(None, old_middle, new_middle, autojunk=False)
+    return [
+        (offsets[i1], offsets[i2], "".join(new_middle[j1:j2]))
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
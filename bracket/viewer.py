@@ -0,0 +1,211 @@
+from array import array
+import bisect
+import mmap
+import pathlib
+import threading
+
+from gi.repository import GLib, GObject, Gio, Gtk  # pyright: ignore[reportMissingModuleSource]
+
+from bracket.workers import run_in_worker
+
+
+class LineIndex:
+    """
+    Finds lines in a memory mapped file without keeping an offset per line.
+    The file is split into blocks of `block_size` bytes and only the number of lines before every block is stored,
+    so the index takes 8 bytes per block. A line is found by looking up its block and scanning that block for it.
+    """
+
+    block_size: int = 1 << 16
+    # lines longer than this are cut off when read, so a file without newlines does not end up in a single huge string
+    max_line_length: int = 1 << 14
+
+    def __init__(self, data: mmap.mmap):
+        self._data: mmap.mmap = data
+        # number of newlines before the start of every block indexed so far
+        self._newlines: array[int] = array("Q", [0])
+        # whether the whole file is indexed
+        self.complete: bool = False
+
+    @property
+    def line_count(self) -> int:
+        """number of lines indexed so far, all of them once the index is complete"""
+        # the line after the last newline of the indexed blocks may continue in the next block
+        return self._newlines[-1] + 1 if self.complete else self._newlines[-1]
+
+    def build(self, cancelled: threading.Event):
+        """indexes the file block by block, to be run on a worker thread. Stops early if `cancelled` is set"""
+        size = len(self._data)
+        newlines = 0
+
+        for start in range(0, size, self.block_size):
+            if cancelled.is_set():
+                return
+            # counting is done in C on a copy of the block, which is small enough to be cheap
+            newlines += self._data[start:start + self.block_size].count(b"\n")
+            self._newlines.append(newlines)
+
+        self.complete = True
+
+    def line_start(self, line: int) -> int:
+        """returns the offset of the first byte of a line"""
+        if line <= 0:
+            return 0
+
+        # the block containing the newline ending the previous line
+        block = bisect.bisect_left(self._newlines, line) - 1
+        position = block * self.block_size
+
+        # skip the newlines in the block before the one ending the previous line
+        for _ in range(line - self._newlines[block]):
+            position = self._data.find(b"\n", position) + 1
+
+        return position
+
+    def line(self, line: int) -> str:
+        """returns the text of a line without its newline, invalid UTF-8 is replaced"""
+        start = self.line_start(line)
+        end = self._data.find(b"\n", start, start + self.max_line_length)
+        if end < 0:
+            end = min(start + self.max_line_length, len(self._data))
+
+        return self._data[start:end].decode("utf-8", errors="replace")
+
+
+class LineModel(GObject.Object, Gio.ListModel):
+    """
+    List model with one Gtk.StringObject per line of a file, items are only created when a list asks for them.
+    The number of items grows with the index, `update` has to be called to announce new lines.
+    """
+
+    def __init__(self, index: LineIndex):
+        super().__init__()
+        self._index: LineIndex = index
+        self._n_items: int = 0
+
+    def do_get_item_type(self) -> GObject.GType:
+        return Gtk.StringObject.__gtype__
+
+    def do_get_n_items(self) -> int:
+        return self._n_items
+
+    def do_get_item(self, position: int) -> Gtk.StringObject | None:
+        if position >= self._n_items:
+            return None
+        return Gtk.StringObject.new(self._index.line(position))
+
+    def update(self):
+        """announces the lines indexed since the last call"""
+        n_items = self._index.line_count
+        if n_items == self._n_items:
+            return
+
+        added = n_items - self._n_items
+        self._n_items = n_items
+        self.items_changed(n_items - added, 0, added)
+
+
+class LargeFileViewer(Gtk.ScrolledWindow):
+    """
+    Read-only view of a file that is too large to be loaded into a text buffer.
+    The file is memory mapped and only the visible lines are read from it, so memory use depends on the size of the
+    line index and not on the size of the file. The index is built on a worker thread, lines show up as it grows.
+    """
+
+    # interval in milliseconds in which lines indexed in the meantime are added to the view
+    update_interval: int = 250
+
+    def __init__(self, path: pathlib.Path):
+        super().__init__(hscrollbar_policy=Gtk.PolicyType.AUTOMATIC, vscrollbar_policy=Gtk.PolicyType.AUTOMATIC)
+        self.path: pathlib.Path = path
+
+        with path.open("rb") as file:
+            self._data: mmap.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.index: LineIndex = LineIndex(self._data)
+        self._model: LineModel = LineModel(self.index)
+        self._cancelled: threading.Event = threading.Event()
+        self._indexing: bool = True
+        self._closed: bool = False
+        # line to scroll to once it is indexed, see `goto_line`
+        self._pending_line: int | None = None
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self._on_setup)
+        factory.connect("bind", self._on_bind)
+
+        self._list: Gtk.ListView = Gtk.ListView(model=Gtk.NoSelection(model=self._model), factory=factory)
+        self._list.add_css_class("monospace")
+        self.set_child(self._list)
+
+        self._update_source: int = GLib.timeout_add(self.update_interval, self._on_update)
+        run_in_worker(lambda: self.index.build(self._cancelled), self._on_indexed)
+
+    def goto_line(self, line: int):
+        """scrolls to a line, a line that is not indexed yet is scrolled to once it is, while the file is still being indexed"""
+        self._pending_line = None
+        if line < 0:
+            return
+        if line < self._model.get_n_items():
+            self._list.scroll_to(line, Gtk.ListScrollFlags.NONE, None)
+        elif self._indexing:
+            self._pending_line = line
+
+    def _scroll_to_pending_line(self):
+        """scrolls to the line passed to `goto_line` if it was indexed in the meantime"""
+        if self._pending_line is not None:
+            self.goto_line(self._pending_line)
+
+    def close(self):
+        """stops indexing and unmaps the file, the viewer must not be shown afterwards"""
+        if self._closed:
+            return
+
+        self._closed = True
+        self._cancelled.set()
+        if self._update_source:
+            GLib.source_remove(self._update_source)
+            self._update_source = 0
+        # the worker may still read the file, it is unmapped once it stopped
+        if not self._indexing:
+            self._data.close()
+
+    def _on_setup(self, _factory: Gtk.SignalListItemFactory, item: Gtk.ListItem):
+        """creates the widgets of a row, the line number and the text of the line"""
+        number = Gtk.Inscription(xalign=1, min_chars=8, nat_chars=8)
+        number.add_css_class("dim-label")
+        text = Gtk.Inscription(xalign=0, hexpand=True, margin_start=12)
+
+        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        box.append(number)
+        box.append(text)
+        item.set_child(box)
+
+    def _on_bind(self, _factory: Gtk.SignalListItemFactory, item: Gtk.ListItem):
+        """fills the widgets of a row with the line it shows"""
+        box = item.get_child()
+        number = box.get_first_child()
+        text = number.get_next_sibling()
+
+        number.set_text(str(item.get_position() + 1))
+        text.set_text(item.get_item().get_string())
+
+    def _on_update(self) -> bool:
+        """adds the lines indexed in the meantime to the view"""
+        self._model.update()
+        self._scroll_to_pending_line()
+        return GLib.SOURCE_CONTINUE
+
+    def _on_indexed(self, _result: None):
+        """Internal callback for when the worker stopped indexing"""
+        self._indexing = False
+
+        if self._closed:
+            self._data.close()
+            return
+
+        if self._update_source:
+            GLib.source_remove(self._update_source)
+            self._update_source = 0
+        self._model.update()
+        self._scroll_to_pending_line()
@@ -0,0 +1,33 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from gi.repository import GLib  # pyright: ignore[reportMissingModuleSource]
+
+# shared pool for work that would block the main loop, like highlighting
+# the highlighter releases the GIL while it works, so several documents are highlighted in parallel
+_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="bracket-worker")
+
+
+def run_in_worker[T](work: Callable[[], T], callback: Callable[[T | None], None]) -> Future[T]:
+    """
+    Runs `work` on the worker pool and calls `callback` with its result on the GLib main loop,
+    so the callback may touch widgets. If `work` raises, the error is printed and the callback is called with `None`.
+    """
+    def on_done(future: Future[T]):
+        result: T | None = None
+        try:
+            result = future.result()
+        except Exception as e:
+            print(e)
+
+        # GLib.idle_add is safe to call from any thread, the callback runs on the main loop
+        def deliver(*_args: object) -> bool:
+            callback(result)
+            return GLib.SOURCE_REMOVE
+
+        GLib.idle_add(deliver)
+
+    future = _pool.submit(work)
+    future.add_done_callback(on_done)
+    return future
@@ -1,7 +1,10 @@
-use pyo3::{exceptions::PyOSError, prelude::*};
+use pyo3::{exceptions::PyOSError, prelude::*, types::PyBytes};
 use std::error::Error;
-use std::sync::RwLock;
-use tree_sitter_highlight as hl;
+use std::ops::Range;
+use std::sync::{Arc, Mutex, MutexGuard, RwLock, RwLockReadGuard};
+use tree_sitter::{InputEdit, Parser, Point, QueryCursor, StreamingIterator, Tree};
+
+use crate::registry::{self, Grammar};
 
 #[pyclass]
 pub enum HLEvent {
@@ -10,14 +13,356 @@ pub enum HLEvent {
     End(),
 }
 
+// shared grammar of a language together with the recognized name every capture of its query maps to
+struct Configuration {
+    grammar: Arc<Grammar>,
+    highlight_indices: Vec<Option<usize>>,
+}
+
+impl Configuration {
+    // maps the captures of the query to the recognized names the same way tree-sitter-highlight does:
+    // a name matches if all of its dot-separated parts appear in the capture name, the longest match wins
+    fn new(grammar: Arc<Grammar>, recognized_names: &[String]) -> Self {
+        let highlight_indices = grammar
+            .query
+            .capture_names()
+            .iter()
+            .map(|capture_name| {
+                let capture_parts: Vec<&str> = capture_name.split('.').collect();
+                let mut best_index = None;
+                let mut best_match_len = 0;
+
+                for (i, recognized_name) in recognized_names.iter().enumerate() {
+                    let parts: Vec<&str> = recognized_name.split('.').collect();
+                    if parts.iter().all(|part| capture_parts.contains(part))
+                        && parts.len() > best_match_len
+                    {
+                        best_index = Some(i);
+                        best_match_len = parts.len();
+                    }
+                }
+                best_index
+            })
+            .collect();
+
+        Self {
+            grammar,
+            highlight_indices,
+        }
+    }
+}
+
+// text of the document as of the last edit, the syntax tree of the last highlight
+// and the byte ranges edited since then
+struct Document {
+    // shared with a running parse instead of copied for it, an edit made meanwhile copies it before changing it
+    source: Arc<Vec<u8>>,
+    // bumped on every change of the text, tells whether a parse of a copy of the text is still current
+    revision: u64,
+    // byte and char offset at which each line starts, the first line always starts at 0
+    // kept up to date on edits, so offsets can be converted without counting from the start of the text
+    line_starts: Vec<usize>,
+    line_chars: Vec<usize>,
+    tree: Option<Tree>,
+    edited: Vec<Range<usize>>,
+}
+
+impl Document {
+    fn new() -> Self {
+        Self {
+            source: Arc::new(Vec::new()),
+            revision: 0,
+            line_starts: vec![0],
+            line_chars: vec![0],
+            tree: None,
+            edited: Vec::new(),
+        }
+    }
+
+    fn set_text(&mut self, text: &str) {
+        self.source = Arc::new(text.as_bytes().to_vec());
+        self.revision += 1;
+        // one pass over the text for both the byte and char offsets of the lines
+        (self.line_starts, self.line_chars) = std::iter::once((0, 0))
+            .chain(newlines(text, 0, 0))
+            .unzip();
+        self.tree = None;
+        self.edited.clear();
+    }
+
+    fn byte_at(&self, (row, column): (usize, usize)) -> usize {
+        match self.line_starts.get(row) {
+            Some(start) => (start + column).min(self.source.len()),
+            None => self.source.len(),
+        }
+    }
+
+    fn point_at(&self, byte: usize) -> Point {
+        let row = self.line_starts.partition_point(|&start| start <= byte) - 1;
+        Point::new(row, byte - self.line_starts[row])
+    }
+
+    // byte offset at which a line starts, the end of the text for lines past it
+    fn line_start(&self, row: usize) -> usize {
+        self.line_starts.get(row).copied().unwrap_or(self.source.len())
+    }
+
+    // exclusive line number of a range ending at `byte`, which is the start of a line or the end of the text
+    fn line_end(&self, byte: usize) -> usize {
+        if byte >= self.source.len() {
+            self.line_starts.len()
+        } else {
+            self.point_at(byte).row
+        }
+    }
+
+    // extends a byte range to the start and the end of the lines it touches
+    fn whole_lines(&self, range: &Range<usize>) -> Range<usize> {
+        let start = self.line_starts[self.point_at(range.start).row];
+        start..self.line_start(self.point_at(range.end).row + 1)
+    }
+
+    // converts the byte offsets of spans sorted by position into char offsets
+    fn char_offsets(&self, spans: &[(usize, usize, usize)]) -> Vec<(usize, usize, usize)> {
+        let mut chars = CharCounter::new(self);
+        spans
+            .iter()
+            .map(|&(start, end, highlight)| (chars.char_at(start), chars.char_at(end), highlight))
+            .collect()
+    }
+
+    // splits spans at line ends into (line, start char in line, end char in line, highlight),
+    // the newline ending a line does not belong to any span
+    fn split_lines(&self, spans: &[(usize, usize, usize)]) -> Vec<(usize, usize, usize, usize)> {
+        let mut res = Vec::with_capacity(spans.len());
+        let mut chars = CharCounter::new(self);
+
+        for &(start, end, highlight) in spans {
+            let mut row = self.point_at(start).row;
+            let mut pos = start;
+
+            while pos < end {
+                let next = self.line_start(row + 1);
+                let content_end = if row + 1 < self.line_starts.len() {
+                    next - 1
+                } else {
+                    next
+                };
+
+                let span_end = end.min(content_end);
+                if pos < span_end {
+                    let line_chars = self.line_chars[row];
+                    res.push((
+                        row,
+                        chars.char_at(pos) - line_chars,
+                        chars.char_at(span_end) - line_chars,
+                        highlight,
+                    ));
+                }
+                pos = next;
+                row += 1;
+            }
+        }
+        res
+    }
+
+    // replaces the text between two (row, byte column) positions and keeps the old tree in sync
+    fn edit(&mut self, start: (usize, usize), old_end: (usize, usize), text: &str) {
+        let start_byte = self.byte_at(start);
+        let old_end_byte = self.byte_at(old_end).max(start_byte);
+        let new_end_byte = start_byte + text.len();
+
+        let start_position = self.point_at(start_byte);
+        let old_end_position = self.point_at(old_end_byte);
+
+        let start_char = CharCounter::new(self).char_at(start_byte);
+        let deleted_chars = count_chars(&self.source[start_byte..old_end_byte]);
+        let inserted_chars = count_chars(text.as_bytes());
+
+        Arc::make_mut(&mut self.source).splice(start_byte..old_end_byte, text.bytes());
+        self.revision += 1;
+
+        // lines starting inside the replaced text are dropped, the ones after it are shifted
+        let first = self.line_starts.partition_point(|&s| s <= start_byte);
+        let last = self.line_starts.partition_point(|&s| s <= old_end_byte);
+        let (inserted, inserted_line_chars): (Vec<usize>, Vec<usize>) =
+            newlines(text, start_byte, start_char).unzip();
+        let shifted = first + inserted.len();
+        self.line_starts.splice(first..last, inserted);
+        self.line_chars.splice(first..last, inserted_line_chars);
+        for line_start in &mut self.line_starts[shifted..] {
+            *line_start = *line_start + new_end_byte - old_end_byte;
+        }
+        for line_chars in &mut self.line_chars[shifted..] {
+            *line_chars = *line_chars + inserted_chars - deleted_chars;
+        }
+
+        for range in &mut self.edited {
+            range.start = shift_start(range.start, start_byte, old_end_byte, new_end_byte);
+            range.end = shift_end(range.end, start_byte, old_end_byte, new_end_byte);
+        }
+        self.edited.push(start_byte..new_end_byte);
+
+        let new_end_position = self.point_at(new_end_byte);
+        if let Some(tree) = self.tree.as_mut() {
+            tree.edit(&InputEdit {
+                start_byte,
+                old_end_byte,
+                new_end_byte,
+                start_position,
+                old_end_position,
+                new_end_position,
+            });
+        }
+    }
+}
+
+// converts byte offsets into char offsets, it remembers the last conversion and counts on from there,
+// so converting ascending offsets costs no more than one pass over the text in total
+struct CharCounter<'a> {
+    document: &'a Document,
+    row: usize,
+    byte: usize,
+    chars: usize,
+}
+
+impl<'a> CharCounter<'a> {
+    fn new(document: &'a Document) -> Self {
+        Self {
+            document,
+            row: 0,
+            byte: 0,
+            chars: 0,
+        }
+    }
+
+    fn char_at(&mut self, byte: usize) -> usize {
+        // offsets in other lines or behind the last one start counting from the start of their line
+        let row = self.document.point_at(byte).row;
+        if row != self.row || byte < self.byte {
+            self.row = row;
+            self.byte = self.document.line_starts[row];
+            self.chars = self.document.line_chars[row];
+        }
+
+        self.chars += count_chars(&self.document.source[self.byte..byte]);
+        self.byte = byte;
+        self.chars
+    }
+}
+
+// number of chars in valid UTF-8, every byte that is not a continuation byte starts a char
+fn count_chars(bytes: &[u8]) -> usize {
+    bytes.iter().filter(|b| (**b & 0xC0) != 0x80).count()
+}
+
+// (byte, char) offsets at which the lines following each newline of `text` start,
+// given `text` starts at byte `offset` and char `char_offset`
+fn newlines(
+    text: &str,
+    offset: usize,
+    char_offset: usize,
+) -> impl Iterator<Item = (usize, usize)> + '_ {
+    let mut chars = char_offset;
+    text.bytes().enumerate().filter_map(move |(i, b)| {
+        if (b & 0xC0) != 0x80 {
+            chars += 1;
+        }
+        (b == b'\n').then_some((offset + i + 1, chars))
+    })
+}
+
+fn shift_start(pos: usize, start: usize, old_end: usize, new_end: usize) -> usize {
+    if pos <= start {
+        pos
+    } else if pos >= old_end {
+        pos + new_end - old_end
+    } else {
+        start
+    }
+}
+
+fn shift_end(pos: usize, start: usize, old_end: usize, new_end: usize) -> usize {
+    if pos <= start {
+        pos
+    } else if pos >= old_end {
+        pos + new_end - old_end
+    } else {
+        new_end
+    }
+}
+
+// sorts the ranges and merges the ones overlapping or touching each other
+fn merge_ranges(mut ranges: Vec<Range<usize>>) -> Vec<Range<usize>> {
+    ranges.sort_by_key(|r| r.start);
+    let mut merged: Vec<Range<usize>> = Vec::with_capacity(ranges.len());
+
+    for range in ranges {
+        match merged.last_mut() {
+            Some(last) if range.start <= last.end => last.end = last.end.max(range.end),
+            _ => merged.push(range),
+        }
+    }
+    merged
+}
+
+// turns nested (start, end, highlight) spans sorted by start into non-overlapping ones,
+// every byte gets the highlight of the innermost span containing it
+fn flatten(spans: &[(usize, usize, usize)]) -> Vec<(usize, usize, usize)> {
+    fn push(res: &mut Vec<(usize, usize, usize)>, start: usize, end: usize, highlight: usize) {
+        if start >= end {
+            return;
+        }
+        match res.last_mut() {
+            Some(last) if last.1 == start && last.2 == highlight => last.1 = end,
+            _ => res.push((start, end, highlight)),
+        }
+    }
+
+    let mut res = Vec::with_capacity(spans.len());
+    // (end, highlight) of the spans enclosing the current position
+    let mut stack: Vec<(usize, usize)> = Vec::new();
+    let mut pos = 0;
+
+    for &(start, end, highlight) in spans {
+        while let Some(&(top_end, top_highlight)) = stack.last() {
+            if top_end > start {
+                break;
+            }
+            push(&mut res, pos, top_end, top_highlight);
+            pos = pos.max(top_end);
+            stack.pop();
+        }
+
+        // spans partially overlapping the enclosing one are cut off at its end
+        let end = match stack.last() {
+            Some(&(top_end, top_highlight)) => {
+                push(&mut res, pos, start, top_highlight);
+                end.min(top_end)
+            }
+            None => end,
+        };
+        pos = pos.max(start);
+        stack.push((end, highlight));
+    }
+
+    while let Some((top_end, top_highlight)) = stack.pop() {
+        push(&mut res, pos, top_end, top_highlight);
+        pos = pos.max(top_end);
+    }
+
+    res
+}
+
 #[pyclass]
 pub struct Highlighter {
-    highlighter: RwLock<hl::Highlighter>,
+    parser: Mutex<Parser>,
     recognized_names: Vec<String>,
-    configuration: RwLock<Option<hl::HighlightConfiguration>>,
+    configuration: RwLock<Option<Configuration>>,
+    document: Mutex<Document>,
 }
 #[derive(Debug)]
-struct HighlighterError {
+pub(crate) struct HighlighterError {
     message: String,
 }
 
@@ -46,91 +391,274 @@ impl std::convert::Into<PyErr> for HighlighterError {
         PyOSError::new_err(self.to_string())
     }
 }
+
+impl Highlighter {
+    // locks are only held for short, bounded pieces of work, so waiting for them is fine,
+    // they only fail if a thread panicked while holding them
+    fn lock_document(&self) -> PyResult<MutexGuard<'_, Document>> {
+        self.document
+            .lock()
+            .map_err(|_| HighlighterError::new("Could not lock on document".into()).into())
+    }
+
+    fn read_configuration(&self) -> PyResult<RwLockReadGuard<'_, Option<Configuration>>> {
+        self.configuration
+            .read()
+            .map_err(|_| HighlighterError::new("Could not lock on config".into()).into())
+    }
+
+    // spans of highlighted text inside of `range`, flattened and clamped to the range
+    fn spans(
+        &self,
+        config: &Configuration,
+        tree: &Tree,
+        source: &[u8],
+        range: &Range<usize>,
+    ) -> Vec<(usize, usize, usize)> {
+        let mut cursor = QueryCursor::new();
+        cursor.set_byte_range(range.clone());
+
+        let mut captures = cursor.captures(&config.grammar.query, tree.root_node(), source);
+        let mut spans: Vec<(usize, usize, usize)> = Vec::new();
+        let mut last_node = None;
+
+        while let Some((query_match, index)) = captures.next() {
+            let capture = query_match.captures[*index];
+
+            // like in tree-sitter-highlight the first pattern capturing a node decides its highlight
+            if last_node == Some(capture.node.id()) {
+                continue;
+            }
+            last_node = Some(capture.node.id());
+
+            let Some(highlight) = config.highlight_indices[capture.index as usize] else {
+                continue;
+            };
+
+            let start = capture.node.start_byte().max(range.start);
+            let end = capture.node.end_byte().min(range.end);
+            if start < end {
+                spans.push((start, end, highlight));
+            }
+        }
+
+        // enclosing spans have to come before the ones nested inside of them
+        spans.sort_by(|a, b| a.0.cmp(&b.0).then(b.1.cmp(&a.1)));
+        flatten(&spans)
+    }
+
+    fn events(&self, spans: &[(usize, usize, usize)]) -> Vec<HLEvent> {
+        let mut res: Vec<HLEvent> = Vec::with_capacity(spans.len() * 3);
+
+        for &(start, end, highlight) in spans {
+            res.push(HLEvent::Start(self.recognized_names[highlight].clone()));
+            res.push(HLEvent::Source(start, end));
+            res.push(HLEvent::End());
+        }
+        res
+    }
+
+    // spans of the lines `start` to `end`, end exclusive, based on the tree of the last update
+    // `split` decides whether they are returned as char offsets or split into lines
+    fn line_spans<T>(
+        &self,
+        start: usize,
+        end: usize,
+        split: impl FnOnce(&Document, Vec<(usize, usize, usize)>) -> Vec<T>,
+    ) -> PyResult<Vec<T>> {
+        // documents without a language are not highlighted
+        let config = self.read_configuration()?;
+        let Some(config) = config.as_ref() else {
+            return Ok(Vec::new());
+        };
+
+        let document = self.lock_document()?;
+        let Some(tree) = document.tree.as_ref() else {
+            return Ok(Vec::new());
+        };
+
+        let range = document.line_start(start)..document.line_start(end);
+        let spans = self.spans(config, tree, &document.source, &range);
+        Ok(split(&*document, spans))
+    }
+
+    fn parse(&self, source: &[u8], old_tree: Option<&Tree>) -> PyResult<Tree> {
+        let Ok(mut parser) = self.parser.lock() else {
+            return Err(HighlighterError::new("Could not lock on highlighter".into()).into());
+        };
+
+        match parser.parse(source, old_tree) {
+            Some(tree) => Ok(tree),
+            None => Err(HighlighterError::new("Error while parsing".into()).into()),
+        }
+    }
+}
+
+// all methods release the GIL while they work, so they can be called from worker threads
+// without blocking the GTK main loop and several documents can be highlighted in parallel
 #[pymethods]
 impl Highlighter {
     #[new]
     pub fn new(recognized_names: Vec<String>) -> Self {
         Self {
-            highlighter: RwLock::new(hl::Highlighter::new()),
+            parser: Mutex::new(Parser::new()),
             recognized_names,
             configuration: RwLock::new(None),
+            document: Mutex::new(Document::new()),
         }
     }
-    pub fn set_language(&self) -> PyResult<()> {
-        let lang = tree_sitter_python::LANGUAGE;
-        let mut config = match hl::HighlightConfiguration::new(
-            lang.into(),
-            "python",
-            tree_sitter_python::HIGHLIGHTS_QUERY,
-            "",
-            tree_sitter_python::TAGS_QUERY,
-        ) {
-            Ok(config) => config,
-            Err(e) => {
-                eprintln!("{e}");
-                return Err(
-                    HighlighterError::new("Could not create Highlighter Function".into()).into(),
-                );
+
+    /// sets the language of the document, its grammar is compiled on first use and shared with all other highlighters
+    #[pyo3(signature = (name = "python"))]
+    pub fn set_language(&self, py: Python<'_>, name: &str) -> PyResult<()> {
+        py.allow_threads(|| -> PyResult<()> {
+            let (grammar, _) = registry::grammar(name).map_err(|e| -> PyErr { e.into() })?;
+            let config = Configuration::new(grammar, &self.recognized_names);
+
+            {
+                let Ok(mut parser) = self.parser.lock() else {
+                    return Err(HighlighterError::new("Could not lock on highlighter".into()).into());
+                };
+                if let Err(e) = parser.set_language(&config.grammar.language) {
+                    eprintln!("{e}");
+                    return Err(HighlighterError::new("Could not set language".into()).into());
+                }
             }
-        };
 
-        config.configure(&self.recognized_names);
+            let Ok(mut c) = self.configuration.write() else {
+                return Err(HighlighterError::new("Could not lock on config".into()).into());
+            };
+            *c = Some(config);
 
-        let Ok(mut c) = self.configuration.try_write() else {
-            return Err(HighlighterError::new("Could not lock on config".into()).into());
-        };
-        *c = Some(config);
+            // the old tree belongs to the previous language
+            let mut document = self.lock_document()?;
+            document.tree = None;
+            document.revision += 1;
 
-        Ok(())
+            Ok(())
+        })
     }
-    pub fn highlight(&self, string: &str) -> PyResult<Vec<HLEvent>> {
-        let leading_white_space = string
-            .find(|c: char| !c.is_whitespace())
-            .unwrap_or(string.len());
 
-        let string = string.trim_start().trim_end();
-        let config = self.configuration.try_read();
-        let Ok(config) = config.as_ref() else {
-            return Err(HighlighterError::new("Could not lock on config".into()).into());
-        };
+    /// records an edit of the document, `start` and `old_end` are (line, byte in line) positions
+    /// in the text before the edit and `text` is the text inserted at `start`
+    pub fn edit(
+        &self,
+        py: Python<'_>,
+        start: (usize, usize),
+        old_end: (usize, usize),
+        text: &str,
+    ) -> PyResult<()> {
+        py.allow_threads(|| -> PyResult<()> {
+            self.lock_document()?.edit(start, old_end, text);
+            Ok(())
+        })
+    }
 
-        let Some(config) = config.as_ref() else {
-            return Err(HighlighterError::new("Could not lock on config".into()).into());
-        };
+    /// highlights the whole text from scratch, it replaces the document kept for incremental highlighting.
+    /// the offsets of the events are char offsets into the text
+    pub fn highlight(&self, py: Python<'_>, string: &str) -> PyResult<Vec<HLEvent>> {
+        py.allow_threads(|| -> PyResult<Vec<HLEvent>> {
+            let config = self.read_configuration()?;
+            let Some(config) = config.as_ref() else {
+                return Err(HighlighterError::new("No language set".into()).into());
+            };
 
-        let Ok(mut highligher) = self.highlighter.try_write() else {
-            return Err(HighlighterError::new("Could not lock on highlighter".into()).into());
-        };
+            let mut document = self.lock_document()?;
+            document.set_text(string);
+
+            let tree = self.parse(&document.source, None)?;
+            let spans = self.spans(config, &tree, &document.source, &(0..document.source.len()));
+            document.tree = Some(tree);
+
+            Ok(self.events(&document.char_offsets(&spans)))
+        })
+    }
 
-        let highlights = match highligher.highlight(config, string.as_bytes(), None, |_| None) {
-            Ok(hl) => hl,
-            Err(e) => {
-                eprintln!("{e}");
-                return Err(HighlighterError::new("Error while highlighting".into()).into());
+    /// reparses the document using the tree of the last update and returns the line ranges
+    /// `(start, end)`, end exclusive, whose highlighting may have changed since then.
+    /// parsing works on a snapshot of the text shared with the document, so edits can be made in the meantime,
+    /// in that case the result is outdated and `None` is returned instead.
+    /// without a language nothing is parsed and no lines are returned
+    pub fn update(&self, py: Python<'_>) -> PyResult<Option<Vec<(usize, usize)>>> {
+        py.allow_threads(|| -> PyResult<Option<Vec<(usize, usize)>>> {
+            if self.read_configuration()?.is_none() {
+                self.lock_document()?.edited.clear();
+                return Ok(Some(Vec::new()));
             }
-        };
 
-        let mut res: Vec<HLEvent> = Vec::new();
+            let (source, old_tree, revision) = {
+                let document = self.lock_document()?;
+                (Arc::clone(&document.source), document.tree.clone(), document.revision)
+            };
 
-        for event in highlights {
-            let Ok(event) = event else {
-                continue;
+            let tree = self.parse(&source, old_tree.as_ref())?;
+
+            let mut document = self.lock_document()?;
+            if document.revision != revision {
+                return Ok(None);
+            }
+
+            // without an old tree everything has changed, otherwise tree-sitter reports the ranges
+            // whose syntactical structure changed, the edited text itself is added on top of that
+            let mut ranges: Vec<Range<usize>> = match old_tree.as_ref() {
+                Some(old_tree) => old_tree
+                    .changed_ranges(&tree)
+                    .map(|r| r.start_byte..r.end_byte)
+                    .collect(),
+                None => vec![0..document.source.len()],
             };
+            ranges.append(&mut document.edited);
+            document.tree = Some(tree);
 
-            match event {
-                tree_sitter_highlight::HighlightEvent::Source { start, end } => res.push(
-                    HLEvent::Source(start + leading_white_space, end + leading_white_space),
-                ),
-                tree_sitter_highlight::HighlightEvent::HighlightStart(highlight) => {
-                    let hl_type = self.recognized_names.get(highlight.0);
-                    if let Some(hl_type) = hl_type {
-                        res.push(HLEvent::Start(hl_type.clone()));
-                    }
+            let ranges = merge_ranges(ranges.iter().map(|r| document.whole_lines(r)).collect());
+
+            Ok(Some(
+                ranges
+                    .iter()
+                    .map(|r| (document.point_at(r.start).row, document.line_end(r.end)))
+                    .collect(),
+            ))
+        })
+    }
+
+    /// returns the events for the lines `start` to `end`, end exclusive, based on the tree of the last update.
+    /// the offsets of the events are char offsets into the whole text
+    pub fn highlight_lines(
+        &self,
+        py: Python<'_>,
+        start: usize,
+        end: usize,
+    ) -> PyResult<Vec<HLEvent>> {
+        py.allow_threads(|| -> PyResult<Vec<HLEvent>> {
+            let spans = self.line_spans(start, end, |document, spans| {
+                document.char_offsets(&spans)
+            })?;
+            Ok(self.events(&spans))
+        })
+    }
+
+    /// like `highlight_lines` but returns the highlighted spans packed into native endian unsigned 32 bit integers,
+    /// four per span: line, start and end as char offset in the line and the index of the highlight in the recognized names.
+    /// spans crossing line ends are split into one span per line, they do not overlap, so they can be applied as they are
+    pub fn highlight_spans<'py>(
+        &self,
+        py: Python<'py>,
+        start: usize,
+        end: usize,
+    ) -> PyResult<Bound<'py, PyBytes>> {
+        let packed = py.allow_threads(|| -> PyResult<Vec<u8>> {
+            let spans = self.line_spans(start, end, |document, spans| {
+                document.split_lines(&spans)
+            })?;
+            let mut packed: Vec<u8> = Vec::with_capacity(spans.len() * 16);
+
+            for (line, start, end, highlight) in spans {
+                for value in [line, start, end, highlight] {
+                    packed.extend_from_slice(&(value as u32).to_ne_bytes());
                 }
-                tree_sitter_highlight::HighlightEvent::HighlightEnd => res.push(HLEvent::End()),
             }
-        }
-
-        Ok(res)
+            Ok(packed)
+        })?;
+        Ok(PyBytes::new(py, &packed))
     }
 }